@@ -1,36 +1,410 @@
 # app.py
 # Long Beach Demographic Dashboard (Excel-backed)
 
+import argparse
+import asyncio
+import base64
+import functools
+import gzip
+import hashlib
+import html
+import importlib
+import itertools
+import json
+import os
 import re
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from shiny import App, ui, render, reactive
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from shiny import App, ui, render, reactive, req
 from shinywidgets import output_widget, render_widget
 
+from measures import CHART_MEASURES, TREND_MEASURES, TrendMeasures, measure_choices
+from metrics import METRICS, SessionMetrics, instrument
+
+
+class _LazyModule:
+    """
+    Stands in for a module and imports it on first attribute access.
+
+    pandas, numpy and plotly take longer to import than shiny itself and
+    nothing needs them until a session asks for data, so the server can
+    start answering before they are loaded.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+np = _LazyModule("numpy")
+pd = _LazyModule("pandas")
+px = _LazyModule("plotly.express")
+go = _LazyModule("plotly.graph_objects")
+
 LB2023_XLSX          = "Long Beach 2023 Estimates - Copy.xlsx"
 RACE_BY_YEAR_XLSX    = "Long Beach race by year US Estimates - Copy.xlsx"
 RACE_ETH_2023_XLSX   = "Long Beach gen and total US Estimates - Copy.xlsx"
 ZIP_YEAR_XLSX        = "Long Beach zip and year Estimates - Copy.xlsx"
 ZIP_GENDER_AGE_XLSX  = "Long Beach zip gender year Estimates - Copy.xlsx"
+CT2021_XLSX          = "Long Beach CT 2021 Estimates - Copy.xlsx"
+
+LB2023_SHEET         = "Long Beach (2023)"
+RACE_ETH_SHEET       = "Race_Ethnicity (2023)"
+RACE_BY_YEAR_SHEET   = "RACE BY YEAR"
+GEN_BY_YEAR_SHEET    = "GEN AND TOTAL BY YEAR"
+ZIP_YEAR_SHEET       = "Zip and Year"
+ZIP_GENDER_AGE_SHEET = "Zip, Gender, Age by Year"
+CT2021_SHEET         = "CT 2021"
+
+
+def _file_signature(path):
+    """(mtime, size) of a workbook, or None if the file is missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+_GRID_CACHE = {}  # (path, sheet) -> (signature, DataFrame, AnchorIndex)
+_GRID_LOCKS = {}
+_GRID_LOCKS_GUARD = threading.Lock()
+
+
+def _parse_sheet(path, sheet):
+    """
+    Stream one worksheet with openpyxl (read_only) into a raw grid that
+    matches pd.read_excel(path, sheet_name=sheet, header=None): absolute
+    0-based row/column positions, NaN for empty cells, trailing blank rows
+    and columns trimmed.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = [list(r) for r in wb[sheet].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+    while rows and all(v is None for v in rows[-1]):
+        rows.pop()
+    width = max((i + 1 for r in rows for i, v in enumerate(r) if v is not None), default=0)
+    grid = pd.DataFrame([r[:width] for r in rows], columns=range(width))
+    grid = grid.infer_objects()
+    return grid.where(grid.notna(), float("nan"))
+
+
+def _anchor_key(label):
+    # Labels in the workbooks carry non-breaking-space indents, trailing
+    # blanks ("Year 2020 ") and mixed case ("TOTAL" / "Total").
+    return " ".join(str(label).split()).casefold()
+
+
+class YearTable:
+    """
+    A table with one column per year, as found by AnchorIndex.year_tables():
+    `labels` down its label column, `years` (ascending) across its header
+    row and values[label, year], NaN where a cell is blank or not a number.
+    """
+
+    def __init__(self, title, row, labels, years, values):
+        self.title = title
+        self.row = row
+        self.labels = labels
+        self.years = years
+        self.values = values
+
+    def frame(self, rows=None, **columns):
+        """
+        Long frame, one row per (table row, year): the `columns` given (a
+        label for the whole table or an array with one per table row), then
+        Year and Population. `rows` picks table rows by position.
+        """
+        values = self.values if rows is None else self.values[rows]
+        n, m = values.shape
+        df = pd.DataFrame(index=pd.RangeIndex(n * m))
+        for name, value in columns.items():
+            value = np.asarray(value, dtype=object)
+            if value.ndim:
+                # One label per table row, repeated for each of its years.
+                if rows is not None:
+                    value = value[rows]
+                value = np.repeat(value, m)
+            df[name] = value
+        df["Year"] = np.tile(self.years, n)
+        df["Population"] = values.ravel()
+        return df
+
+
+class AnchorIndex:
+    """
+    Every text label in a sheet mapped to the (row, col) cells that hold
+    it, built in a single pass over the grid. Loaders resolve their tables
+    from these anchors instead of hard-coded row offsets.
+
+    numbers() and year_tables() are computed on first use and kept with
+    the index, so every loader reading the sheet shares them.
+    """
+
+    def __init__(self, grid):
+        self._grid = grid
+        self._cells = {}
+        for (r, c), v in np.ndenumerate(grid.to_numpy(dtype=object)):
+            if isinstance(v, str) and v.strip():
+                self._cells.setdefault(_anchor_key(v), []).append((r, c))
+        self._patterns = {}
+        self._numbers = None
+        self._year_tables = None
+
+    def cells(self, label):
+        """All (row, col) cells holding `label`, in reading order."""
+        return self._cells.get(_anchor_key(label), [])
+
+    def find(self, label, col=None, below=-1):
+        """First cell holding `label` (optionally in `col`) below row `below`."""
+        for r, c in self.cells(label):
+            if r > below and (col is None or c == col):
+                return r, c
+        raise KeyError(f"anchor {label!r} not found")
+
+    def matching(self, pattern):
+        """
+        [(match, row, col)] for every label fully matching the regex
+        `pattern` (applied to the normalised label), in reading order.
+        """
+        if pattern not in self._patterns:
+            rx = re.compile(pattern)
+            hits = []
+            for key, cells in self._cells.items():
+                m = rx.fullmatch(key)
+                if m:
+                    hits.extend((m, r, c) for r, c in cells)
+            self._patterns[pattern] = sorted(hits, key=lambda h: (h[1], h[2]))
+        return self._patterns[pattern]
+
+    def years(self, col=0):
+        """{year: row} for the "Year YYYY" block markers in `col`."""
+        return {int(m.group(1)): r for m, r, c in self.matching(r"year (\d{4})") if c == col}
+
+    def numbers(self):
+        """The grid as a float array, NaN wherever a cell is not a number."""
+        if self._numbers is None:
+            self._numbers = self._grid.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+        return self._numbers
+
+    def year_tables(self):
+        """
+        Every table with one column per year, in reading order. A run of two
+        or more consecutive years across a row heads each one; its labels
+        are in the column left of the first year, down to the first blank,
+        and its title is the label in the header row or else the one just
+        above it. A header needs text labels below it and no numbers right
+        above its years, so a row of counts that happens to run 2015, 2016,
+        ... inside a table is not taken for one. Years are found for the whole grid at once and each table
+        is cut out with one slice, so a sheet with more years or more
+        tables costs no extra Python per cell.
+        """
+        if self._year_tables is not None:
+            return self._year_tables
+        cells = self._grid.to_numpy(dtype=object)
+        nums = self.numbers()
+        # Year header cells: whole numbers 1900-2099, or labels like "LB 2023".
+        found = (nums >= 1900) & (nums < 2100) & (nums == np.round(nums))
+        years = np.where(found, nums, np.nan)
+        for m, r, c in self.matching(r"lb ((?:19|20)\d\d)"):
+            years[r, c], found[r, c] = int(m.group(1)), True
+        # joined[r, c]: the cell continues the year run of its left neighbour.
+        joined = np.zeros_like(found)
+        joined[:, 1:] = np.abs(np.diff(years, axis=1)) == 1
+        ends = found & ~np.concatenate([joined[:, 1:], np.zeros((len(found), 1), dtype=bool)], axis=1)
+        tables = []
+        for (row, first), (_, last) in zip(zip(*np.nonzero(found & ~joined)), zip(*np.nonzero(ends))):
+            if last == first or first == 0:
+                continue
+            if row and not np.isnan(nums[row - 1, first : last + 1]).all():
+                continue
+            col = first - 1
+            body = slice(row + 1, row + 1 + block_length(self._grid, row + 1, col))
+            if not all(isinstance(v, str) for v in cells[body, col]):
+                continue
+            title = next((v.strip() for v in cells[row::-1, col][:2] if isinstance(v, str) and v.strip()), None)
+            order = np.argsort(years[row, first : last + 1])
+            tables.append(
+                YearTable(
+                    title, row,
+                    [str(v).strip() for v in cells[body, col]],
+                    years[row, first : last + 1][order].astype(int),
+                    nums[body, first : last + 1][:, order],
+                )
+            )
+        self._year_tables = tables
+        return tables
+
+    def year_table(self, title, first=None):
+        """
+        The first of the year_tables() titled `title`, or, given `first`,
+        the one whose first row is labelled `first`.
+        """
+        for t in self.year_tables():
+            if t.title is None or _anchor_key(t.title) != _anchor_key(title):
+                continue
+            if first is None or (t.labels and _anchor_key(t.labels[0]) == _anchor_key(first)):
+                return t
+        raise KeyError(f"year table {title!r} not found" + (f" starting with {first!r}" if first else ""))
+
+
+def _load_sheet(path, sheet):
+    key = (path, sheet)
+    with _GRID_LOCKS_GUARD:
+        lock = _GRID_LOCKS.setdefault(key, threading.Lock())
+    with lock:
+        sig = _file_signature(path)
+        cached = _GRID_CACHE.get(key)
+        if cached is not None and cached[0] == sig:
+            return cached[1], cached[2]
+        grid = _parse_sheet(path, sheet)
+        index = AnchorIndex(grid)
+        _GRID_CACHE[key] = (sig, grid, index)
+        return grid, index
+
+
+def read_sheet(path, sheet):
+    """
+    Raw grid (header=None) for one sheet, parsed at most once per version of
+    the workbook and shared by every loader that reads that sheet.
+    The grid is shared: slice or copy it, never modify it in place.
+    """
+    return _load_sheet(path, sheet)[0]
+
+
+def sheet_anchors(path, sheet):
+    """AnchorIndex for one sheet, cached together with its grid."""
+    return _load_sheet(path, sheet)[1]
+
+
+def sheet_table(grid, header, nrows=None, usecols=None):
+    """
+    Slice a table out of a raw grid the way
+    pd.read_excel(..., header=header, nrows=nrows, usecols=usecols) would:
+    the header row supplies column names and blank rows are skipped.
+    """
+    stop = None if nrows is None else header + 1 + nrows
+    body = grid.iloc[header + 1 : stop]
+    names = grid.iloc[header]
+    if usecols is not None:
+        body = body.iloc[:, usecols]
+        names = names.iloc[usecols]
+    df = body.dropna(how="all").copy()
+    df.columns = [
+        f"Unnamed: {c}" if pd.isna(v) else (v.strip() if isinstance(v, str) else v)
+        for c, v in names.items()
+    ]
+    return df.reset_index(drop=True).infer_objects()
+
+
+def block_length(grid, start, col):
+    """Number of consecutive non-blank cells in `col` from row `start` down."""
+    filled = grid.iloc[start:, col].notna().to_numpy()
+    return int(filled.argmin()) if not filled.all() else len(filled)
+
+
+def _tract_label(value):
+    """
+    'Tract 5440.02' for the six-digit tract code 544002 / 544002.0 /
+    '544002' ('Tract 5771' for 577100), else None.
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    if not re.fullmatch(r"\d{6}", text):
+        return None
+    number, suffix = text[:4].lstrip("0") or "0", text[4:]
+    return f"Tract {number}" if suffix == "00" else f"Tract {number}.{suffix}"
+
+
+def _zip_code(value):
+    """'90802' for 90802 / 90802.0 / '90802', else None."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text if re.fullmatch(r"\d{5}", text) else None
+
+
+ZIP_CODES_LABEL = [
+    "ZIP 90802",
+    "ZIP 90803",
+    "ZIP 90804",
+    "ZIP 90805",
+    "ZIP 90806",
+    "ZIP 90807",
+    "ZIP 90808",
+    "ZIP 90810",
+    "ZIP 90813",
+    "ZIP 90814",
+    "ZIP 90815",
+]
+# Selected in the ZIP trend chart when the dashboard opens.
+DEFAULT_ZIPS = ["ZIP 90805", "ZIP 90814"]
+
+GENDERS = ("Male", "Female", "Total")
+
+# Columns every tidy table shares. Dimensions are ordered Categoricals with
+# a fixed category list, so filters, group-bys and sorts run on integer
+# codes and charts get the same order everywhere; years are int16 and
+# counts int32.
+COUNT_COLUMNS = ("Population", "Total")
+
+
+def tidy(df, **categories):
+    """
+    Apply the shared schema to a loader's frame:
+
+    - "ZIP Code" takes ZIP_CODES_LABEL order (any other ZIP found in the
+      sheet goes after it), "Gender" takes GENDERS order;
+    - "Age Group", "Race/Ethnicity" and any column named in `categories`
+      take the order given there, or else sheet (first appearance) order;
+    - "Year" becomes int16 and the count columns int32.
+
+    Rows with a missing count must already be dropped.
+    """
+    df = df.reset_index(drop=True)
+    fixed = {"ZIP Code": ZIP_CODES_LABEL, "Gender": GENDERS}
+    for col in df.columns:
+        if col in COUNT_COLUMNS:
+            df[col] = df[col].astype("int32")
+        elif col == "Year":
+            df[col] = df[col].astype("int16")
+        elif col in categories or col in fixed or col in ("Age Group", "Race/Ethnicity"):
+            values = df[col].astype(str)
+            order = list(categories.get(col, fixed.get(col, ())))
+            known = set(order)
+            order += [v for v in pd.unique(values) if v not in known]
+            df[col] = pd.Categorical(values, categories=order, ordered=True)
+    return df
+
 
 def load_population_trend():
     """
     Sheet: Long Beach (2023)
-    Header row: 98 (Year | Total | Male | Female)
-    13 rows for 2011–2023
+    Table under the "Year" anchor (Year | Total | Male | Female),
+    one row per year (2011–2023) down to the first blank row.
     """
     try:
-        df = pd.read_excel(
-            LB2023_XLSX,
-            sheet_name="Long Beach (2023)",
-            header=98,
-            nrows=13,
-            usecols=[0, 1],  # Year, Total
+        grid = read_sheet(LB2023_XLSX, LB2023_SHEET)
+        header, col = sheet_anchors(LB2023_XLSX, LB2023_SHEET).find("Year", col=0)
+        df = sheet_table(
+            grid,
+            header=header,
+            nrows=block_length(grid, header + 1, col),
+            usecols=[col, col + 1],  # Year, Total
         ).dropna()
-        df["Year"] = df["Year"].astype(int)
-        df["Total"] = pd.to_numeric(df["Total"]).astype(int)
-        return df
+        df["Total"] = pd.to_numeric(df["Total"])
+        return tidy(df)
     except Exception as e:
         print("load_population_trend:", e)
         return pd.DataFrame(columns=["Year", "Total"])
@@ -39,24 +413,24 @@ def load_population_trend():
 def load_zip_population_2023():
     """
     Sheet: Long Beach (2023)
-    Header row: 113 (Zip Code | LB 2023)
-    11 ZIP rows (+ sometimes a total row—drop it)
+    Table under the "Zip Code" anchor (Zip Code | LB 2023), 11 ZIP rows
+    (+ sometimes a total row—drop it)
     """
     try:
-        df = pd.read_excel(
-            LB2023_XLSX,
-            sheet_name="Long Beach (2023)",
-            header=113,
-            nrows=12,
-            usecols=[0, 1],
+        grid = read_sheet(LB2023_XLSX, LB2023_SHEET)
+        header, col = sheet_anchors(LB2023_XLSX, LB2023_SHEET).find("Zip Code", col=0)
+        df = sheet_table(
+            grid,
+            header=header,
+            nrows=block_length(grid, header + 1, col),
+            usecols=[col, col + 1],
         ).dropna()
         df.columns = ["ZIP Code", "Population"]
         zips = df["ZIP Code"].astype(str).str.extract(r"(\d{5})")[0]
         df = df[zips.notna()].copy()
         df["ZIP Code"] = "ZIP " + zips
         df["Population"] = pd.to_numeric(df["Population"], errors="coerce")
-        df = df.dropna()
-        return df
+        return tidy(df.dropna())
     except Exception as e:
         print("load_zip_population_2023:", e)
         return pd.DataFrame(columns=["ZIP Code", "Population"])
@@ -65,16 +439,19 @@ def load_zip_population_2023():
 def load_population_pyramid_2023():
     """
     Sheet: Long Beach (2023)
-    Header row: 50 (Age Group | Male | Female | Total)
+    Table under the "2023 5-Year Estimates" anchor (Age Group | Male | Female | Total)
     Drop the 'Total' summary row. Make male negative for a population pyramid.
     """
     try:
-        df = pd.read_excel(
-            LB2023_XLSX,
-            sheet_name="Long Beach (2023)",
-            header=50,
-            usecols=[0, 1, 2],
-            nrows=20,  
+        grid = read_sheet(LB2023_XLSX, LB2023_SHEET)
+        _, header, col = sheet_anchors(LB2023_XLSX, LB2023_SHEET).matching(
+            r"2023 5-year estimates"
+        )[0]
+        df = sheet_table(
+            grid,
+            header=header,
+            usecols=[col, col + 1, col + 2],
+            nrows=block_length(grid, header + 1, col),
         )
         df.columns = ["Age Group", "Male", "Female"]
         df = df[df["Age Group"].astype(str).str.lower() != "total"].copy()
@@ -87,34 +464,28 @@ def load_population_pyramid_2023():
             var_name="Gender",
             value_name="Population",
         ).dropna()
-        return out
+        return tidy(out)
     except Exception as e:
         print("load_population_pyramid_2023:", e)
         return pd.DataFrame(columns=["Age Group", "Gender", "Population"])
 
 
+# First row of the "Age Cat1" table load_age_group_trends() reads.
+AGE_TRENDS_FIRST_BAND = "<20"
+
+
 def load_age_group_trends():
     """
     Sheet: Long Beach (2023)
-    Header row: 14 (Age Cat1 | LB 2023 | LB 2022 | LB 2021 | LB 2020 | LB 2019)
+    The "Age Cat1" year table whose first row is "<20"
+    (Age Cat1 | LB 2023 | LB 2022 | ...), every year it has.
     """
     try:
-        df = pd.read_excel(
-            LB2023_XLSX,
-            sheet_name="Long Beach (2023)",
-            header=14,
-            nrows=8,
-        )
-        df = df[
-            ["Age Cat1", "LB 2023", "LB 2022", "LB 2021", "LB 2020", "LB 2019"]
-        ].copy()
-        df.columns = ["Age Group", "2023", "2022", "2021", "2020", "2019"]
-        out = df.melt(
-            id_vars="Age Group", var_name="Year", value_name="Population"
-        )
-        out["Population"] = pd.to_numeric(out["Population"], errors="coerce")
-        out = out.dropna()
-        return out
+        # The sheet has two "Age Cat1" tables with the same header row; this
+        # chart uses the one in ten-year bands (<20, 20-29, ... 80+), picked
+        # by its first band rather than by position.
+        table = sheet_anchors(LB2023_XLSX, LB2023_SHEET).year_table("Age Cat1", first=AGE_TRENDS_FIRST_BAND)
+        return tidy(table.frame(**{"Age Group": table.labels}).dropna())
     except Exception as e:
         print("load_age_group_trends:", e)
         return pd.DataFrame(columns=["Age Group", "Year", "Population"])
@@ -123,16 +494,13 @@ def load_age_group_trends():
 def load_race_2023():
     """
     Sheet: Race_Ethnicity (2023)
-    TOTAL row at absolute row index 40 (0-based in pandas after header=None).
+    Row of the "TOTAL" anchor in column 0.
     Columns 1..5 are: Hispanic, White, Asian, Black, NHPI.
     """
     try:
-        base = pd.read_excel(
-            RACE_ETH_2023_XLSX,
-            sheet_name="Race_Ethnicity (2023)",
-            header=None,
-        )
-        totals = base.iloc[40, 1:6].tolist() 
+        base = read_sheet(RACE_ETH_2023_XLSX, RACE_ETH_SHEET)
+        row, _ = sheet_anchors(RACE_ETH_2023_XLSX, RACE_ETH_SHEET).find("TOTAL", col=0)
+        totals = base.iloc[row, 1:6].tolist()
         labels = [
             "Hispanic or Latino",
             "White (Not Hispanic)",
@@ -142,57 +510,102 @@ def load_race_2023():
         ]
         df = pd.DataFrame({"Race/Ethnicity": labels, "Population": totals})
         df["Population"] = pd.to_numeric(df["Population"], errors="coerce")
-        return df.dropna()
+        return tidy(df.dropna())
     except Exception as e:
         print("load_race_2023:", e)
         return pd.DataFrame(columns=["Race/Ethnicity", "Population"])
 
 
+# Race block titles in the RACE BY YEAR sheet that are not simply
+# title-cased to get the label the charts use.
+RACE_BLOCK_LABELS = {"hispanic/latino": "Hispanic"}
+
+
+def gender_sections(labels):
+    """
+    (gender, age group) of each row of a table laid out as a "Total:" row,
+    then "Male:" and "Female:" rows each followed by their age rows. Rows
+    before the first section count as "Total"; section rows themselves have
+    age group None.
+    """
+    labels = pd.Series(labels, dtype=object)
+    section = labels.str.endswith(":")
+    gender = labels.where(section).str.rstrip(":").str.strip().str.title().ffill().fillna("Total")
+    return gender.to_numpy(dtype=object), labels.where(~section).to_numpy(dtype=object)
+
+
+def _race_year_blocks():
+    """[(race label, YearTable)] for every race block of the RACE BY YEAR sheet."""
+    tables = sheet_anchors(RACE_BY_YEAR_XLSX, RACE_BY_YEAR_SHEET).year_tables()
+    return [
+        (RACE_BLOCK_LABELS.get(_anchor_key(t.title), t.title.title()), t)
+        for t in tables
+        if t.labels and _anchor_key(t.labels[0]) == "total:"
+    ]
+
+
 def load_race_trends():
     """
     Sheet: RACE BY YEAR
-    Totals row for each race is at absolute row index 2 (header=None).
-    Blocks by columns:
-      Hispanic: 1..7, White: 9..15, Asian: 17..23, Black: 25..31
+    One block per race side by side, each a year table whose first row
+    ("Total:") holds the race's totals. Every block and year in the sheet.
     """
     try:
-        row = pd.read_excel(
-            RACE_BY_YEAR_XLSX, sheet_name="RACE BY YEAR", header=None
-        ).iloc[2]
-        years = [str(y) for y in range(2017, 2024)]
-        blocks = {
-            "Hispanic": row[1:8].tolist(),
-            "White": row[9:16].tolist(),
-            "Asian": row[17:24].tolist(),
-            "Black": row[25:32].tolist(),
-        }
-        out = []
-        for race, vals in blocks.items():
-            for y, v in zip(years, vals):
-                out.append({"Year": y, "Race/Ethnicity": race, "Population": v})
-        df = pd.DataFrame(out)
-        df["Population"] = pd.to_numeric(df["Population"], errors="coerce")
-        return df.dropna()
+        frames = [t.frame(rows=[0], **{"Race/Ethnicity": race}) for race, t in _race_year_blocks()]
+        df = pd.concat(frames, ignore_index=True)[["Year", "Race/Ethnicity", "Population"]]
+        return tidy(df.dropna())
     except Exception as e:
         print("load_race_trends:", e)
-        return pd.DataFrame(columns=["Year", "Race/Ethnicity", "Population"])
+        return pd.DataFrame(columns=["Race/Ethnicity", "Year", "Population"])
+
+
+def load_race_gender_age_trends():
+    """
+    Sheet: RACE BY YEAR
+    The same race blocks as load_race_trends(), down to their "Male:" and
+    "Female:" age rows: race x gender x age group x year.
+    """
+    try:
+        frames = []
+        for race, t in _race_year_blocks():
+            gender, age = gender_sections(t.labels)
+            rows = np.nonzero(pd.notna(age) & np.isin(gender, ["Male", "Female"]))[0]
+            frames.append(t.frame(rows=rows, **{"Race/Ethnicity": race, "Gender": gender, "Age Group": age}))
+        return tidy(pd.concat(frames, ignore_index=True).dropna())
+    except Exception as e:
+        print("load_race_gender_age_trends:", e)
+        return pd.DataFrame(columns=["Race/Ethnicity", "Gender", "Age Group", "Year", "Population"])
+
+
+def load_gender_age_trends():
+    """
+    Sheet: GEN AND TOTAL BY YEAR
+    The first "TOTAL" year table: the city's "Male:" and "Female:" age rows,
+    gender x age group x year.
+    """
+    try:
+        t = sheet_anchors(RACE_ETH_2023_XLSX, GEN_BY_YEAR_SHEET).year_table("TOTAL")
+        gender, age = gender_sections(t.labels)
+        rows = np.nonzero(pd.notna(age) & np.isin(gender, ["Male", "Female"]))[0]
+        return tidy(t.frame(rows=rows, **{"Gender": gender, "Age Group": age}).dropna())
+    except Exception as e:
+        print("load_gender_age_trends:", e)
+        return pd.DataFrame(columns=["Gender", "Age Group", "Year", "Population"])
 
 
 def load_race_age_dist_2023():
     """
     Sheet: Race_Ethnicity (2023)
-    Compact Age x Race block starts at absolute row 58 (no header).
-    5 rows of ages, columns: Age | Hispanic | White | Asian | Black
+    Compact Age x Race block: the rows between the first "TOTAL AGE GROUPS"
+    anchor and the "TOTAL SUM" row below it (no header).
+    Columns: Age | Hispanic | White | Asian | Black
     """
     try:
-        df = pd.read_excel(
-            RACE_ETH_2023_XLSX,
-            sheet_name="Race_Ethnicity (2023)",
-            header=None,
-            skiprows=58,
-            nrows=5,
-            usecols=[0, 1, 2, 3, 4],
-        )
+        anchors = sheet_anchors(RACE_ETH_2023_XLSX, RACE_ETH_SHEET)
+        start, _ = anchors.find("TOTAL AGE GROUPS", col=0)
+        stop, _ = anchors.find("TOTAL SUM", col=0, below=start)
+        base = read_sheet(RACE_ETH_2023_XLSX, RACE_ETH_SHEET)
+        df = base.iloc[start + 1 : stop, 0:5].copy()
         df.columns = ["Age Group", "Hispanic", "White", "Asian", "Black"]
         melted = df.melt(
             id_vars="Age Group",
@@ -200,7 +613,7 @@ def load_race_age_dist_2023():
             value_name="Population",
         )
         melted["Population"] = pd.to_numeric(melted["Population"], errors="coerce")
-        return melted.dropna()
+        return tidy(melted.dropna())
     except Exception as e:
         print("load_race_age_dist_2023:", e)
         return pd.DataFrame(columns=["Age Group", "Race/Ethnicity", "Population"])
@@ -209,367 +622,2653 @@ def load_race_age_dist_2023():
 def load_race_gender_2023():
     """
     Sheet: Race_Ethnicity (2023)
-    Male TOTAL row at 83, Female TOTAL row at 93 (header=None).
+    Male / Female TOTAL rows: the first "TOTAL SUM" below the "Male" and
+    "Female" anchors in column 0.
     Columns 1..5 map to: Hispanic, White, Asian, Black, NHPI.
     """
     try:
-        base = pd.read_excel(
-            RACE_ETH_2023_XLSX, sheet_name="Race_Ethnicity (2023)", header=None
-        )
-        male = base.iloc[83, 1:6].tolist()
-        female = base.iloc[93, 1:6].tolist()
+        anchors = sheet_anchors(RACE_ETH_2023_XLSX, RACE_ETH_SHEET)
+        base = read_sheet(RACE_ETH_2023_XLSX, RACE_ETH_SHEET)
+        totals = {}
+        for gender in ["Male", "Female"]:
+            start, _ = anchors.find(gender, col=0)
+            row, _ = anchors.find("TOTAL SUM", col=0, below=start)
+            totals[gender] = base.iloc[row, 1:6].tolist()
         races = ["Hispanic", "White", "Asian", "Black", "NHPI"]
         df_m = pd.DataFrame(
-            {"Race/Ethnicity": races, "Gender": "Male", "Population": male}
+            {"Race/Ethnicity": races, "Gender": "Male", "Population": totals["Male"]}
         )
         df_f = pd.DataFrame(
-            {"Race/Ethnicity": races, "Gender": "Female", "Population": female}
+            {"Race/Ethnicity": races, "Gender": "Female", "Population": totals["Female"]}
         )
         df = pd.concat([df_m, df_f], ignore_index=True)
         df["Population"] = pd.to_numeric(df["Population"], errors="coerce")
-        return df.dropna()
+        return tidy(df.dropna())
     except Exception as e:
         print("load_race_gender_2023:", e)
         return pd.DataFrame(columns=["Race/Ethnicity", "Gender", "Population"])
 
 
+def _zip_labels(cells):
+    """'ZIP 90802' for every cell of an array holding a ZIP code (90802 / 90802.0 / '90802'), else None."""
+    text = pd.Series(np.asarray(cells, dtype=object).ravel()).astype(str).str.strip()
+    zips = "ZIP " + text.str.extract(r"^(\d{5})(?:\.0)?$")[0]
+    return zips.to_numpy(dtype=object).reshape(np.shape(cells))
+
+
 def load_zip_trends():
     """
     Sheet: Zip and Year
-    Year blocks begin at these absolute row indices (header=None):
-      2016:2, 2017:40, 2018:77, 2019:115, 2020:153, 2021:191, 2022:229, 2023:266
-    For each block: header with zips at start+2; 'Total' row holds the counts.
+    One block per "Year YYYY" anchor. In each block the first "Total" row
+    holds the counts and the row above it lists the ZIP codes. Every block
+    is read at once: one array of ZIP labels and one of counts, [block, col].
     """
     try:
-        raw = pd.read_excel(ZIP_YEAR_XLSX, sheet_name="Zip and Year", header=None)
-        year_rows = {
-            2016: 2,
-            2017: 40,
-            2018: 77,
-            2019: 115,
-            2020: 153,
-            2021: 191,
-            2022: 229,
-            2023: 266,
-        }
-        out = []
-        for year, start in year_rows.items():
-            zips = raw.iloc[start + 2, 1:12].astype(str).tolist()
-            block = raw.iloc[start : start + 25, :]
-            total_rel_idx = block[0].astype(str).str.fullmatch("Total", na=False)
-            if not total_rel_idx.any():
-                continue
-            total_row = block[total_rel_idx].index[0]
-            vals = raw.iloc[total_row, 1:12].tolist()
-            for z, v in zip(zips, vals):
-                if re.fullmatch(r"\d{5}", str(z)):
-                    out.append({"ZIP Code": f"ZIP {z}", "Population": v, "Year": year})
-        df = pd.DataFrame(out)
-        df["Population"] = pd.to_numeric(df["Population"], errors="coerce")
-        return df.dropna()
+        raw = read_sheet(ZIP_YEAR_XLSX, ZIP_YEAR_SHEET)
+        anchors = sheet_anchors(ZIP_YEAR_XLSX, ZIP_YEAR_SHEET)
+        years = anchors.years()
+        total_rows = np.array([anchors.find("Total", col=0, below=start)[0] for start in years.values()])
+        zips = _zip_labels(raw.iloc[total_rows - 1, 1:].to_numpy())
+        counts = anchors.numbers()[total_rows, 1:]
+        # Each block's ZIP columns run from column 1 to the first blank;
+        # anything further right (a lookup list in 2016) is not data.
+        block, col = np.nonzero(np.cumprod(pd.notna(zips), axis=1))
+        df = pd.DataFrame(
+            {
+                "ZIP Code": zips[block, col],
+                "Population": counts[block, col],
+                "Year": np.array(list(years))[block],
+            }
+        )
+        return tidy(df.dropna())
     except Exception as e:
         print("load_zip_trends:", e)
         return pd.DataFrame(columns=["ZIP Code", "Population", "Year"])
 
 
-def load_zip_age_dist_2023():
+class ZipCube:
+    """
+    Population counts from the "Zip, Gender, Age by Year" sheet as one dense
+    array, values[zip, year, age, gender], with a label Index per axis.
+
+    sel() indexes with labels and returns views of `values`, so the
+    Geographic tab can switch year or gender without reparsing the sheet or
+    rebuilding frames. Missing cells are NaN. CUBES keeps one cube per
+    dataset version.
+    """
+
+    COLUMNS = ("ZIP Code", "Year", "Age Group", "Gender")
+    GENDERS = GENDERS
+
+    def __init__(self, values, zips, years, ages, genders):
+        self.values = values
+        self.zips = pd.Index(np.asarray(zips))
+        self.years = pd.Index(np.asarray(years))
+        self.ages = pd.Index(np.asarray(ages))
+        self.genders = pd.Index(np.asarray(genders))
+
+    @property
+    def axes(self):
+        return (self.zips, self.years, self.ages, self.genders)
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Inverse of to_frame(): the Population column as floats (missing
+        cells become NaN), reshaped to the cube. The conversion from Int32
+        copies the column, so use CUBES rather than calling this per use.
+        """
+        labels = [pd.unique(df[col]) for col in cls.COLUMNS]
+        shape = tuple(len(l) for l in labels)
+        values = df["Population"].to_numpy(dtype=float, na_value=np.nan).reshape(shape)
+        return cls(values, *labels)
+
+    def to_frame(self):
+        """
+        Long frame, one row per cell in C order (zip, year, age, gender),
+        in the tidy() schema: label columns are ordered Categoricals with
+        the axis order as categories, Year is int16. Population is the
+        nullable Int32, as a cell can be missing and every row has to stay
+        for from_frame().
+        """
+        index = pd.MultiIndex.from_product(self.axes, names=self.COLUMNS)
+        df = index.to_frame(index=False)
+        for col, axis in zip(self.COLUMNS, self.axes):
+            if col == "Year":
+                df[col] = df[col].astype("int16")
+            else:
+                df[col] = pd.Categorical(df[col], categories=axis, ordered=True)
+        df["Population"] = pd.array(self.values.ravel(), dtype="Int32")
+        return df
+
+    def sel(self, zip_code=None, year=None, age=None, gender=None):
+        """
+        Slice by label. A label drops that axis, None keeps all of it. Only
+        basic indexing is used, so the result is a view, never a copy.
+        """
+        key = tuple(
+            slice(None) if label is None else axis.get_loc(label)
+            for axis, label in zip(self.axes, (zip_code, year, age, gender))
+        )
+        return self.values[key]
+
+    def age_frame(self, year, gender="Total"):
+        """(Age Group, ZIP Code, Population) rows for one year and gender."""
+        counts = self.sel(year=year, gender=gender)  # (zip, age)
+        df = pd.DataFrame(
+            {
+                "Age Group": np.repeat(self.ages, len(self.zips)),
+                "ZIP Code": np.tile(self.zips, len(self.ages)),
+                "Population": counts.T.ravel(),
+            }
+        )
+        return df.dropna()
+
+
+def load_zip_gender_age():
     """
     Sheet: Zip, Gender, Age by Year
-    Find the 'Year 2023' marker, then for each ZIP take its 'Total' column
-    across the standard age rows.
+    Every "Year YYYY" block: a ZIP row (each ZIP over its Male | Female |
+    Total columns), the gender header row, a 'Total' row, then the age rows.
+    The whole sheet goes into one ZipCube; the frame returned is in cube
+    order so ZipCube.from_frame() can rebuild it with a reshape.
     """
     try:
-        raw = pd.read_excel(
-            ZIP_GENDER_AGE_XLSX, sheet_name="Zip, Gender, Age by Year", header=None
+        raw = read_sheet(ZIP_GENDER_AGE_XLSX, ZIP_GENDER_AGE_SHEET)
+        anchors = sheet_anchors(ZIP_GENDER_AGE_XLSX, ZIP_GENDER_AGE_SHEET)
+        nums = anchors.numbers()
+
+        blocks = []
+        for year, start in anchors.years().items():
+            total_row, _ = anchors.find("Total", col=0, below=start)
+            headers = raw.iloc[total_row - 1].astype(str).str.strip().str.casefold().to_numpy()
+            labels = _zip_labels(raw.iloc[total_row - 2].to_numpy())
+            zip_cols = np.nonzero(pd.notna(labels))[0]
+            # Male | Female | Total columns: the first of each at or right of the ZIP label.
+            gender_cols = []
+            for g in ("male", "female", "total"):
+                at = np.nonzero(headers == g)[0]
+                gender_cols.append(at[np.searchsorted(at, zip_cols)])
+            cols = dict(zip(labels[zip_cols], np.column_stack(gender_cols).tolist()))
+            first = total_row + 1
+            rows = np.arange(first, first + block_length(raw, first, 0))
+            ages = [str(a).strip() for a in raw.iloc[rows, 0]]
+            blocks.append((year, rows, ages, cols))
+
+        zips = list(dict.fromkeys(z for *_, cols in blocks for z in cols))
+        # ZIP_CODES_LABEL order first, as tidy() would.
+        zips.sort(key=lambda z: ZIP_CODES_LABEL.index(z) if z in ZIP_CODES_LABEL else len(ZIP_CODES_LABEL))
+        ages = list(dict.fromkeys(a for _, _, block_ages, _ in blocks for a in block_ages))
+        years = [year for year, *_ in blocks]
+        cube = ZipCube(
+            np.full((len(zips), len(years), len(ages), len(ZipCube.GENDERS)), np.nan),
+            zips, years, ages, ZipCube.GENDERS,
         )
+        for y, (_, rows, block_ages, cols) in enumerate(blocks):
+            col_idx = np.array(list(cols.values()))  # (zip, gender)
+            block = nums[rows[:, None, None], col_idx[None, :, :]]  # (age, zip, gender)
+            z = np.array([zips.index(k) for k in cols])
+            a = np.array([ages.index(k) for k in block_ages])
+            cube.values[z[:, None], y, a[None, :]] = block.transpose(1, 0, 2)
+        return cube.to_frame()
+    except Exception as e:
+        print("load_zip_gender_age:", e)
+        return pd.DataFrame(columns=list(ZipCube.COLUMNS) + ["Population"])
 
-        year_mask = raw[0].astype(str).str.contains("Year 2023", na=False)
-        if not year_mask.any():
-            return pd.DataFrame(columns=["Age Group", "ZIP Code", "Population"])
-        start = year_mask[year_mask].index[0]
-
-        header_row = start + 2  
-        zip_row = start + 1     
-
-        cols = []
-        for c in range(raw.shape[1]):
-            if str(raw.iloc[header_row, c]).strip().lower() == "total":
-                z = str(raw.iloc[zip_row, c]).strip()
-                if re.fullmatch(r"\d{5}", z):
-                    cols.append((f"ZIP {z}", c))
-
-        ages = []
-        r = start + 4
-        while (
-            r < raw.shape[0]
-            and isinstance(raw.iloc[r, 0], str)
-            and raw.iloc[r, 0].strip()
-        ):
-            ages.append((raw.iloc[r, 0].strip(), r))
-            r += 1
-
-        out = []
-        for age_label, rr in ages:
-            for zip_lbl, cc in cols:
-                out.append(
-                    {
-                        "Age Group": age_label,
-                        "ZIP Code": zip_lbl,
-                        "Population": raw.iloc[rr, cc],
-                    }
-                )
-        df = pd.DataFrame(out)
+
+def load_tract_population_2021():
+    """
+    Sheet: CT 2021
+    Table under the "Census Tract" anchor (Census Tract | Population), one
+    row per six-digit tract code; the unlabelled total row at the bottom is
+    dropped.
+    """
+    try:
+        grid = read_sheet(CT2021_XLSX, CT2021_SHEET)
+        header, col = sheet_anchors(CT2021_XLSX, CT2021_SHEET).find("Census Tract", col=0)
+        df = sheet_table(grid, header=header, usecols=[col, col + 1])
+        df.columns = ["Census Tract", "Population"]
+        df["Census Tract"] = df["Census Tract"].map(_tract_label)
         df["Population"] = pd.to_numeric(df["Population"], errors="coerce")
-        return df.dropna()
+        return tidy(df.dropna(), **{"Census Tract": ()})
     except Exception as e:
-        print("load_zip_age_dist_2023:", e)
-        return pd.DataFrame(columns=["Age Group", "ZIP Code", "Population"])
+        print("load_tract_population_2021:", e)
+        return pd.DataFrame(columns=["Census Tract", "Population"])
 
 
-ZIP_CODES_LABEL = [
-    "ZIP 90802",
-    "ZIP 90803",
-    "ZIP 90804",
-    "ZIP 90805",
-    "ZIP 90806",
-    "ZIP 90807",
-    "ZIP 90808",
-    "ZIP 90810",
-    "ZIP 90813",
-    "ZIP 90814",
-    "ZIP 90815",
-]
+DATA_PACK_DIR = "data_pack"
+DATA_PACK_MANIFEST = "manifest.json"
+# Bump whenever a loader's output changes, so packs built by older code
+# are treated as stale.
+DATA_PACK_FORMAT = 5
 
-app_ui = ui.page_navbar(
-    ui.nav_panel(
-        "Summary Overview",
-        ui.tags.h2("Summary Overview (2023)"),
-        ui.layout_columns(
-            ui.value_box("Total Population", "458,491", theme="primary"),
-            ui.value_box("Male Population", "226,934"),
-            ui.value_box("Female Population", "231,557"),
-            ui.value_box("Largest Age Group", "20-44 (174,952)"),
-        ),
-        ui.layout_columns(
-            output_widget("summary_pop_trend"),
-            output_widget("summary_race_pie"),
-        ),
-        ui.layout_columns(
-            output_widget("summary_zip_bar"),
-        ),
-    ),
-    ui.nav_panel(
-        "Age & Gender Deep Dive",
-        ui.tags.h2("Age & Gender Deep Dive (2023)"),
-        ui.layout_columns(
-            output_widget("age_population_pyramid"),
-            output_widget("age_group_trends"),
-        ),
-    ),
-    ui.nav_panel(
-        "Race & Ethnicity Deep Dive",
-        ui.tags.h2("Race & Ethnicity Deep Dive"),
-        ui.layout_columns(
-            output_widget("race_pop_trends"),
-        ),
-        ui.layout_columns(
-            output_widget("race_age_dist"),
-            output_widget("race_gender_dist"),
-        ),
-    ),
-    ui.nav_panel(
-        "Geographic Deep Dive",
-        ui.tags.h2("Geographic Deep Dive (ZIP Code)"),
-        ui.layout_columns(
-            output_widget("geo_zip_bar_rank"),
-        ),
-        ui.layout_columns(
-            ui.card(
-                ui.tags.h4("Population Trends by ZIP Code (2016–2023)"),
-                ui.input_selectize(
-                    "zip_select",
-                    "Select ZIP Codes:",
-                    choices=ZIP_CODES_LABEL,
-                    selected=["ZIP 90805", "ZIP 90814"],
-                    multiple=True,
-                ),
-                output_widget("geo_zip_trends"),
-            ),
-            output_widget("geo_zip_age_dist"),
-        ),
-    ),
-    title="Long Beach Demographic Dashboard",
-    footer=ui.tags.p(
-        "Data sourced from 2023 ACS 5-Year Estimates Excel workbooks.",
-        style="text-align: center; margin-top: 20px;",
-    ),
-)
+_HASH_CACHE = {}  # path -> (signature, sha256)
 
 
-def server(input, output, session):
-    @reactive.Calc
-    def df_trend():
-        return load_population_trend()
+def _file_sha256(path):
+    """sha256 of a workbook (memoised per mtime/size), or None if missing."""
+    sig = _file_signature(path)
+    if sig is None:
+        return None
+    cached = _HASH_CACHE.get(path)
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    with open(path, "rb") as fh:
+        digest = hashlib.sha256(fh.read()).hexdigest()
+    _HASH_CACHE[path] = (sig, digest)
+    return digest
 
-    @reactive.Calc
-    def df_race_2023():
-        return load_race_2023()
 
-    @reactive.Calc
-    def df_zip_2023():
-        return load_zip_population_2023()
+def _read_manifest(pack_dir=DATA_PACK_DIR):
+    try:
+        with open(os.path.join(pack_dir, DATA_PACK_MANIFEST)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
 
-    @reactive.Calc
-    def df_pyramid_2023():
-        return load_population_pyramid_2023()
 
-    @reactive.Calc
-    def df_age_trends():
-        return load_age_group_trends()
+def read_data_pack(name, path, pack_dir=DATA_PACK_DIR):
+    """
+    Dataset `name` from the prebuilt Arrow data pack, memory-mapped, or None
+    when there is no usable pack entry. An entry is stale when its source
+    workbook exists and no longer matches the hash recorded at build time;
+    if the workbook is absent (e.g. a deployment that only ships the pack),
+    the pack is trusted as-is.
+    """
+    manifest = _read_manifest(pack_dir)
+    if not manifest or manifest.get("format") != DATA_PACK_FORMAT:
+        return None
+    if name not in manifest.get("datasets", {}):
+        return None
+    current = _file_sha256(path)
+    if current is not None and current != manifest["sources"].get(path):
+        return None
+    try:
+        return _map_arrow(os.path.join(pack_dir, manifest["datasets"][name]))
+    except Exception as e:
+        print("read_data_pack:", name, e)
+        return None
 
-    @reactive.Calc
-    def df_race_trends():
-        return load_race_trends()
 
-    @reactive.Calc
-    def df_race_age_dist():
-        return load_race_age_dist_2023()
+def _map_arrow(filename):
+    """
+    Read an Arrow IPC file through a memory map. split_blocks keeps pandas
+    from consolidating columns, so numeric and string columns stay views of
+    the mapped file (read-only) instead of being copied.
+    """
+    import pyarrow as pa
 
-    @reactive.Calc
-    def df_race_gender_dist():
-        return load_race_gender_2023()
+    with pa.memory_map(filename, "r") as source:
+        return pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
 
-    @reactive.Calc
-    def df_zip_trends():
-        return load_zip_trends()
 
-    @reactive.Calc
-    def df_zip_age_dist():
-        return load_zip_age_dist_2023()
+def _write_atomic(filename, write):
+    # Readers may have the old file memory-mapped: write a new file and
+    # rename it over the old one rather than rewriting it in place.
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    write(tmp)
+    os.replace(tmp, filename)
 
-    @output
-    @render_widget
-    def summary_pop_trend():
-        d = df_trend()
-        if d.empty:
-            return go.Figure().update_layout(title="Long Beach Population Trend (no data)")
-        fig = px.line(d, x="Year", y="Total", title="Long Beach Population Trend (2011–2023)", markers=True)
-        fig.update_layout(yaxis_title="Total Population")
-        return fig
 
-    @output
-    @render_widget
-    def summary_race_pie():
-        d = df_race_2023()
-        if d.empty:
-            return go.Figure().update_layout(title="2023 Race/Ethnicity Breakdown (no data)")
-        fig = px.pie(d, names="Race/Ethnicity", values="Population", title="2023 Race/Ethnicity Breakdown", hole=0.4)
-        fig.update_traces(textposition="inside", textinfo="percent+label")
-        return fig
+def build_data_pack(registry, pack_dir=DATA_PACK_DIR):
+    """
+    Run every registered loader against the workbooks and write each tidy
+    table to <pack_dir>/<name>.arrow (Arrow IPC file format), plus a
+    manifest with the sha256 of every source workbook and a version number
+    that goes up by one on every build.
 
-    @output
-    @render_widget
-    def summary_zip_bar():
-        d = df_zip_2023()
-        if d.empty:
-            return go.Figure().update_layout(title="Population by ZIP Code (2023) — no data")
-        d = d.sort_values("Population", ascending=True)
-        return px.bar(d, x="Population", y="ZIP Code", title="Population by ZIP Code (2023)", orientation="h")
+    Loaders report a failure by printing it and returning an empty frame.
+    A dataset that comes back empty is not written and its workbook's hash
+    is left out of the manifest, so the app keeps parsing that workbook
+    instead of serving an empty table as current; ValueError is raised
+    once the rest of the pack is written.
+    """
+    import pyarrow as pa
 
-    @output
-    @render_widget
-    def age_population_pyramid():
-        d = df_pyramid_2023()
-        if d.empty:
-            return go.Figure().update_layout(title="Population Pyramid (2023) — no data")
+    os.makedirs(pack_dir, exist_ok=True)
+    previous = _read_manifest(pack_dir) or {}
+    manifest = {
+        "format": DATA_PACK_FORMAT,
+        "version": previous.get("version", 0) + 1,
+        "sources": {},
+        "datasets": {},
+    }
+    failed = []
+    for name in registry.names():
+        path, loader = registry.source(name)
+        df = loader()
+        if df.empty:
+            failed.append(name)
+            continue
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        filename = f"{name}.arrow"
 
-        ages = list(d["Age Group"].unique())
-        fig = go.Figure()
-        for gender in ["Male", "Female"]:
-            g = d[d["Gender"] == gender]
-            fig.add_trace(go.Bar(y=g["Age Group"], x=g["Population"], name=gender, orientation="h"))
-
-        max_abs = int(abs(d["Population"]).max()) if len(d) else 0
-        step = max(1, max_abs // 5) if max_abs else 1
-        ticks = list(range(-max_abs, max_abs + 1, step)) if max_abs else [-1, 0, 1]
-
-        fig.update_layout(
-            title="Population Pyramid (2023)",
-            barmode="relative",
-            yaxis=dict(title="Age Group", categoryorder="array", categoryarray=ages),
-            xaxis=dict(title="Population", tickvals=ticks, ticktext=[f"{abs(t):,}" for t in ticks]),
-            bargap=0.1,
-            legend_title_text="Gender",
+        def write(tmp):
+            with pa.OSFile(tmp, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+        _write_atomic(os.path.join(pack_dir, filename), write)
+        manifest["datasets"][name] = filename
+        manifest["sources"][path] = _file_sha256(path)
+        print(f"  {filename}: {table.num_rows} rows")
+    for name in failed:
+        path, _ = registry.source(name)
+        manifest["sources"].pop(path, None)
+
+    def write_manifest(tmp):
+        with open(tmp, "w") as fh:
+            json.dump(manifest, fh, indent=2)
+
+    _write_atomic(os.path.join(pack_dir, DATA_PACK_MANIFEST), write_manifest)
+    if failed:
+        raise ValueError(f"no rows loaded for {', '.join(failed)}; their workbooks are not in the pack")
+    return manifest
+
+
+def data_pack_is_current(registry, pack_dir=DATA_PACK_DIR):
+    """True if the pack has every dataset and matches every workbook's hash."""
+    manifest = _read_manifest(pack_dir)
+    if not manifest or manifest.get("format") != DATA_PACK_FORMAT:
+        return False
+    if set(manifest.get("datasets", {})) != set(registry.names()):
+        return False
+    return all(manifest["sources"].get(path) == _file_sha256(path) for path in registry.paths())
+
+
+# Census tract outlines, built into the data pack by `python -m app
+# build-tracts` from a Census tract boundary file (see README 5.2.8).
+TRACT_GEOMETRY = "tracts.json"
+TRACT_GEOMETRY_FORMAT = 1
+TRACT_COUNTY = "06037"  # Los Angeles County, the tracts in the CT 2021 sheet
+# Outline detail levels, coarsest first: (name, Douglas-Peucker tolerance
+# in degrees, map zoom from which it is shown). At the initial zoom a
+# pixel spans about 0.0005 degrees, so each level is off by under a pixel
+# at the zooms it is shown at.
+TRACT_DETAIL = (("coarse", 0.0005, 1), ("medium", 0.00015, 3), ("fine", 0.00005, 10))
+
+
+def _tract_feature_label(props):
+    geoid = str(props.get("GEOID") or props.get("GEOID20") or props.get("GEOID10") or "")
+    if not geoid and "TRACTCE" in props:
+        geoid = f"{props.get('STATEFP', '')}{props.get('COUNTYFP', '')}{props['TRACTCE']}"
+    return _tract_label(geoid[5:]) if geoid.startswith(TRACT_COUNTY) else None
+
+
+def _zcta_feature_label(props):
+    for key in ("ZCTA5CE20", "ZCTA5CE10", "ZCTA5CE", "GEOID20", "GEOID10", "GEOID"):
+        if key in props:
+            z = _zip_code(props[key])
+            return f"ZIP {z}" if z else None
+    return None
+
+
+def build_tract_geometry(tracts_path, zips_path=None, pack_dir=DATA_PACK_DIR):
+    """
+    Write <pack_dir>/tracts.json: the outline of every tract in the CT 2021
+    sheet, taken from the GeoJSON file `tracts_path` (Census tract
+    boundaries, identified by GEOID or STATEFP/COUNTYFP/TRACTCE), simplified
+    at each TRACT_DETAIL tolerance, plus their bounds and, given a ZIP Code
+    Tabulation Area GeoJSON file as `zips_path`, the tract-to-ZIP index.
+    Nothing spatial is left to do per request.
+    """
+    import tracts as geo
+
+    wanted = list(load_tract_population_2021()["Census Tract"])
+    found = geo.read_features(tracts_path, _tract_feature_label)
+    tracts = {label: found[label] for label in wanted if label in found}
+    if not tracts:
+        raise ValueError(f"{tracts_path}: none of the CT 2021 tracts found")
+    missing = [label for label in wanted if label not in tracts]
+    bounds = np.array([geo.bounds(polygons) for polygons in tracts.values()])
+    geometry = {
+        "format": TRACT_GEOMETRY_FORMAT,
+        "bounds": [*bounds[:, :2].min(axis=0).tolist(), *bounds[:, 2:].max(axis=0).tolist()],
+        "levels": {
+            name: {
+                "type": "FeatureCollection",
+                "features": [
+                    {"type": "Feature", "id": label, "properties": {}, "geometry": geo.outline(polygons, tolerance)}
+                    for label, polygons in tracts.items()
+                ],
+            }
+            for name, tolerance, _ in TRACT_DETAIL
+        },
+        "zip_index": None,
+    }
+    if zips_path:
+        geometry["zip_index"] = geo.zip_index(tracts, geo.read_features(zips_path, _zcta_feature_label))
+
+    def write(tmp):
+        with open(tmp, "w") as fh:
+            json.dump(geometry, fh, separators=(",", ":"))
+
+    os.makedirs(pack_dir, exist_ok=True)
+    filename = os.path.join(pack_dir, TRACT_GEOMETRY)
+    _write_atomic(filename, write)
+    for name, *_ in TRACT_DETAIL:
+        size = len(json.dumps(geometry["levels"][name], separators=(",", ":")))
+        print(f"  {name}: {size / 1024:.0f} KiB")
+    if missing:
+        print(f"  no outline for {len(missing)} tract(s): {', '.join(missing)}")
+    return geometry
+
+
+@functools.cache
+def tract_geometry(pack_dir=DATA_PACK_DIR):
+    """
+    The tract outlines and tract-to-ZIP index from build_tract_geometry(),
+    read once per process, or None when they have not been built.
+    """
+    try:
+        with open(os.path.join(pack_dir, TRACT_GEOMETRY)) as fh:
+            geometry = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return geometry if geometry.get("format") == TRACT_GEOMETRY_FORMAT else None
+
+
+def tract_detail(scale):
+    """Name of the TRACT_DETAIL level to show at map zoom `scale`."""
+    return [name for name, _, zoom in TRACT_DETAIL if (scale or 1) >= zoom][-1]
+
+
+SHARED_STORE_ENV = "LBDHHS_SHARED_STORE"
+
+
+class SharedStore:
+    """
+    A data pack shared by all worker processes on one host.
+
+    Set LBDHHS_SHARED_STORE to a directory (preferably on tmpfs, such as
+    /dev/shm/lbdhhs) before starting the workers. Every worker
+    memory-maps the same Arrow files read-only, so the OS keeps one copy
+    of the data rather than one per worker, and only one process ever
+    parses the workbooks.
+
+    That process is the writer: whichever worker holds the lock file in
+    the directory. It builds the pack, then rebuilds it whenever a workbook
+    changes. The other workers wait on the lock in a background thread, so
+    one of them takes over if the writer exits. The manifest records the
+    hash of each workbook the pack was built from; workers poll it through
+    DatasetRegistry.signature() to pick up reloads.
+    """
+
+    def __init__(self, directory, interval=5):
+        self.directory = directory
+        self.interval = interval
+        self._manifest = (None, None)  # (file signature, parsed manifest)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def manifest(self):
+        """Current manifest, re-read only when the file changes."""
+        sig = _file_signature(os.path.join(self.directory, DATA_PACK_MANIFEST))
+        with self._lock:
+            if sig != self._manifest[0]:
+                manifest = _read_manifest(self.directory) if sig else None
+                if manifest and manifest.get("format") != DATA_PACK_FORMAT:
+                    manifest = None
+                self._manifest = (sig, manifest)
+            return self._manifest[1]
+
+    def version(self, path):
+        """Hash of workbook `path` as of the current pack, or None."""
+        manifest = self.manifest()
+        return manifest["sources"].get(path) if manifest else None
+
+    def read(self, name, timeout=60):
+        """
+        Memory-map dataset `name`, waiting up to `timeout` seconds for the
+        writer's first build. None if it does not appear in time, or if
+        the pack was built without it because its loader failed.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            manifest = self.manifest()
+            if manifest and name not in manifest["datasets"]:
+                return None
+            if manifest:
+                try:
+                    return _map_arrow(os.path.join(self.directory, manifest["datasets"][name]))
+                except OSError as e:
+                    print("SharedStore.read:", name, e)
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.2)
+
+    def start_writer(self, registry):
+        self._thread = threading.Thread(target=self._write_loop, args=(registry,), name="shared-store", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the writer thread and wait up to `timeout` seconds for it to
+        release the lock. A worker still waiting for the lock stops once it
+        gets it.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _write_loop(self, registry):
+        try:
+            import fcntl
+        except ImportError:
+            print("SharedStore: no file locking on this platform; build the store with `python -m app build-data --out DIR`")
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # blocks until this process is the writer
+            built = None
+            while not self._stopped.is_set():
+                current = tuple((path, _file_signature(path)) for path in registry.paths())
+                if current != built:
+                    try:
+                        if not data_pack_is_current(registry, self.directory):
+                            print(f"SharedStore: building {self.directory}/ (pid {os.getpid()})")
+                            build_data_pack(registry, self.directory)
+                    except Exception as e:
+                        print("SharedStore:", e)
+                    # A failed build is retried when a workbook changes,
+                    # not on every poll.
+                    built = current
+                    # The writer serves from the store like everyone else.
+                    _GRID_CACHE.clear()
+                self._stopped.wait(self.interval)
+
+
+class DatasetRegistry:
+    """
+    Process-wide cache of the tidy DataFrames, shared read-only by every
+    Shiny session. Each dataset is loaded once and kept together with the
+    (mtime, size) signature of its source workbook; when that signature
+    changes the next get() reloads it. Loads come from the prebuilt data
+    pack when it is up to date, otherwise from the workbook itself.
+
+    stats counts hits (served from cache), misses (first load) and
+    reloads (source workbook changed).
+
+    submit() loads a whole workbook on a thread pool with one worker per
+    workbook, so workbooks load concurrently and a slow one does not hold
+    up the rest.
+
+    With a SharedStore attached, datasets are read from the store and
+    versioned by the store's manifest instead of the workbook files.
+    """
+
+    def __init__(self):
+        self._sources = {}  # name -> (path, loader)
+        self._entries = {}  # name -> (signature, DataFrame)
+        self._locks = {}
+        self._stats_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "reloads": 0}
+        self._pool = None
+        self._pending = {}  # path -> Future of load_workbook(path)
+        self._pool_lock = threading.Lock()
+        self._store = None
+
+    def register(self, name, path, loader):
+        self._sources[name] = (path, instrument("loader")(loader))
+        self._locks[name] = threading.Lock()
+
+    def names(self):
+        return list(self._sources)
+
+    def source(self, name):
+        return self._sources[name]
+
+    def paths(self):
+        return sorted({path for path, _ in self._sources.values()})
+
+    def attach_store(self, store):
+        self._store = store
+        store.start_writer(self)
+
+    def version(self, path):
+        """What a cached dataset from `path` is checked against."""
+        if self._store is not None:
+            return self._store.version(path)
+        return _file_signature(path)
+
+    def signature(self):
+        return tuple((path, self.version(path)) for path in self.paths())
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def get(self, name):
+        # The returned frame is shared between sessions: callers must not
+        # modify it in place.
+        path, loader = self._sources[name]
+        sig = self.version(path)
+        with self._locks[name]:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == sig:
+                self._count("hits")
+                return entry[1]
+            self._count("misses" if entry is None else "reloads")
+            if self._store is not None:
+                df = self._store.read(name)
+            else:
+                df = read_data_pack(name, path)
+            if df is None:
+                df = loader()
+            self._entries[name] = (sig, df)
+            return df
+
+    def load_workbook(self, path):
+        """get() every dataset that comes from `path`, as {name: DataFrame}."""
+        return {name: self.get(name) for name, (p, _) in self._sources.items() if p == path}
+
+    def submit(self, path):
+        """
+        Run load_workbook(path) on the loader pool and return its Future.
+        Callers asking for a workbook that is already loading share the
+        same Future instead of queueing a second load.
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=len(self.paths()), thread_name_prefix="workbook")
+            future = self._pending.get(path)
+            if future is None or future.done():
+                future = self._pool.submit(self.load_workbook, path)
+                self._pending[path] = future
+            return future
+
+
+DATASETS = DatasetRegistry()
+DATASETS.register("trend", LB2023_XLSX, load_population_trend)
+DATASETS.register("zip_2023", LB2023_XLSX, load_zip_population_2023)
+DATASETS.register("pyramid_2023", LB2023_XLSX, load_population_pyramid_2023)
+DATASETS.register("age_trends", LB2023_XLSX, load_age_group_trends)
+DATASETS.register("race_2023", RACE_ETH_2023_XLSX, load_race_2023)
+DATASETS.register("race_trends", RACE_BY_YEAR_XLSX, load_race_trends)
+DATASETS.register("race_gender_age_trends", RACE_BY_YEAR_XLSX, load_race_gender_age_trends)
+DATASETS.register("gender_age_trends", RACE_ETH_2023_XLSX, load_gender_age_trends)
+DATASETS.register("race_age_dist", RACE_ETH_2023_XLSX, load_race_age_dist_2023)
+DATASETS.register("race_gender_dist", RACE_ETH_2023_XLSX, load_race_gender_2023)
+DATASETS.register("zip_trends", ZIP_YEAR_XLSX, load_zip_trends)
+DATASETS.register("zip_gender_age", ZIP_GENDER_AGE_XLSX, load_zip_gender_age)
+DATASETS.register("tracts_2021", CT2021_XLSX, load_tract_population_2021)
+if os.environ.get(SHARED_STORE_ENV):
+    DATASETS.attach_store(SharedStore(os.environ[SHARED_STORE_ENV]))
+
+
+# Declared outside server() so one poller is shared by all sessions; it
+# invalidates every session's datasets when any workbook is modified.
+@reactive.poll(DATASETS.signature, 5)
+def data_version():
+    return DATASETS.signature()
+
+
+class DerivedCache:
+    """
+    Values computed from a registered dataset and shared by every session.
+
+    Each name is registered with the dataset it is derived from and a
+    function of that dataset's frame. The first get() runs the function;
+    the result is kept with the version of the dataset's workbook (see
+    DatasetRegistry.version) and recomputed only when that changes.
+
+    Keyword arguments to get() are passed on to the function and are part
+    of the key, so values driven by a few inputs (year, gender) are cached
+    once per combination.
+
+    With max_entries set, the least recently used values are dropped once
+    there are more than that many.
+
+    stats counts hits, misses and rebuilds (dataset changed), as in
+    DatasetRegistry.
+    """
+
+    def __init__(self, datasets, max_entries=None):
+        self._datasets = datasets
+        self.max_entries = max_entries
+        self._sources = {}  # name -> (dataset name, function)
+        self._entries = {}  # (name, params) -> (signature, value), least recently used first
+        self._locks = {}
+        self._lru_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "rebuilds": 0}
+
+    def register(self, name, dataset, fn):
+        self._sources[name] = (dataset, fn)
+        self._locks[name] = threading.Lock()
+
+    def names(self):
+        return list(self._sources)
+
+    def source(self, name):
+        return self._sources[name]
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _build(self, fn, d, params):
+        return fn(d, **params)
+
+    def _store(self, key, entry):
+        # Re-inserting moves the key to the end, the most recently used.
+        with self._lru_lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while self.max_entries is not None and len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def get(self, name, **params):
+        # Values are shared between sessions: callers must not modify them.
+        dataset, fn = self._sources[name]
+        path, _ = self._datasets.source(dataset)
+        sig = self._datasets.version(path)
+        key = (name, tuple(sorted(params.items())))
+        with self._locks[name]:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == sig:
+                self._count("hits")
+                if self.max_entries is not None:
+                    self._store(key, entry)
+                return entry[1]
+            self._count("misses" if entry is None else "rebuilds")
+            value = self._build(fn, self._datasets.get(dataset), params)
+            self._store(key, (sig, value))
+            return value
+
+
+# Lower bounds of the workbook's "Age Groups" bands (0-19, 20-44, 45-64,
+# 65-84, 85+), used to roll the pyramid's five-year groups up.
+AGE_BAND_STARTS = (0, 20, 45, 65, 85)
+
+
+def _age_start(label):
+    """First age in a label such as "Under 5 years", "<20" or "20 to 24 years"."""
+    if label.strip().lower().startswith(("under", "<")):
+        return 0
+    return int(re.search(r"\d+", label).group())
+
+
+def _age_band_label(i):
+    lo = AGE_BAND_STARTS[i]
+    if i + 1 == len(AGE_BAND_STARTS):
+        return f"{lo}+"
+    return f"{lo}-{AGE_BAND_STARTS[i + 1] - 1}"
+
+
+def summary_kpis(d):
+    """
+    Value-box figures for the Summary tab, from the population pyramid:
+    total, male and female population and the largest age band.
+    None if the pyramid has no data.
+    """
+    if d.empty:
+        return None
+    pop = d["Population"].abs()
+    by_gender = pop.groupby(d["Gender"]).sum()
+    starts = np.asarray(d["Age Group"].map(_age_start), dtype=int)
+    bands = np.searchsorted(AGE_BAND_STARTS, starts, side="right") - 1
+    by_band = pop.groupby(bands).sum()
+    largest = int(by_band.idxmax())
+    return {
+        "total": int(pop.sum()),
+        "male": int(by_gender.get("Male", 0)),
+        "female": int(by_gender.get("Female", 0)),
+        "largest_age_group": _age_band_label(largest),
+        "largest_age_group_population": int(by_band[largest]),
+    }
+
+
+def kpi_texts(k):
+    """The value boxes' text for summary_kpis() figures (None: no data)."""
+    if not k:
+        return dict.fromkeys(("total", "male", "female", "largest_age_group"), "—")
+    return {
+        "total": f"{k['total']:,}",
+        "male": f"{k['male']:,}",
+        "female": f"{k['female']:,}",
+        "largest_age_group": f"{k['largest_age_group']} ({k['largest_age_group_population']:,})",
+    }
+
+
+AGGREGATES = DerivedCache(DATASETS)
+AGGREGATES.register("summary_kpis", "pyramid_2023", summary_kpis)
+
+CUBES = DerivedCache(DATASETS)
+CUBES.register("zip_gender_age", "zip_gender_age", ZipCube.from_frame)
+
+
+def race_key(label):
+    """
+    Short race/ethnicity name, the same in every workbook: the 2023 sheet's
+    "Hispanic or Latino" and "White (Not Hispanic)" become "Hispanic" and
+    "White", as in the other sheets.
+    """
+    return re.sub(r" or Latino$| \(Not Hispanic\)$", "", label, flags=re.IGNORECASE)
+
+
+def _nansum(values, axis):
+    # Like np.nansum, but a total of nothing but missing cells stays NaN.
+    return np.where(np.isnan(values).all(axis=axis), np.nan, np.nansum(values, axis=axis))
+
+
+class Rollup:
+    """
+    A tidy dataset's counts as a dense array over its label columns, with
+    the total over every subset of those columns computed up front. ROLLUPS
+    keeps one per dataset version.
+
+    lookup() groups and filters by indexing one of those arrays, so a
+    cross-filter click costs no pandas filter or group-by. Totals over
+    Gender use the sheet's "Total" rows where it has them. Totals add
+    magnitudes: the pyramid keeps Male counts negative so they plot to the
+    left, and a total must not net them against Female. Missing cells are
+    NaN.
+
+    Selections are made of canonical keys, comparable across workbooks:
+    race labels by race_key() and age groups as (start, end) ranges, which
+    match every group they overlap, so a five-year group picked in one sheet
+    selects the broad band containing it in another.
+    """
+
+    def __init__(self, dims, axes, values):
+        self.dims = tuple(dims)
+        self.axes = dict(zip(self.dims, axes))
+        self._totals = {}
+        for n in range(len(self.dims) + 1):
+            for keep in itertools.combinations(range(len(self.dims)), n):
+                total = values
+                for i in reversed(range(len(self.dims))):
+                    if i not in keep:
+                        total = self._total(total, i, self.axes[self.dims[i]])
+                self._totals[keep] = total
+        self._keys = {col: self._canonical(col, axis) for col, axis in self.axes.items()}
+
+    @classmethod
+    def from_frame(cls, df):
+        count = next(col for col in COUNT_COLUMNS if col in df.columns)
+        dims = [col for col in df.columns if col != count]
+        axes, codes = [], []
+        for col in dims:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                axes.append(pd.Index(df[col].cat.categories))
+                codes.append(df[col].cat.codes.to_numpy())
+            else:
+                axis = pd.Index(np.sort(df[col].unique()))
+                axes.append(axis)
+                codes.append(axis.get_indexer(df[col]))
+        values = np.full(tuple(len(axis) for axis in axes), np.nan)
+        values[tuple(codes)] = df[count].to_numpy(dtype=float, na_value=np.nan)
+        return cls(dims, axes, values)
+
+    @staticmethod
+    def _total(values, i, axis):
+        if "Total" in axis:
+            total = np.take(values, axis.get_loc("Total"), axis=i)
+            if not np.isnan(total).all():
+                return total
+        return _nansum(np.abs(values), i)
+
+    @staticmethod
+    def _canonical(col, axis):
+        if col == "Race/Ethnicity":
+            return [race_key(label) for label in axis]
+        if col == "Age Group":
+            starts = [_age_start(label) for label in axis]
+            bounds = sorted(set(starts)) + [float("inf")]
+            return [(s, bounds[bounds.index(s) + 1]) for s in starts]
+        return list(axis)
+
+    def key(self, col, label):
+        """Canonical key of one label of `col`."""
+        return self._keys[col][self.axes[col].get_loc(label)]
+
+    def match(self, col, keys):
+        """Labels of `col` selected by canonical `keys`, in axis order."""
+        if col == "Age Group":
+            hit = [any(lo < k_hi and k_lo < hi for k_lo, k_hi in keys) for lo, hi in self._keys[col]]
+        else:
+            hit = [key in keys for key in self._keys[col]]
+        return list(self.axes[col][hit])
+
+    def lookup(self, by, where=None):
+        """
+        Counts grouped by the columns in `by`, in that order, over the rows
+        whose labels are in where[column] for every column in `where`
+        (columns the dataset lacks are ignored); other columns are totalled.
+        Returns the labels along each `by` axis and the array of counts.
+        """
+        where = {col: labels for col, labels in (where or {}).items() if col in self.axes}
+        kept = [col for col in self.dims if col in by or col in where]
+        values = self._totals[tuple(self.dims.index(col) for col in kept)]
+        axes = {col: self.axes[col] for col in kept}
+        for col, labels in where.items():
+            idx = axes[col].get_indexer(list(labels))
+            idx = idx[idx >= 0]
+            values = np.take(values, idx, axis=kept.index(col))
+            axes[col] = axes[col][idx]
+        for col in reversed(list(kept)):
+            if col not in by:
+                values = _nansum(np.abs(values), kept.index(col))
+                kept.remove(col)
+        return [axes[col] for col in by], values.transpose([kept.index(col) for col in by])
+
+
+ROLLUPS = DerivedCache(DATASETS)
+for _name in DATASETS.names():
+    ROLLUPS.register(_name, _name, Rollup.from_frame)
+
+
+def trend_measures(d):
+    """TrendMeasures (see measures.py) of a trend dataset."""
+    return TrendMeasures.from_rollup(Rollup.from_frame(d))
+
+
+MEASURES = DerivedCache(DATASETS, max_entries=64)
+for _name in ("race_trends", "age_trends", "zip_trends"):
+    MEASURES.register(_name, _name, trend_measures)
+
+
+def show_trend_measure(fig, measures, measure, area=False):
+    """
+    Plot `measure` on a trend chart with one trace per group, in place.
+    An area chart is unstacked for measures that do not add up.
+    """
+    _, title, _, unit, stacks = TREND_MEASURES[measure]
+    for trace in fig.data:
+        trace.y = measures.series(measure, trace.name, _axis_labels(trace))
+        trace.hovertemplate = measures.hovertemplate(measure, trace.name)
+        if area:
+            trace.stackgroup = "1" if stacks else None
+    fig.layout.yaxis.title.text = title
+    fig.layout.yaxis.ticksuffix = unit or None
+
+
+# Figure builders take the dataset frame and return a plotly Figure. They
+# depend on nothing but their dataset, so FIGURES can share the result
+# between sessions.
+
+
+def _year_span(d):
+    """'2017–2023': the years a time series covers, as found in the sheet."""
+    return f"{d['Year'].min()}–{d['Year'].max()}"
+
+
+def figure_pop_trend(d):
+    if d.empty:
+        return go.Figure().update_layout(title="Long Beach Population Trend (no data)")
+    fig = px.line(d, x="Year", y="Total", title=f"Long Beach Population Trend ({_year_span(d)})", markers=True)
+    fig.update_layout(yaxis_title="Total Population")
+    return fig
+
+
+def figure_race_pie(d):
+    if d.empty:
+        return go.Figure().update_layout(title="2023 Race/Ethnicity Breakdown (no data)")
+    fig = px.pie(d, names="Race/Ethnicity", values="Population", title="2023 Race/Ethnicity Breakdown", hole=0.4)
+    fig.update_traces(textposition="inside", textinfo="percent+label")
+    return fig
+
+
+def figure_zip_bar(d):
+    if d.empty:
+        return go.Figure().update_layout(title="Population by ZIP Code (2023) — no data")
+    d = d.sort_values("Population", ascending=True)
+    return px.bar(d, x="Population", y="ZIP Code", title="Population by ZIP Code (2023)", orientation="h")
+
+
+def _with_growth(fig, d):
+    # Trend hovers name each group's compound annual growth rate too.
+    measures = trend_measures(d)
+    for trace in fig.data:
+        trace.hovertemplate = measures.hovertemplate("absolute", trace.name)
+    return fig
+
+
+def figure_zip_trends(d):
+    # One trace per ZIP in ZIP_CODES_LABEL order; sessions pick which ones
+    # are visible with show_zip_traces().
+    if d.empty:
+        return go.Figure().update_layout(title="Selected ZIP Code Population Trends — no data")
+    fig = px.line(
+        d, x="Year", y="Population", color="ZIP Code", title="Selected ZIP Code Population Trends",
+        markers=True, category_orders={"ZIP Code": ZIP_CODES_LABEL},
+    )
+    return _with_growth(fig, d)
+
+
+def show_zip_traces(fig, selected):
+    """Make only the selected ZIP codes visible on a figure_zip_trends() chart."""
+    if not fig.data:
+        return
+    selected = set(selected)
+    for trace in fig.data:
+        trace.visible = trace.name in selected
+    fig.layout.title.text = (
+        "Selected ZIP Code Population Trends" if selected else "Please select at least one ZIP code."
+    )
+
+
+def figure_population_pyramid(d):
+    if d.empty:
+        return go.Figure().update_layout(title="Population Pyramid (2023) — no data")
+
+    ages = list(d["Age Group"].unique())
+    fig = go.Figure()
+    for gender in ["Male", "Female"]:
+        g = d[d["Gender"] == gender]
+        fig.add_trace(go.Bar(y=g["Age Group"], x=g["Population"], name=gender, orientation="h"))
+
+    max_abs = int(abs(d["Population"]).max()) if len(d) else 0
+    step = max(1, max_abs // 5) if max_abs else 1
+    ticks = list(range(-max_abs, max_abs + 1, step)) if max_abs else [-1, 0, 1]
+
+    fig.update_layout(
+        title="Population Pyramid (2023)",
+        barmode="relative",
+        yaxis=dict(title="Age Group", categoryorder="array", categoryarray=ages),
+        xaxis=dict(title="Population", tickvals=ticks, ticktext=[f"{abs(t):,}" for t in ticks]),
+        bargap=0.1,
+        legend_title_text="Gender",
+    )
+    return fig
+
+
+def figure_age_group_trends(d):
+    if d.empty:
+        return go.Figure().update_layout(title="Population Change by Age Group — no data")
+    fig = px.area(d, x="Year", y="Population", color="Age Group", title=f"Population Change by Age Group ({_year_span(d)})")
+    # Years are int16; keep one category per year rather than a numeric axis.
+    return _with_growth(fig, d).update_xaxes(type="category")
+
+
+def figure_race_pop_trends(d):
+    if d.empty:
+        return go.Figure().update_layout(title="Population Trends by Race/Ethnicity — no data")
+    fig = px.line(
+        d, x="Year", y="Population", color="Race/Ethnicity",
+        title=f"Population Trends by Race/Ethnicity ({_year_span(d)})", markers=True,
+    )
+    return _with_growth(fig, d).update_xaxes(type="category")
+
+
+def figure_race_age_dist(d):
+    if d.empty:
+        return go.Figure().update_layout(title="Age Distribution by Race/Ethnicity (2023) — no data")
+    return px.bar(d, x="Race/Ethnicity", y="Population", color="Age Group", title="Age Distribution by Race/Ethnicity (2023)", barmode="stack")
+
+
+def figure_race_gender_dist(d):
+    if d.empty:
+        return go.Figure().update_layout(title="Gender by Race/Ethnicity (2023) — no data")
+    return px.bar(d, x="Race/Ethnicity", y="Population", color="Gender", title="Gender by Race/Ethnicity (2023)", barmode="group")
+
+
+def _zip_age_title(year, gender):
+    title = f"Age Distribution by ZIP Code ({year})"
+    return title if gender == "Total" else f"{gender} {title}"
+
+
+def figure_zip_age_dist(d, year=2023, gender="Total"):
+    # d is the whole ZipCube frame, whose cube CUBES builds once per dataset
+    # version; year and gender pick one slice of it.
+    cube = CUBES.get("zip_gender_age") if not d.empty else None
+    if cube is None or year not in cube.years:
+        return go.Figure().update_layout(title=f"{_zip_age_title(year, gender)} — no data")
+    fig = px.bar(
+        cube.age_frame(year, gender), x="ZIP Code", y="Population", color="Age Group",
+        title=_zip_age_title(year, gender), barmode="stack",
+    )
+    fig.update_xaxes(categoryorder="total descending")
+    return fig
+
+
+def figure_tract_map(d, detail="coarse"):
+    # The outlines come from the data pack, not the workbook: without them
+    # the tab falls back to figure_tract_bar() alone.
+    geometry = tract_geometry()
+    if d.empty or geometry is None:
+        return go.Figure().update_layout(title="Population by Census Tract (2021) — no tract outlines")
+    x0, y0, x1, y1 = geometry["bounds"]
+    pad = 0.05 * max(x1 - x0, y1 - y0)
+    fig = go.Figure(
+        go.Choropleth(
+            geojson=geometry["levels"][detail], featureidkey="id",
+            locations=d["Census Tract"].astype(str), z=d["Population"],
+            colorscale="Viridis", marker_line_width=0.3, colorbar_title="Population",
+            hovertemplate="%{location}<br>%{z:,} residents<extra></extra>",
         )
-        return fig
+    )
+    # Fixed axis ranges rather than fitbounds, so zoom (projection.scale)
+    # is relative to the whole city and tract_detail() can pick a level.
+    fig.update_geos(
+        visible=False, projection_type="mercator",
+        lonaxis_range=[x0 - pad, x1 + pad], lataxis_range=[y0 - pad, y1 + pad],
+    )
+    fig.update_layout(title="Population by Census Tract (2021)", margin=dict(l=0, r=0, b=0))
+    return fig
+
+
+def figure_tract_bar(d, top=25):
+    if d.empty:
+        return go.Figure().update_layout(title="Most Populous Census Tracts (2021) — no data")
+    d = d.sort_values("Population").tail(top)
+    return px.bar(d, x="Population", y="Census Tract", title="Most Populous Census Tracts (2021)", orientation="h")
+
+
+def show_tracts(fig, d, tracts, top=25):
+    """
+    Limit a figure_tract_map() or figure_tract_bar() chart to `tracts`
+    (labels); None shows what the builder shows.
+    """
+    if not fig.data:
+        return
+    if tracts is not None:
+        d = d[d["Census Tract"].isin(tracts)]
+    trace = fig.data[0]
+    if trace.type == "choropleth":
+        trace.locations, trace.z = d["Census Tract"].astype(str).tolist(), d["Population"].tolist()
+        return
+    d = d.sort_values("Population")
+    if tracts is None:
+        d = d.tail(top)
+    trace.y, trace.x = d["Census Tract"].astype(str).tolist(), d["Population"].tolist()
+    fig.layout.title.text = (
+        "Most Populous Census Tracts (2021)" if tracts is None else "Census Tracts in the Selected ZIP Codes (2021)"
+    )
+
+
+def tracts_in_zips(zips, min_share=0.25):
+    """
+    Tracts with at least `min_share` of their area in any of `zips`, from
+    the prebuilt tract-to-ZIP index; None when there is no index or no ZIP
+    is selected.
+    """
+    geometry = tract_geometry()
+    if not zips or geometry is None or not geometry.get("zip_index"):
+        return None
+    zips = set(zips)
+    return [
+        tract for tract, shares in geometry["zip_index"].items()
+        if any(label in zips and share >= min_share for label, share in shares)
+    ]
+
+
+# Payload optimizer: FIGURES keeps slimmed figures and widgets load plotly.js
+# from /assets/ by URL. Set LBDHHS_SLIM_PAYLOADS=0 to send figures as
+# plotly builds them, with the bundle inlined in every widget.
+SLIM_PAYLOADS_ENV = "LBDHHS_SLIM_PAYLOADS"
+SLIM_PAYLOADS = os.environ.get(SLIM_PAYLOADS_ENV, "1") != "0"
+
+# Trace attributes plotly express writes out although they equal the
+# plotly.js defaults, by trace type ("*" for every type).
+TRACE_DEFAULTS = {
+    "*": {"xaxis": "x", "yaxis": "y", "legendgroup": "", "showlegend": True},
+    "bar": {"orientation": "v", "textposition": "auto", "marker": {"pattern": {"shape": ""}}},
+    "scatter": {"orientation": "v", "line": {"dash": "solid"}},
+}
+AXIS_DEFAULTS = {"xaxis": {"anchor": "y", "domain": [0.0, 1.0]}, "yaxis": {"anchor": "x", "domain": [0.0, 1.0]}}
+
+# Template layout entries that only style subplots of these trace types.
+TEMPLATE_SUBPLOTS = {
+    "geo": ("scattergeo", "choropleth"),
+    "map": ("scattermap", "choroplethmap", "densitymap"),
+    "mapbox": ("scattermapbox", "choroplethmapbox", "densitymapbox"),
+    "polar": ("scatterpolar", "scatterpolargl", "barpolar"),
+    "scene": ("scatter3d", "surface", "mesh3d", "cone", "streamtube", "volume", "isosurface"),
+    "ternary": ("scatterternary",),
+}
+COLORSCALE_TRACES = (
+    "heatmap", "contour", "histogram2d", "histogram2dcontour", "surface",
+    "choropleth", "choroplethmap", "choroplethmapbox", "densitymap", "densitymapbox",
+)
+
+# Typed-array dtypes plotly.js decodes, narrowest first.
+INT_DTYPES = ("i1", "u1", "i2", "u2", "i4", "u4")
+
+
+def _drop_defaults(d, defaults):
+    for key, default in defaults.items():
+        if isinstance(default, dict) and isinstance(d.get(key), dict):
+            _drop_defaults(d[key], default)
+            if not d[key]:
+                del d[key]
+        elif key in d and d[key] == default:
+            del d[key]
+
+
+def _decode_array(value):
+    """
+    A data array of a figure read back from JSON: typed arrays stay
+    {"dtype", "bdata"} dicts there (see FigureCache.get) and are decoded
+    to numpy; anything else is returned as it is.
+    """
+    if isinstance(value, dict) and "bdata" in value:
+        return np.frombuffer(base64.b64decode(value["bdata"]), dtype=value["dtype"])
+    return value
+
+
+def _narrow_array(value):
+    """A float typed array holding whole numbers, re-encoded as the narrowest int type."""
+    if not (isinstance(value, dict) and value.get("dtype") in ("f4", "f8") and "shape" not in value):
+        return value
+    a = _decode_array(value)
+    if not len(a) or not np.isfinite(a).all() or (a != np.round(a)).any():
+        return value
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= a.min() and a.max() <= info.max:
+            return {"dtype": dtype, "bdata": base64.b64encode(a.astype(dtype).tobytes()).decode()}
+    return value
+
+
+def slim_figure(spec):
+    """
+    Shrink a plotly JSON figure (fig.to_json(), parsed) without changing
+    how it draws: the template keeps only what these traces and subplots
+    use, attributes equal to plotly.js defaults are dropped and float
+    arrays of whole numbers become integer typed arrays. Modifies `spec`
+    in place and returns it.
+    """
+    traces = spec.get("data", [])
+    types = {t.get("type", "scatter") for t in traces}
+    for trace in traces:
+        kind = trace.get("type", "scatter")
+        _drop_defaults(trace, TRACE_DEFAULTS["*"])
+        _drop_defaults(trace, TRACE_DEFAULTS.get(kind, {}))
+        for key in ("x", "y", "values"):
+            if key in trace:
+                trace[key] = _narrow_array(trace[key])
+
+    layout = spec.get("layout", {})
+    _drop_defaults(layout, AXIS_DEFAULTS)
+    template = layout.get("template")
+    if template:
+        template["data"] = {k: v for k, v in template.get("data", {}).items() if k in types}
+        t_layout = template.get("layout", {})
+        for subplot, kinds in TEMPLATE_SUBPLOTS.items():
+            if types.isdisjoint(kinds) and subplot not in layout:
+                t_layout.pop(subplot, None)
+        if types.isdisjoint(COLORSCALE_TRACES) and not any("coloraxis" in t for t in traces):
+            t_layout.pop("coloraxis", None)
+            t_layout.pop("colorscale", None)
+        for feature in ("annotation", "shape"):
+            if f"{feature}s" not in layout:
+                t_layout.pop(f"{feature}defaults", None)
+    return spec
+
+
+class FigureCache(DerivedCache):
+    """
+    Serialized figures shared by every Shiny session.
+
+    Building a chart with plotly express costs far more than the render
+    itself, and every session used to repeat it. The first get() of a chart
+    runs its builder and keeps fig.to_json(), passed through slim_figure()
+    when SLIM_PAYLOADS is on; later gets rebuild the Figure from that
+    payload without re-validating it. Each call returns a new Figure, so
+    sessions never share a mutable object.
+    """
+
+    def _build(self, builder, d, params):
+        payload = builder(d, **params).to_json()
+        return json.dumps(slim_figure(json.loads(payload))) if SLIM_PAYLOADS else payload
+
+    def payload(self, chart_id, **params):
+        """Plotly JSON for `chart_id`, building it on first use."""
+        return super().get(chart_id, **params)
+
+    def get(self, chart_id, **params):
+        return go.Figure(json.loads(self.payload(chart_id, **params)), _validate=False)
+
+
+FIGURES = FigureCache(DATASETS)
+FIGURES.register("pop_trend", "trend", figure_pop_trend)
+FIGURES.register("race_pie", "race_2023", figure_race_pie)
+# summary_zip_bar and geo_zip_bar_rank show the same chart.
+FIGURES.register("zip_bar_2023", "zip_2023", figure_zip_bar)
+FIGURES.register("population_pyramid", "pyramid_2023", figure_population_pyramid)
+FIGURES.register("age_group_trends", "age_trends", figure_age_group_trends)
+FIGURES.register("race_pop_trends", "race_trends", figure_race_pop_trends)
+FIGURES.register("race_age_dist", "race_age_dist", figure_race_age_dist)
+FIGURES.register("race_gender_dist", "race_gender_dist", figure_race_gender_dist)
+FIGURES.register("zip_trends", "zip_trends", figure_zip_trends)
+FIGURES.register("zip_age_dist", "zip_gender_age", figure_zip_age_dist)
+FIGURES.register("tract_map", "tracts_2021", figure_tract_map)
+FIGURES.register("tract_bar", "tracts_2021", figure_tract_bar)
+
+
+# Query-string filters understood by the data API: parameter -> column.
+# A filter is accepted for a dataset only if the dataset has the column.
+API_FILTERS = {
+    "year": "Year",
+    "zip": "ZIP Code",
+    "race": "Race/Ethnicity",
+    "gender": "Gender",
+}
+
+API_MEDIA_TYPES = {
+    "json": "application/json",
+    "csv": "text/csv; charset=utf-8",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def _api_key(param, value):
+    """
+    Normalize a filter value or column value for comparison. Races compare
+    by race_key(), so "hispanic" also matches "Hispanic or Latino".
+    """
+    value = str(value).strip()
+    if param == "zip":
+        return "".join(ch for ch in value if ch.isdigit())
+    if param == "race":
+        value = race_key(value)
+    return value.casefold()
+
+
+def filter_dataset(d, filters):
+    """Rows of `d` matching every (param, values) pair in `filters`."""
+    mask = np.ones(len(d), dtype=bool)
+    for param, values in filters:
+        column = d[API_FILTERS[param]]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Normalize the few categories, then select by code.
+            keys = [_api_key(param, c) for c in column.cat.categories]
+            allowed = np.append(np.isin(keys, values), False)  # code -1: missing
+            mask &= allowed[column.cat.codes.to_numpy()]
+        else:
+            mask &= column.astype(str).map(lambda v: _api_key(param, v)).isin(values).to_numpy()
+    return d[mask]
+
+
+def encode_dataset(d, fmt):
+    if fmt == "json":
+        # pandas escapes "/" (as in "Race/Ethnicity"); JSON does not need it.
+        return d.to_json(orient="records").replace("\\/", "/").encode()
+    if fmt == "csv":
+        return d.to_csv(index=False).encode()
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(d, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class Payload:
+    """An encoded response body, its gzipped form and their ETags."""
+
+    def __init__(self, body, media_type):
+        self.body = body
+        self.media_type = media_type
+        self.gzip_body = gzip.compress(body, mtime=0)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.digest = digest
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gz"'
+
+
+class PayloadCache(DerivedCache):
+    """
+    Encoded API responses shared by every request.
+
+    Each dataset is registered under its own name. get(name, fmt=...,
+    filters=...) filters and encodes the frame once and keeps the result
+    until the workbook changes, so repeat requests only stat the workbook
+    and write bytes that are already compressed. Filtered responses are
+    cached too; the least recently used are dropped beyond max_entries.
+    """
+
+    def __init__(self, datasets, max_entries=512):
+        super().__init__(datasets, max_entries)
+
+    def _build(self, fn, d, params):
+        d = fn(d, params["filters"])
+        return Payload(encode_dataset(d, params["fmt"]), API_MEDIA_TYPES[params["fmt"]])
+
+
+PAYLOADS = PayloadCache(DATASETS)
+for _name in DATASETS.names():
+    PAYLOADS.register(_name, _name, filter_dataset)
+
+
+@functools.cache
+def plotly_bundle():
+    """FigureWidget's plotly.js bundle, served once per browser from /assets/."""
+    return Payload(str(go.FigureWidget._esm).encode(), "text/javascript")
+
+
+@functools.cache
+def _figure_widget_class(esm_url):
+    # anywidget keeps an http(s) _esm as a URL and the browser import()s
+    # it, instead of receiving the module's source in the widget state.
+    return type("FigureWidget", (go.FigureWidget,), {"_esm": esm_url})
+
+
+def _app_url(session):
+    """The app's absolute URL as the session's browser sees it, or None."""
+    parts = ("protocol", "hostname", "port", "pathname")
+    if not all(f".clientdata_url_{part}" in session.input for part in parts):
+        return None
+    clientdata = session.clientdata
+    with reactive.isolate():
+        protocol, host = clientdata.url_protocol(), clientdata.url_hostname()
+        port, path = clientdata.url_port(), clientdata.url_pathname()
+    port = f":{port}" if port else ""
+    return f"{protocol}//{host}{port}{path[: path.rfind('/') + 1]}"
+
+
+def figure_widget(fig):
+    """
+    The FigureWidget render_widget would make from `fig`. With SLIM_PAYLOADS
+    on, it loads plotly.js from /assets/, so the 5 MB bundle is downloaded
+    once and cached by the browser rather than sent with every chart.
+    Clients that do not report their URL get the bundle inline.
+    """
+    from shiny.session import get_current_session
+
+    session = get_current_session()
+    base = _app_url(session) if SLIM_PAYLOADS and session is not None else None
+    if base is None:
+        return go.FigureWidget(fig.data, fig.layout)
+    cls = _figure_widget_class(f"{base}assets/plotly-widget-{plotly_bundle().digest}.js")
+    return cls(fig.data, fig.layout)
+
+
+def _cache_samples():
+    caches = {
+        "datasets": DATASETS, "aggregates": AGGREGATES, "rollups": ROLLUPS, "cubes": CUBES, "measures": MEASURES,
+        "figures": FIGURES, "payloads": PAYLOADS,
+    }
+    for cache, registry in caches.items():
+        for event, count in registry.stats.items():
+            yield "lbdhhs_cache_events_total", {"cache": cache, "event": event}, count
+    yield "lbdhhs_sessions_active", {}, len(SessionMetrics.active)
+
+
+METRICS.add_collector(_cache_samples)
+
+
+def _api_error(status, message):
+    from starlette.responses import JSONResponse
+
+    return JSONResponse({"error": message}, status_code=status)
+
+
+def _api_response(request, payload, filename=None, cache_control="no-cache"):
+    """
+    `payload` as a response: 304 if the client already has it, gzipped if
+    the client accepts gzip. By default clients must revalidate (no-cache),
+    so a poll costs one round trip and no body while the data is unchanged.
+    """
+    from starlette.responses import Response
+
+    use_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag = payload.gzip_etag if use_gzip else payload.etag
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if filename:
+        headers["Content-Disposition"] = f'inline; filename="{filename}"'
+    match = {t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")}
+    if "*" in match or payload.etag in match or payload.gzip_etag in match:
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(payload.gzip_body, media_type=payload.media_type, headers=headers)
+    return Response(payload.body, media_type=payload.media_type, headers=headers)
+
+
+def _api_index_payload():
+    datasets = {}
+    for name in DATASETS.names():
+        d = DATASETS.get(name)
+        path, _ = DATASETS.source(name)
+        datasets[name] = {
+            "source": os.path.basename(path),
+            "rows": len(d),
+            "columns": list(d.columns),
+            "filters": [p for p, column in API_FILTERS.items() if column in d.columns],
+            "formats": list(API_MEDIA_TYPES),
+        }
+    return Payload(json.dumps({"datasets": datasets}, indent=2).encode(), API_MEDIA_TYPES["json"])
+
+
+async def api_index(request):
+    """GET /api/: every dataset with its columns and accepted filters."""
+    from starlette.concurrency import run_in_threadpool
+
+    return _api_response(request, await run_in_threadpool(_api_index_payload))
+
+
+async def api_dataset(request):
+    """
+    GET /api/<dataset>[.json|.csv|.arrow]?year=..&zip=..&race=..&gender=..
+
+    Filters may be repeated or comma-separated; rows must match one of the
+    values of every filter given. ZIP codes match with or without the "ZIP "
+    prefix, race and gender case-insensitively. Other query parameters (a
+    cache buster, say) are ignored.
+    """
+    from starlette.concurrency import run_in_threadpool
+
+    name, _, fmt = request.path_params["dataset"].partition(".")
+    fmt = fmt or "json"
+    if name not in DATASETS.names():
+        return _api_error(404, f"unknown dataset {name!r}")
+    if fmt not in API_MEDIA_TYPES:
+        return _api_error(404, f"unknown format {fmt!r}; use one of {', '.join(API_MEDIA_TYPES)}")
+
+    filters = []
+    for param in sorted(set(request.query_params) & set(API_FILTERS)):
+        values = {
+            _api_key(param, v)
+            for raw in request.query_params.getlist(param)
+            for v in raw.split(",")
+            if v.strip()
+        }
+        if param == "year" and not all(v.isdigit() for v in values):
+            return _api_error(400, f"year must be a whole number, not {request.query_params[param]!r}")
+        if values:
+            filters.append((param, tuple(sorted(values))))
+
+    def build():
+        columns = DATASETS.get(name).columns
+        for param, _ in filters:
+            if API_FILTERS[param] not in columns:
+                return None
+        return PAYLOADS.get(name, fmt=fmt, filters=tuple(filters))
+
+    payload = await run_in_threadpool(build)
+    if payload is None:
+        allowed = [p for p, column in API_FILTERS.items() if column in DATASETS.get(name).columns]
+        return _api_error(400, f"{name} accepts filters: {', '.join(allowed) or 'none'}")
+    return _api_response(request, payload, f"{name}.{fmt}")
+
+
+async def plotly_widget_bundle(request):
+    """
+    GET /assets/plotly-widget-<digest>.js: the module figure_widget() points
+    widgets at. The digest changes with the bundle, so it is cached for good.
+    """
+    from starlette.concurrency import run_in_threadpool
+
+    payload = await run_in_threadpool(plotly_bundle)
+    if request.path_params["digest"] != payload.digest:
+        return _api_error(404, "unknown bundle")
+    return _api_response(request, payload, cache_control="public, max-age=31536000, immutable")
+
+
+async def metrics(request):
+    """GET /metrics: METRICS in the Prometheus text format."""
+    from starlette.responses import PlainTextResponse
+
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+def http_routes():
+    """Routes served next to the Shiny app: the data API, /metrics and the plotly.js bundle."""
+    from starlette.routing import Mount, Route
+
+    return [
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/assets/plotly-widget-{digest}.js", plotly_widget_bundle, methods=["GET"]),
+        Route("/api", api_index, methods=["GET"]),
+        Mount(
+            "/api",
+            routes=[
+                Route("/", api_index, methods=["GET"]),
+                Route("/{dataset}", api_dataset, methods=["GET"]),
+            ],
+        ),
+    ]
+
+
+# Dataset behind each chart, for its "Download data" links.
+CHART_DATASETS = {
+    "summary_pop_trend": "trend",
+    "summary_race_pie": "race_2023",
+    "summary_zip_bar": "zip_2023",
+    "age_population_pyramid": "pyramid_2023",
+    "age_group_trends": "age_trends",
+    "race_pop_trends": "race_trends",
+    "race_age_dist": "race_age_dist",
+    "race_gender_dist": "race_gender_dist",
+    "geo_zip_bar_rank": "zip_2023",
+    "geo_zip_trends": "zip_trends",
+    "geo_zip_age_dist": "zip_gender_age",
+    "tract_map": "tracts_2021",
+    "tract_bar_rank": "tracts_2021",
+}
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+EXPORT_CHUNK_ROWS = 2000
+
+
+def _export_chunks(d, filters):
+    """
+    Row chunks of `d` matching `filters` ({column: allowed values}). Only
+    the boolean mask and one chunk at a time are ever copied.
+    """
+    mask = np.ones(len(d), dtype=bool)
+    for column, values in filters.items():
+        mask &= d[column].isin(list(values)).to_numpy()
+    for start in range(0, len(d), EXPORT_CHUNK_ROWS):
+        stop = start + EXPORT_CHUNK_ROWS
+        yield d.iloc[start:stop][mask[start:stop]]
+
+
+def iter_export(dataset, filters, fmt, measure=None):
+    """
+    Blocking generator of file chunks for `dataset` as CSV or XLSX. The
+    export of a trend chart showing a TREND_MEASURES `measure` other than
+    the counts gets a column of it, named by its axis title.
+    """
+    d = DATASETS.get(dataset)
+    if measure not in (None, "absolute"):
+        d = d.assign(**{TREND_MEASURES[measure][1]: MEASURES.get(dataset).column(measure, d)})
+    if fmt == "csv":
+        yield d.iloc[:0].to_csv(index=False)
+        for chunk in _export_chunks(d, filters):
+            yield chunk.to_csv(index=False, header=False)
+        return
+
+    import tempfile
+    from openpyxl import Workbook
+
+    # A write-only workbook spools rows to disk as they are appended; the
+    # finished file is then read back in pieces.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(dataset)
+    ws.append(list(d.columns))
+    for chunk in _export_chunks(d, filters):
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            ws.append(row)
+    with tempfile.TemporaryFile() as fh:
+        wb.save(fh)
+        fh.seek(0)
+        while block := fh.read(1 << 16):
+            yield block
+
+
+async def _iter_in_thread(chunks):
+    """Advance a blocking generator on a worker thread, one item at a time."""
+    done = object()
+    while (chunk := await asyncio.to_thread(next, chunks, done)) is not done:
+        yield chunk
+
+
+# Charts that take part in cross-filtering: chart -> (column the traces
+# stand for, column along the category axis), None where there is none.
+# Clicking or box-selecting points selects their labels in the columns
+# listed in CROSS_FILTER_COLUMNS, for every chart in the session.
+CROSS_FILTER_CHARTS = {
+    "summary_race_pie": (None, "Race/Ethnicity"),
+    "summary_zip_bar": (None, "ZIP Code"),
+    "age_population_pyramid": ("Gender", "Age Group"),
+    "age_group_trends": ("Age Group", "Year"),
+    "race_pop_trends": ("Race/Ethnicity", "Year"),
+    "race_age_dist": ("Age Group", "Race/Ethnicity"),
+    "race_gender_dist": ("Gender", "Race/Ethnicity"),
+    "geo_zip_bar_rank": (None, "ZIP Code"),
+    "geo_zip_age_dist": ("Age Group", "ZIP Code"),
+}
+CROSS_FILTER_COLUMNS = ("ZIP Code", "Race/Ethnicity", "Age Group", "Gender")
+
+
+def _axis_labels(trace):
+    if trace.type == "pie":
+        labels = trace.labels
+    else:
+        labels = trace.y if trace.orientation == "h" else trace.x
+    labels = _decode_array(labels)
+    return labels.tolist() if hasattr(labels, "tolist") else list(labels)
+
+
+def picked_keys(rollup, chart_id, traces):
+    """
+    Canonical keys of the points picked in a chart, {column: frozenset},
+    from (trace, point indices) pairs.
+    """
+    trace_col, axis_col = CROSS_FILTER_CHARTS[chart_id]
+    picked = {}
+    for trace, point_inds in traces:
+        if not point_inds:
+            continue
+        if trace_col in CROSS_FILTER_COLUMNS:
+            picked.setdefault(trace_col, set()).add(rollup.key(trace_col, trace.name))
+        if axis_col in CROSS_FILTER_COLUMNS:
+            labels = _axis_labels(trace)
+            picked.setdefault(axis_col, set()).update(rollup.key(axis_col, labels[i]) for i in point_inds)
+    return {col: frozenset(keys) for col, keys in picked.items()}
+
+
+def update_cross_filter(selection, chart_id, picked):
+    """
+    The session's cross-filter ({column: (keys, chart)}) after `chart_id`
+    reports the keys in `picked`: they replace what the chart picked
+    before, or clear it if the same points are picked again or none are.
+    """
+    mine = {col: keys for col, (keys, source) in selection.items() if source == chart_id}
+    rest = {col: entry for col, entry in selection.items() if entry[1] != chart_id}
+    if not picked or picked == mine:
+        return rest
+    return {**rest, **{col: (keys, chart_id) for col, keys in picked.items()}}
+
+
+def cross_filter_rows(rollup, chart_id, selection):
+    """
+    Split the session's cross-filter for one chart into the labels its
+    rows are filtered to (columns picked in other charts) and the labels
+    it highlights (columns picked in the chart itself, and the slices of
+    a pie, which would say nothing filtered to one slice).
+    """
+    filters, highlight = {}, {}
+    pie = chart_id == "summary_race_pie"
+    for col, (keys, source) in selection.items():
+        if col in rollup.axes:
+            target = highlight if source == chart_id or (pie and col == CROSS_FILTER_CHARTS[chart_id][1]) else filters
+            target[col] = rollup.match(col, keys)
+    return filters, highlight
+
+
+def show_cross_filter(fig, base, rollup, chart_id, selection, where=None):
+    """
+    Restyle a CROSS_FILTER_CHARTS chart for the session's cross-filter.
+
+    `base` holds each trace's name and axis labels as first rendered. Axis
+    labels and traces outside the filters are dropped (traces by hiding
+    them) and the counts are looked up in `rollup` with the filters and
+    `where` (e.g. the year and gender inputs) applied. Highlighted labels
+    are shown as the selected points, or pulled out of a pie.
+    """
+    trace_col, axis_col = CROSS_FILTER_CHARTS[chart_id]
+    filters, highlight = cross_filter_rows(rollup, chart_id, selection)
+    filters.update(where or {})
+    by = [col for col in (trace_col, axis_col) if col is not None]
+    axes, counts = rollup.lookup(by, filters)
+    for trace, (name, labels) in zip(fig.data, base):
+        if trace_col is not None:
+            if name not in axes[0]:
+                trace.visible = False
+                continue
+            trace.visible = None
+            row = counts[axes[0].get_loc(name)]
+        else:
+            row = counts
+        if axis_col in filters:
+            labels = [label for label in labels if label in set(filters[axis_col])]
+        values = row[axes[-1].get_indexer(labels)]
+        picked = set(highlight.get(axis_col, labels))
+        selected = [i for i, label in enumerate(labels) if label in picked]
+        faded = trace_col in highlight and name not in highlight[trace_col]
+        if faded:
+            selected = []
+        if trace.type != "pie":
+            # Lines and areas have no selected points to show; fade the trace.
+            trace.opacity = 0.35 if faded else None
+        if trace.type == "pie":
+            trace.labels, trace.values = labels, values
+            trace.pull = [0.08 if i in selected else 0 for i in range(len(labels))] if highlight else None
+        elif trace.orientation == "h":
+            trace.y, trace.x = labels, values
+            trace.selectedpoints = selected if highlight else None
+        else:
+            trace.x, trace.y = labels, values
+            trace.selectedpoints = selected if highlight else None
+
+
+def describe_cross_filter(selection):
+    """One line naming the labels the session's cross-filter picked."""
+    parts = []
+    for col, (keys, _) in selection.items():
+        if col == "Age Group":
+            names = [
+                f"{lo}+" if hi == float("inf") else f"{lo}" if hi == lo + 1 else f"{lo}–{hi - 1}"
+                for lo, hi in sorted(keys)
+            ]
+        else:
+            names = sorted(keys)
+        parts.append(f"{col}: {', '.join(names)}")
+    return "; ".join(parts)
+
+
+def chart_output(chart_id):
+    """A chart's widget with links to download the data behind it."""
+    return ui.div(
+        output_widget(chart_id),
+        ui.div(
+            "Download data: ",
+            ui.download_link(f"{chart_id}_csv", "CSV"),
+            " · ",
+            ui.download_link(f"{chart_id}_xlsx", "XLSX"),
+            class_="small text-end",
+        ),
+    )
+
+
+TABS = ("summary", "age", "race", "geo", "tracts")
+
+# Datasets behind each tab's outputs. Their workbooks start loading in the
+# background when the tab is first opened.
+TAB_DATASETS = {
+    "summary": ("trend", "race_2023", "zip_2023", "pyramid_2023"),
+    "age": ("pyramid_2023", "age_trends"),
+    "race": ("race_trends", "race_age_dist", "race_gender_dist"),
+    "geo": ("zip_2023", "zip_trends", "zip_gender_age"),
+    "tracts": ("tracts_2021",),
+}
+
+app_ui = ui.page_navbar(
+    ui.nav_panel(
+        "Summary Overview",
+        ui.tags.h2("Summary Overview (2023)"),
+        ui.layout_columns(
+            ui.value_box("Total Population", ui.output_text("kpi_total"), theme="primary"),
+            ui.value_box("Male Population", ui.output_text("kpi_male")),
+            ui.value_box("Female Population", ui.output_text("kpi_female")),
+            ui.value_box("Largest Age Group", ui.output_text("kpi_largest_age_group")),
+        ),
+        ui.layout_columns(
+            chart_output("summary_pop_trend"),
+            chart_output("summary_race_pie"),
+        ),
+        ui.layout_columns(
+            chart_output("summary_zip_bar"),
+        ),
+        value="summary",
+    ),
+    ui.nav_panel(
+        "Age & Gender Deep Dive",
+        ui.tags.h2("Age & Gender Deep Dive (2023)"),
+        ui.layout_columns(
+            chart_output("age_population_pyramid"),
+            ui.div(
+                ui.input_radio_buttons("age_measure", "Show:", choices=measure_choices("age_group_trends"), inline=True),
+                chart_output("age_group_trends"),
+            ),
+        ),
+        value="age",
+    ),
+    ui.nav_panel(
+        "Race & Ethnicity Deep Dive",
+        ui.tags.h2("Race & Ethnicity Deep Dive"),
+        ui.layout_columns(
+            ui.div(
+                ui.input_radio_buttons("race_measure", "Show:", choices=measure_choices("race_pop_trends"), inline=True),
+                chart_output("race_pop_trends"),
+            ),
+        ),
+        ui.layout_columns(
+            chart_output("race_age_dist"),
+            chart_output("race_gender_dist"),
+        ),
+        value="race",
+    ),
+    ui.nav_panel(
+        "Geographic Deep Dive",
+        ui.tags.h2("Geographic Deep Dive (ZIP Code)"),
+        ui.layout_columns(
+            chart_output("geo_zip_bar_rank"),
+        ),
+        ui.layout_columns(
+            ui.card(
+                ui.tags.h4("Population Trends by ZIP Code"),
+                ui.input_selectize(
+                    "zip_select",
+                    "Select ZIP Codes:",
+                    choices=ZIP_CODES_LABEL,
+                    selected=DEFAULT_ZIPS,
+                    multiple=True,
+                ),
+                ui.input_radio_buttons("zip_measure", "Show:", choices=measure_choices("geo_zip_trends"), inline=True),
+                chart_output("geo_zip_trends"),
+            ),
+            ui.card(
+                ui.tags.h4("Age Distribution by ZIP Code"),
+                ui.layout_columns(
+                    ui.input_select("geo_year", "Year:", choices=["2023"]),
+                    ui.input_radio_buttons(
+                        "geo_gender", "Gender:", choices=list(ZipCube.GENDERS), selected="Total", inline=True
+                    ),
+                ),
+                chart_output("geo_zip_age_dist"),
+            ),
+        ),
+        value="geo",
+    ),
+    ui.nav_panel(
+        "Census Tracts",
+        ui.tags.h2("Census Tracts (2021)"),
+        ui.layout_columns(
+            ui.input_selectize(
+                "tract_zip",
+                "Show tracts in ZIP codes (all when empty):",
+                choices=[],
+                multiple=True,
+            ),
+            ui.output_text("tract_note"),
+        ),
+        ui.layout_columns(
+            chart_output("tract_map"),
+            chart_output("tract_bar_rank"),
+        ),
+        value="tracts",
+    ),
+    title="Long Beach Demographic Dashboard",
+    id="navbar",
+    header=ui.div(
+        ui.output_text("cross_filter_status", inline=True),
+        " ",
+        ui.input_action_link("clear_cross_filter", "Clear"),
+        class_="small text-muted px-3 pt-2",
+    ),
+    footer=ui.tags.p(
+        "Data sourced from 2023 ACS 5-Year Estimates Excel workbooks.",
+        style="text-align: center; margin-top: 20px;",
+    ),
+)
+
+
+def server(input, output, session):
+    # Per-session counts for /metrics and the session log line.
+    SessionMetrics(session)
+
+    # Outputs wait until their tab has been opened once, so a new session
+    # only loads the workbooks and builds the figures behind the Summary tab.
+    opened = {tab: reactive.value(tab == "summary") for tab in TABS}
+
+    @reactive.effect
+    @instrument("effect")
+    def track_opened_tabs():
+        opened[input.navbar()].set(True)
+
+    def require_tab(tab):
+        req(opened[tab]())
+
+    # Cross-filter shared by the session's charts: column -> (canonical
+    # keys, chart they were picked in). See CROSS_FILTER_CHARTS.
+    cross_filter = reactive.value({})
+    rendered_labels = {}  # chart -> [(trace name, axis labels)] as rendered
+    shown = {}  # chart -> (cross-filter, other filters, measure) its widget shows
+
+    def cross_filtered(chart_id, widget, where=None, measure=None):
+        """
+        Note `widget`'s labels and feed its clicks and selections into
+        cross_filter. `where` holds the filters it was built with and
+        `measure` the TREND_MEASURES key it plots, if it has a toggle.
+        """
+        rendered_labels[chart_id] = [(trace.name, _axis_labels(trace)) for trace in widget.data]
+        shown[chart_id] = ({}, where or {}, measure)
+        pending = []
+
+        def on_points(trace, points, *_):
+            # plotly calls this once per trace, in trace order, per event.
+            pending.append((trace, points.point_inds))
+            if points.trace_index == len(widget.data) - 1:
+                picked = picked_keys(ROLLUPS.get(CHART_DATASETS[chart_id]), chart_id, pending)
+                pending.clear()
+                cross_filter.set(update_cross_filter(cross_filter.get(), chart_id, picked))
+
+        for trace in widget.data:
+            trace.on_click(on_points)
+            trace.on_selection(on_points)
+            trace.on_deselect(on_points)
+        return widget
+
+    @render.text
+    @instrument("output")
+    def cross_filter_status():
+        selection = cross_filter()
+        if not selection:
+            return "Click or box-select bars, slices and lines to filter the other charts."
+        return f"Filtered to {describe_cross_filter(selection)}."
+
+    @reactive.effect
+    @reactive.event(input.clear_cross_filter)
+    @instrument("effect")
+    def clear_cross_filter():
+        cross_filter.set({})
+
+    # One ExtendedTask per workbook loads all of its datasets on the
+    # registry's thread pool, off the event loop. Until a workbook is ready
+    # its outputs show as busy; each chart fills in as soon as its own
+    # workbook is done, whatever the others are doing.
+    def workbook_loader(path):
+        @reactive.extended_task
+        async def load():
+            return await asyncio.wrap_future(DATASETS.submit(path))
+
+        return load
+
+    loads = {path: workbook_loader(path) for path in DATASETS.paths()}
+    load_signatures = {}  # path -> signature of the workbook last loaded
+
+    @reactive.effect
+    @instrument("effect")
+    def start_loads():
+        signatures = dict(data_version())
+        for tab in TABS:
+            if not opened[tab]():
+                continue
+            for name in TAB_DATASETS[tab]:
+                path, _ = DATASETS.source(name)
+                if load_signatures.get(path) != signatures[path]:
+                    load_signatures[path] = signatures[path]
+                    loads[path].invoke()
+
+    def dataset(name):
+        path, _ = DATASETS.source(name)
+        return loads[path].result()[name]
+
+    @reactive.Calc
+    @instrument("calc")
+    def kpis():
+        dataset("pyramid_2023")
+        return AGGREGATES.get("summary_kpis")
+
+    @output
+    @render.text
+    @instrument("output")
+    def kpi_total():
+        return kpi_texts(kpis())["total"]
+
+    @output
+    @render.text
+    @instrument("output")
+    def kpi_male():
+        return kpi_texts(kpis())["male"]
+
+    @output
+    @render.text
+    @instrument("output")
+    def kpi_female():
+        return kpi_texts(kpis())["female"]
+
+    @output
+    @render.text
+    @instrument("output")
+    def kpi_largest_age_group():
+        return kpi_texts(kpis())["largest_age_group"]
 
     @output
     @render_widget
+    @instrument("output")
+    def summary_pop_trend():
+        require_tab("summary")
+        dataset("trend")
+        return figure_widget(FIGURES.get("pop_trend"))
+
+    @output
+    @render_widget
+    @instrument("output")
+    def summary_race_pie():
+        require_tab("summary")
+        dataset("race_2023")
+        return cross_filtered("summary_race_pie", figure_widget(FIGURES.get("race_pie")))
+
+    @output
+    @render_widget
+    @instrument("output")
+    def summary_zip_bar():
+        require_tab("summary")
+        dataset("zip_2023")
+        return cross_filtered("summary_zip_bar", figure_widget(FIGURES.get("zip_bar_2023")))
+
+    @output
+    @render_widget
+    @instrument("output")
+    def age_population_pyramid():
+        require_tab("age")
+        dataset("pyramid_2023")
+        return cross_filtered("age_population_pyramid", figure_widget(FIGURES.get("population_pyramid")))
+
+    @output
+    @render_widget
+    @instrument("output")
     def age_group_trends():
-        d = df_age_trends()
-        if d.empty:
-            return go.Figure().update_layout(title="Population Change by Age Group (2019–2023) — no data")
-        fig = px.area(d, x="Year", y="Population", color="Age Group", title="Population Change by Age Group (2019–2023)")
-        return fig
+        require_tab("age")
+        dataset("age_trends")
+        return cross_filtered("age_group_trends", figure_widget(FIGURES.get("age_group_trends")), measure="absolute")
 
     @output
     @render_widget
+    @instrument("output")
     def race_pop_trends():
-        d = df_race_trends()
-        if d.empty:
-            return go.Figure().update_layout(title="Population Trends by Race/Ethnicity (2017–2023) — no data")
-        fig = px.line(d, x="Year", y="Population", color="Race/Ethnicity", title="Population Trends by Race/Ethnicity (2017–2023)", markers=True)
-        return fig
+        require_tab("race")
+        dataset("race_trends")
+        return cross_filtered("race_pop_trends", figure_widget(FIGURES.get("race_pop_trends")), measure="absolute")
 
     @output
     @render_widget
+    @instrument("output")
     def race_age_dist():
-        d = df_race_age_dist()
-        if d.empty:
-            return go.Figure().update_layout(title="Age Distribution by Race/Ethnicity (2023) — no data")
-        fig = px.bar(d, x="Race/Ethnicity", y="Population", color="Age Group", title="Age Distribution by Race/Ethnicity (2023)", barmode="stack")
-        return fig
+        require_tab("race")
+        dataset("race_age_dist")
+        return cross_filtered("race_age_dist", figure_widget(FIGURES.get("race_age_dist")))
 
     @output
     @render_widget
+    @instrument("output")
     def race_gender_dist():
-        d = df_race_gender_dist()
-        if d.empty:
-            return go.Figure().update_layout(title="Gender by Race/Ethnicity (2023) — no data")
-        fig = px.bar(d, x="Race/Ethnicity", y="Population", color="Gender", title="Gender by Race/Ethnicity (2023)", barmode="group")
-        return fig
-
+        require_tab("race")
+        dataset("race_gender_dist")
+        return cross_filtered("race_gender_dist", figure_widget(FIGURES.get("race_gender_dist")))
 
     @output
     @render_widget
+    @instrument("output")
     def geo_zip_bar_rank():
-        d = df_zip_2023()
-        if d.empty:
-            return go.Figure().update_layout(title="Population by ZIP Code (2023) — no data")
-        d = d.sort_values("Population", ascending=True)
-        return px.bar(d, x="Population", y="ZIP Code", title="Population by ZIP Code (2023)", orientation="h")
+        require_tab("geo")
+        dataset("zip_2023")
+        return cross_filtered("geo_zip_bar_rank", figure_widget(FIGURES.get("zip_bar_2023")))
 
     @output
     @render_widget
+    @instrument("output")
     def geo_zip_trends():
-        selected = input.zip_select()
-        d = df_zip_trends()
-        if not selected:
-            return go.Figure().update_layout(title="Please select at least one ZIP code.")
-        if d.empty:
-            return go.Figure().update_layout(title="Selected ZIP Code Population Trends — no data")
-        d = d[d["ZIP Code"].isin(selected)]
-        fig = px.line(d, x="Year", y="Population", color="ZIP Code", title="Selected ZIP Code Population Trends", markers=True)
+        # Rendered once per load of the workbook with a trace for every ZIP code; the
+        # selection only changes which traces are visible (see below).
+        require_tab("geo")
+        dataset("zip_trends")
+        fig = figure_widget(FIGURES.get("zip_trends"))
+        with reactive.isolate():
+            show_zip_traces(fig, input.zip_select())
+        shown["geo_zip_trends"] = "absolute"
         return fig
 
+    @reactive.effect
+    @instrument("effect")
+    def update_zip_trends():
+        # Restyle the widget already in the browser instead of re-rendering
+        # it: FigureWidget sends only the changed trace properties.
+        selected = input.zip_select()
+        widget = geo_zip_trends.widget
+        with widget.batch_update():
+            show_zip_traces(widget, selected)
+
+    @reactive.effect
+    @instrument("effect")
+    def update_zip_trend_measure():
+        # Switching measure swaps each line's values for ones MEASURES has
+        # already computed for every ZIP code.
+        measure = input.zip_measure()
+        widget = geo_zip_trends.widget
+        if not widget.data or shown["geo_zip_trends"] == measure:
+            return
+        with widget.batch_update():
+            show_trend_measure(widget, MEASURES.get("zip_trends"), measure)
+        shown["geo_zip_trends"] = measure
+
+    @reactive.Calc
+    @instrument("calc")
+    def zip_cube():
+        dataset("zip_gender_age")
+        return CUBES.get("zip_gender_age")
+
     @output
     @render_widget
+    @instrument("output")
     def geo_zip_age_dist():
-        d = df_zip_age_dist()
-        if d.empty:
-            return go.Figure().update_layout(title="Age Distribution by ZIP Code (2023) — no data")
-        fig = px.bar(d, x="ZIP Code", y="Population", color="Age Group", title="Age Distribution by ZIP Code (2023)", barmode="stack")
-        fig.update_xaxes(categoryorder="total descending")
-        return fig
+        # Rendered once per load of the workbook; year, gender and cross-filter
+        # changes restyle the widget from the dataset's rollup instead (see below).
+        require_tab("geo")
+        dataset("zip_gender_age")
+        with reactive.isolate():
+            year, gender = int(input.geo_year()), input.geo_gender()
+        widget = figure_widget(FIGURES.get("zip_age_dist", year=year, gender=gender))
+        return cross_filtered("geo_zip_age_dist", widget, where={"Year": [year], "Gender": [gender]})
+
+    @reactive.effect
+    @instrument("effect")
+    def update_zip_age_dist():
+        year, gender = int(input.geo_year()), input.geo_gender()
+        widget = geo_zip_age_dist.widget
+        state = (cross_filter(), {"Year": [year], "Gender": [gender]}, None)
+        if not widget.data or shown["geo_zip_age_dist"] == state:
+            return
+        rollup = ROLLUPS.get("zip_gender_age")
+        with widget.batch_update():
+            show_cross_filter(widget, rendered_labels["geo_zip_age_dist"], rollup, "geo_zip_age_dist", *state[:2])
+            widget.layout.title.text = _zip_age_title(year, gender)
+        shown["geo_zip_age_dist"] = state
+
+    def register_cross_filter(chart_id, output, measure=None, area=False):
+        # `measure` is the chart's measure toggle, if it has one.
+        def update():
+            state = (cross_filter(), {}, measure() if measure else None)
+            widget = output.widget
+            if not widget.data or shown[chart_id] == state:
+                return
+            rollup = ROLLUPS.get(CHART_DATASETS[chart_id])
+            with widget.batch_update():
+                show_cross_filter(widget, rendered_labels[chart_id], rollup, chart_id, *state[:2])
+                if measure:
+                    show_trend_measure(widget, MEASURES.get(CHART_DATASETS[chart_id]), state[2], area)
+            shown[chart_id] = state
+
+        # Named per chart, for /metrics.
+        update.__name__ = f"update_cross_filter_{chart_id}"
+        reactive.effect(instrument("effect")(update))
+
+    cross_filter_outputs = {
+        "summary_race_pie": summary_race_pie,
+        "summary_zip_bar": summary_zip_bar,
+        "age_population_pyramid": age_population_pyramid,
+        "age_group_trends": age_group_trends,
+        "race_pop_trends": race_pop_trends,
+        "race_age_dist": race_age_dist,
+        "race_gender_dist": race_gender_dist,
+        "geo_zip_bar_rank": geo_zip_bar_rank,
+    }
+    # Trend charts with a measure toggle: chart -> (input, area chart).
+    measure_inputs = {
+        "age_group_trends": (input.age_measure, True),
+        "race_pop_trends": (input.race_measure, False),
+    }
+    for chart_id, chart in cross_filter_outputs.items():
+        register_cross_filter(chart_id, chart, *measure_inputs.get(chart_id, ()))
+
+    # Each chart's export has the rows the chart shows: the same dataset,
+    # with the filters its inputs apply (columns -> allowed values).
+    export_filters = {
+        "geo_zip_trends": lambda: {"ZIP Code": input.zip_select()},
+        "geo_zip_age_dist": lambda: {"Year": [int(input.geo_year())], "Gender": [input.geo_gender()]},
+        "tract_map": lambda: {} if tract_filter() is None else {"Census Tract": tract_filter()},
+        "tract_bar_rank": lambda: {} if tract_filter() is None else {"Census Tract": tract_filter()},
+    }
+    # Trend charts export the measure they show, named in the file name too.
+    export_measures = {
+        "age_group_trends": input.age_measure,
+        "race_pop_trends": input.race_measure,
+        "geo_zip_trends": input.zip_measure,
+    }
+
+    def register_export(chart_id, fmt):
+        measure = export_measures.get(chart_id, lambda: None)
+
+        def filename():
+            suffix = "" if measure() in (None, "absolute") else f"_{measure()}"
+            return f"{chart_id}{suffix}.{fmt}"
+
+        @output(id=f"{chart_id}_{fmt}")
+        @render.download_link(filename=filename, media_type=EXPORT_MEDIA_TYPES[fmt])
+        @instrument("download", name=f"{chart_id}_{fmt}")
+        async def export():
+            # Inputs are read here, on the session; the frame is sliced and
+            # encoded on a worker thread so other sessions are not held up.
+            filters = export_filters.get(chart_id, dict)()
+            if chart_id in CROSS_FILTER_CHARTS:
+                rollup = ROLLUPS.get(CHART_DATASETS[chart_id])
+                filters = {**cross_filter_rows(rollup, chart_id, cross_filter())[0], **filters}
+            chunks = iter_export(CHART_DATASETS[chart_id], filters, fmt, measure())
+            async for chunk in _iter_in_thread(chunks):
+                yield chunk
+
+    for chart_id in CHART_DATASETS:
+        for fmt in EXPORT_MEDIA_TYPES:
+            register_export(chart_id, fmt)
+
+    @reactive.effect
+    @instrument("effect")
+    def update_geo_years():
+        # Offer every year in the sheet, newest first; keep the current
+        # choice if the workbook still has it.
+        require_tab("geo")
+        years = [str(y) for y in zip_cube().years[::-1]]
+        if not years:
+            return
+        with reactive.isolate():
+            current = input.geo_year()
+        ui.update_select("geo_year", choices=years, selected=current if current in years else years[0])
+
+    @reactive.Calc
+    @instrument("calc")
+    def tract_filter():
+        return tracts_in_zips(input.tract_zip())
+
+    @render.text
+    @instrument("output")
+    def tract_note():
+        geometry = tract_geometry()
+        if geometry is None:
+            return "Tract outlines have not been built, so there is no map (see README 5.2.8)."
+        if not geometry.get("zip_index"):
+            return "No tract-to-ZIP index was built, so tracts cannot be filtered by ZIP code."
+        return "A tract is shown for a ZIP code when a quarter or more of its area lies in it."
+
+    @reactive.effect
+    @instrument("effect")
+    def update_tract_zips():
+        require_tab("tracts")
+        geometry = tract_geometry()
+        index = (geometry or {}).get("zip_index") or {}
+        found = {label for shares in index.values() for label, _ in shares}
+        zips = [z for z in ZIP_CODES_LABEL if z in found] + sorted(found - set(ZIP_CODES_LABEL))
+        ui.update_selectize("tract_zip", choices=zips)
+
+    @output
+    @render_widget
+    @instrument("output")
+    def tract_map():
+        # Rendered once per load of the workbook with the coarsest outlines;
+        # zooming in swaps in finer ones and the ZIP filter restyles the
+        # tracts shown (see below).
+        require_tab("tracts")
+        d = dataset("tracts_2021")
+        widget = figure_widget(FIGURES.get("tract_map"))
+        with reactive.isolate():
+            show_tracts(widget, d, tract_filter())
+        if not widget.data:
+            return widget
+        detail = tract_detail(None)
+
+        def show_detail(layout, scale):
+            nonlocal detail
+            if tract_detail(scale) != detail:
+                detail = tract_detail(scale)
+                widget.data[0].geojson = tract_geometry()["levels"][detail]
+
+        widget.layout.on_change(show_detail, "geo.projection.scale")
+        return widget
+
+    @output
+    @render_widget
+    @instrument("output")
+    def tract_bar_rank():
+        require_tab("tracts")
+        d = dataset("tracts_2021")
+        widget = figure_widget(FIGURES.get("tract_bar"))
+        with reactive.isolate():
+            show_tracts(widget, d, tract_filter())
+        return widget
+
+    @reactive.effect
+    @instrument("effect")
+    def update_tracts():
+        tracts = tract_filter()
+        d = dataset("tracts_2021")
+        for chart in (tract_map, tract_bar_rank):
+            widget = chart.widget
+            with widget.batch_update():
+                show_tracts(widget, d, tracts)
+
+
+def http_app(shiny_app):
+    """
+    The ASGI app to serve: the routes of http_routes() first, then the
+    Shiny app mounted at "/" for everything else. Shiny's lifespan still
+    runs, so its shutdown callbacks are called.
+    """
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+
+    return Starlette(
+        routes=[*http_routes(), Mount("/", app=shiny_app)],
+        lifespan=shiny_app.starlette_app.router.lifespan_context,
+    )
+
+
+shiny_app = App(app_ui, server)
+app = http_app(shiny_app)
+
+
+# Static build: the dashboard as one HTML file that any static host can
+# serve, with no Python behind it (python -m app build-static).
+
+STATIC_DIR = "static"
+STATIC_PAGE = "index.html"
+# The page's script and style, inlined into it at build time.
+STATIC_ASSETS = "static_page"
+
+# The dashboard's tabs as laid out in app_ui: (value, nav label, heading,
+# rows of charts). "kpis" stands for the row of value boxes.
+STATIC_TABS = (
+    ("summary", "Summary Overview", "Summary Overview (2023)", (
+        ("kpis",), ("summary_pop_trend", "summary_race_pie"), ("summary_zip_bar",),
+    )),
+    ("age", "Age & Gender Deep Dive", "Age & Gender Deep Dive (2023)", (
+        ("age_population_pyramid", "age_group_trends"),
+    )),
+    ("race", "Race & Ethnicity Deep Dive", "Race & Ethnicity Deep Dive", (
+        ("race_pop_trends",), ("race_age_dist", "race_gender_dist"),
+    )),
+    ("geo", "Geographic Deep Dive", "Geographic Deep Dive (ZIP Code)", (
+        ("geo_zip_bar_rank",), ("geo_zip_trends", "geo_zip_age_dist"),
+    )),
+    ("tracts", "Census Tracts", "Census Tracts (2021)", (
+        ("tract_map", "tract_bar_rank"),
+    )),
+)
+
+# Chart -> the FIGURES entry server() renders it from.
+STATIC_FIGURES = {
+    "summary_pop_trend": "pop_trend",
+    "summary_race_pie": "race_pie",
+    "summary_zip_bar": "zip_bar_2023",
+    "age_population_pyramid": "population_pyramid",
+    "age_group_trends": "age_group_trends",
+    "race_pop_trends": "race_pop_trends",
+    "race_age_dist": "race_age_dist",
+    "race_gender_dist": "race_gender_dist",
+    "geo_zip_bar_rank": "zip_bar_2023",
+    "geo_zip_trends": "zip_trends",
+    "geo_zip_age_dist": "zip_age_dist",
+    "tract_map": "tract_map",
+    "tract_bar_rank": "tract_bar",
+}
+
+# Inputs of the static page, by chart: the input names a view is keyed on.
+STATIC_INPUTS = {
+    "age_group_trends": ("age_measure",),
+    "race_pop_trends": ("race_measure",),
+    "geo_zip_trends": ("zip_measure",),
+    "geo_zip_age_dist": ("geo_year", "geo_gender"),
+}
+
+
+def _restyle(fig, attrs, paths):
+    """
+    Plotly.restyle and Plotly.relayout arguments that set `attrs` of every
+    trace and the layout properties at the dotted `paths` to `fig`'s.
+    """
+    data = {}
+    for attr in attrs:
+        values = [getattr(trace, attr) for trace in fig.data]
+        data[attr] = [np.round(v, 3) if isinstance(v, np.ndarray) and v.dtype.kind == "f" else v for v in values]
+    return {"data": data, "layout": {path: fig.layout[path] for path in paths}}
+
+
+def static_views():
+    """
+    Every state the static page's inputs can put a chart in, precomputed
+    with the same helpers as the server's in-place updates: chart ->
+    {"inputs": input names, "views": {"value|value": restyle arguments}}.
+    """
+    views = {}
+    for chart_id in ("age_group_trends", "race_pop_trends", "geo_zip_trends"):
+        name = STATIC_FIGURES[chart_id]
+        measures = MEASURES.get(FIGURES.source(name)[0])
+        area = chart_id == "age_group_trends"
+        chart_views = {}
+        for measure in CHART_MEASURES[chart_id]:
+            fig = FIGURES.get(name)
+            if not fig.data:
+                break
+            show_trend_measure(fig, measures, measure, area)
+            attrs = ("y", "hovertemplate", "stackgroup") if area else ("y", "hovertemplate")
+            chart_views[measure] = _restyle(fig, attrs, ("yaxis.title.text", "yaxis.ticksuffix"))
+        views[chart_id] = {"inputs": STATIC_INPUTS[chart_id], "views": chart_views}
+
+    years = static_zip_years()
+    rollup = ROLLUPS.get("zip_gender_age")
+    chart_views = {}
+    if years:
+        base = FIGURES.get("zip_age_dist", year=years[-1])
+        labels = [(trace.name, _axis_labels(trace)) for trace in base.data]
+        for year in years:
+            for gender in ZipCube.GENDERS:
+                fig = FIGURES.get("zip_age_dist", year=years[-1])
+                show_cross_filter(fig, labels, rollup, "geo_zip_age_dist", {}, {"Year": [year], "Gender": [gender]})
+                fig.layout.title.text = _zip_age_title(year, gender)
+                # Without a cross-filter the ZIP codes along x stay the same.
+                chart_views[f"{year}|{gender}"] = _restyle(fig, ("y", "visible"), ("title.text",))
+    views["geo_zip_age_dist"] = {"inputs": STATIC_INPUTS["geo_zip_age_dist"], "views": chart_views}
+    return views
+
+
+def static_zip_years():
+    """Years of the ZIP, gender and age sheet, oldest first."""
+    d = DATASETS.get("zip_gender_age")
+    return [] if d.empty else [int(year) for year in CUBES.get("zip_gender_age").years]
+
+
+def _static_asset(name):
+    """A file of STATIC_ASSETS, as text."""
+    with open(os.path.join(STATIC_ASSETS, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def _static_controls(chart_id, years):
+    """The inputs shown above a chart on the static page, as HTML."""
+    def radios(name, choices, selected):
+        return "".join(
+            f'<label><input type="radio" name="{name}" value="{html.escape(str(value))}"'
+            f'{" checked" if value == selected else ""}> {html.escape(label)}</label>'
+            for value, label in choices.items()
+        )
+
+    controls = ""
+    if chart_id == "geo_zip_trends":
+        zips = "".join(
+            f'<label><input type="checkbox" name="zip_select" value="{z}"'
+            f'{" checked" if z in DEFAULT_ZIPS else ""}> {z}</label>'
+            for z in ZIP_CODES_LABEL
+        )
+        controls += f'<div class="controls"><span>ZIP codes:</span>{zips}</div>'
+    if chart_id in CHART_MEASURES:
+        measures = radios(STATIC_INPUTS[chart_id][0], measure_choices(chart_id), "absolute")
+        controls += f'<div class="controls"><span>Show:</span>{measures}</div>'
+    if chart_id == "geo_zip_age_dist":
+        options = "".join(f'<option value="{y}">{y}</option>' for y in years[::-1])
+        genders = radios("geo_gender", {g: g for g in ZipCube.GENDERS}, "Total")
+        controls += f'<div class="controls"><label>Year: <select name="geo_year">{options}</select></label>{genders}</div>'
+    return controls
+
+
+def build_static(out_dir=STATIC_DIR):
+    """
+    Write the dashboard as one self-contained HTML page: every chart as
+    built by FIGURES, the views its inputs switch between, and plotly.js,
+    all inline. The ZIP selection, measure toggles and the ZIP age chart's
+    year and gender run in the browser; cross-filtering and the tract ZIP
+    filter need the server and are left out.
+    """
+    from plotly.io.json import to_json_plotly
+    from plotly.offline import get_plotlyjs
+
+    years = static_zip_years()
+    figures = {}
+    for chart_id, name in STATIC_FIGURES.items():
+        # The ZIP age chart opens on the newest year, as in the app.
+        params = {"year": years[-1]} if chart_id == "geo_zip_age_dist" and years else {}
+        figures[chart_id] = json.loads(FIGURES.payload(name, **params))
+    # The ZIP trend chart opens with DEFAULT_ZIPS shown, as in the app.
+    for trace in figures["geo_zip_trends"].get("data", []):
+        trace["visible"] = trace.get("name") in DEFAULT_ZIPS
+    data = {"figures": figures, "views": static_views(), "zipTitle": "Selected ZIP Code Population Trends"}
+
+    kpis = kpi_texts(AGGREGATES.get("summary_kpis"))
+    boxes = (
+        ("Total Population", kpis["total"], " primary"),
+        ("Male Population", kpis["male"], ""),
+        ("Female Population", kpis["female"], ""),
+        ("Largest Age Group", kpis["largest_age_group"], ""),
+    )
+    nav, panes = [], []
+    for tab, label, heading, rows in STATIC_TABS:
+        nav.append(f'<a class="nav-link" href="#{tab}" data-tab="{tab}">{html.escape(label)}</a>')
+        body = []
+        for row in rows:
+            if row == ("kpis",):
+                cells = [
+                    f'<div class="value-box{cls}"><div>{title}</div><div class="value">{html.escape(value)}</div></div>'
+                    for title, value, cls in boxes
+                ]
+            else:
+                cells = [f'<div>{_static_controls(c, years)}<div class="chart" id="{c}"></div></div>' for c in row]
+            body.append(f'<div class="row">{"".join(cells)}</div>')
+        panes.append(f'<section class="tab-pane" id="tab-{tab}"><h2>{html.escape(heading)}</h2>{"".join(body)}</section>')
+
+    # "</" would end the script element early.
+    payload = to_json_plotly(data).replace("</", "<\\/")
+    page = f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Long Beach Demographic Dashboard</title>
+<style>{_static_asset("page.css")}</style>
+<script>{get_plotlyjs()}</script>
+</head>
+<body>
+<nav><span class="brand">Long Beach Demographic Dashboard</span>{"".join(nav)}</nav>
+<main>{"".join(panes)}</main>
+<footer><p>Data sourced from 2023 ACS 5-Year Estimates Excel workbooks. Built {time.strftime("%Y-%m-%d")}.</p></footer>
+<script type="application/json" id="dashboard-data">{payload}</script>
+<script>{_static_asset("page.js")}</script>
+</body>
+</html>
+"""
+    os.makedirs(out_dir, exist_ok=True)
+    filename = os.path.join(out_dir, STATIC_PAGE)
+
+    def write(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(page)
+
+    _write_atomic(filename, write)
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser(
+        "build-data", help="compile the Excel workbooks into an Arrow data pack"
+    )
+    p_build.add_argument("--out", default=DATA_PACK_DIR, help="output directory")
+    p_tracts = sub.add_parser(
+        "build-tracts", help="simplify census tract outlines (GeoJSON) into the data pack"
+    )
+    p_tracts.add_argument("tracts", help="tract boundaries, GeoJSON")
+    p_tracts.add_argument("--zips", help="ZIP Code Tabulation Area boundaries, GeoJSON, for the tract-to-ZIP index")
+    p_tracts.add_argument("--out", default=DATA_PACK_DIR, help="output directory")
+    p_static = sub.add_parser(
+        "build-static", help="write the dashboard as one self-contained HTML page"
+    )
+    p_static.add_argument("--out", default=STATIC_DIR, help="output directory")
+    args = parser.parse_args()
+
+    if args.command == "build-data":
+        print(f"Building data pack in {args.out}/")
+        try:
+            build_data_pack(DATASETS, args.out)
+        except ValueError as e:
+            parser.exit(1, f"build-data: {e}\n")
+    elif args.command == "build-tracts":
+        print(f"Building tract outlines in {args.out}/{TRACT_GEOMETRY}")
+        build_tract_geometry(args.tracts, args.zips, args.out)
+    elif args.command == "build-static":
+        filename = build_static(args.out)
+        print(f"Wrote {filename} ({os.path.getsize(filename) / 2**20:.1f} MiB)")
+
 
-app = App(app_ui, server)
+if __name__ == "__main__":
+    main()
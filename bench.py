@@ -0,0 +1,308 @@
+# bench.py
+# Benchmarks for the dashboard's data loading.
+#
+#   python bench.py parse [--repeat N]
+#   python bench.py profile [--repeat N] [--json report.json]
+#   python bench.py diff old.json new.json
+#   python bench.py payload
+#
+# "parse" compares the original approach (every loader calls pd.read_excel
+# on its own, ten reads in total) with the single-pass reader in app.py
+# (each sheet streamed once through openpyxl, loaders slice the cached grid).
+#
+# "profile" times the cold-start path: importing app.py and its heavy
+# dependencies (in a fresh interpreter), every registered loader (with the
+# sheet cache cleared, so each run includes parsing) and every figure
+# builder. Each row reports median wall time, median CPU time and the
+# tracemalloc peak. --json writes the same numbers to a file; "diff" compares
+# two such files, e.g. one per commit, and flags rows that got slower.
+#
+# "payload" reports, per chart, the bytes of widget state a session receives
+# with the figure as plotly builds it and the plotly.js bundle inlined
+# (LBDHHS_SLIM_PAYLOADS=0), the same without the bundle, and with the
+# payload optimizer: slim_figure() and the bundle loaded from /assets/,
+# once per browser.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+import app
+
+# The ten independent reads the loaders used to make, one per loader.
+LEGACY_READS = [
+    (app.LB2023_XLSX, app.LB2023_SHEET, dict(header=98, nrows=13, usecols=[0, 1])),
+    (app.LB2023_XLSX, app.LB2023_SHEET, dict(header=113, nrows=12, usecols=[0, 1])),
+    (app.LB2023_XLSX, app.LB2023_SHEET, dict(header=50, nrows=20, usecols=[0, 1, 2])),
+    (app.LB2023_XLSX, app.LB2023_SHEET, dict(header=14, nrows=8)),
+    (app.RACE_ETH_2023_XLSX, app.RACE_ETH_SHEET, dict(header=None)),
+    (app.RACE_BY_YEAR_XLSX, app.RACE_BY_YEAR_SHEET, dict(header=None)),
+    (app.RACE_ETH_2023_XLSX, app.RACE_ETH_SHEET, dict(header=None, skiprows=58, nrows=5, usecols=[0, 1, 2, 3, 4])),
+    (app.RACE_ETH_2023_XLSX, app.RACE_ETH_SHEET, dict(header=None)),
+    (app.ZIP_YEAR_XLSX, app.ZIP_YEAR_SHEET, dict(header=None)),
+    (app.ZIP_GENDER_AGE_XLSX, app.ZIP_GENDER_AGE_SHEET, dict(header=None)),
+]
+
+# The loaders those reads stood for, one each. "parse" times only these, so
+# both sides read the same sheets; "profile" covers every registered loader.
+LOADERS = [
+    app.load_population_trend,
+    app.load_zip_population_2023,
+    app.load_population_pyramid_2023,
+    app.load_age_group_trends,
+    app.load_race_2023,
+    app.load_race_trends,
+    app.load_race_age_dist_2023,
+    app.load_race_gender_2023,
+    app.load_zip_trends,
+    app.load_zip_gender_age,
+]
+
+# Imported one after another in a fresh interpreter; each row is the cost
+# on top of the rows before it. Everything up to "app" is paid before the
+# server can answer; app.py loads pandas and plotly lazily, so the rows
+# after it are paid by the first session that needs them.
+IMPORT_STEPS = ["shiny", "shinywidgets", "app", "pandas", "plotly.graph_objects", "plotly.express"]
+
+_IMPORT_SCRIPT = """
+import importlib, json, sys, time, tracemalloc
+trace = sys.argv[1] == "trace"
+if trace:
+    tracemalloc.start()
+out = {}
+for name in sys.argv[2:]:
+    if trace:
+        tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    importlib.import_module(name)
+    peak = tracemalloc.get_traced_memory()[1] if trace else 0
+    out[name] = [time.perf_counter() - wall, time.process_time() - cpu, peak]
+print(json.dumps(out))
+"""
+
+# diff flags a row when its wall time grows by more than this factor.
+REGRESSION_RATIO = 1.2
+
+
+def legacy_reads():
+    for path, sheet, kwargs in LEGACY_READS:
+        pd.read_excel(path, sheet_name=sheet, **kwargs)
+
+
+def single_pass():
+    app._GRID_CACHE.clear()
+    for loader in LOADERS:
+        loader()
+
+
+def measure(fn, repeat):
+    """
+    Median wall time (s) and CPU time (s) over `repeat` runs, plus the
+    tracemalloc peak (bytes) of one extra run. Tracing slows Python code
+    down several times over, so it is kept out of the timed runs.
+    """
+    times, cpus = [], []
+    for _ in range(repeat):
+        t0, c0 = time.perf_counter(), time.process_time()
+        fn()
+        times.append(time.perf_counter() - t0)
+        cpus.append(time.process_time() - c0)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times), statistics.median(cpus), peak
+
+
+def measure_imports(repeat):
+    """measure() for IMPORT_STEPS, each run in a new interpreter."""
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def run(mode):
+        proc = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SCRIPT, mode, *IMPORT_STEPS],
+            cwd=here, capture_output=True, text=True, check=True,
+        )
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    runs = [run("time") for _ in range(repeat)]
+    traced = run("trace")
+    return {
+        name: (
+            statistics.median(r[name][0] for r in runs),
+            statistics.median(r[name][1] for r in runs),
+            traced[name][2],
+        )
+        for name in IMPORT_STEPS
+    }
+
+
+def cold_loader(loader):
+    def run():
+        app._GRID_CACHE.clear()
+        loader()
+
+    return run
+
+
+def print_rows(title, rows):
+    print(f"\n{title:<28}{'wall (s)':>10}{'cpu (s)':>10}{'peak (MiB)':>12}")
+    for name, (wall, cpu, peak) in rows.items():
+        print(f"{name:<28}{wall:>10.3f}{cpu:>10.3f}{peak / 2**20:>12.2f}")
+
+
+def compare(old, new, better, worse):
+    """'x2.0 faster' or 'x1.3 slower': how `new` compares with `old`, where less is better."""
+    ratio = old / new
+    return f"x{ratio:.1f} {better}" if ratio >= 1 else f"x{1 / ratio:.1f} {worse}"
+
+
+def bench_parse(repeat):
+    legacy_t, _, legacy_m = measure(legacy_reads, repeat)
+    single_t, _, single_m = measure(single_pass, repeat)
+    print(f"{'':<24}{'time (s)':>10}{'peak (MiB)':>12}")
+    print(f"{'10 x pd.read_excel':<24}{legacy_t:>10.3f}{legacy_m / 2**20:>12.2f}")
+    print(f"{'single-pass grids':<24}{single_t:>10.3f}{single_m / 2**20:>12.2f}")
+    print(f"time {compare(legacy_t, single_t, 'faster', 'slower')}, peak memory {compare(legacy_m, single_m, 'lower', 'higher')}")
+
+
+def bench_profile(repeat, json_path=None):
+    sections = {"imports": measure_imports(repeat), "loaders": {}, "figures": {}}
+    for name in app.DATASETS.names():
+        _, loader = app.DATASETS.source(name)
+        sections["loaders"][loader.__name__] = measure(cold_loader(loader), repeat)
+    for chart_id in app.FIGURES.names():
+        dataset, builder = app.FIGURES.source(chart_id)
+        d = app.DATASETS.get(dataset)
+        sections["figures"][builder.__name__] = measure(lambda: builder(d), repeat)
+
+    for title, rows in sections.items():
+        print_rows(title, rows)
+
+    if json_path:
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "repeat": repeat,
+            "results": {
+                title: {
+                    name: {"wall_s": round(wall, 6), "cpu_s": round(cpu, 6), "peak_bytes": peak}
+                    for name, (wall, cpu, peak) in rows.items()
+                }
+                for title, rows in sections.items()
+            },
+        }
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nWrote {json_path}")
+
+
+def bench_diff(old_path, new_path):
+    """Print old vs new wall time per row; return the number of regressions."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    regressions = 0
+    for title, rows in new["results"].items():
+        print(f"\n{title:<28}{'old (s)':>10}{'new (s)':>10}{'ratio':>8}")
+        for name, row in rows.items():
+            before = old["results"].get(title, {}).get(name)
+            if before is None:
+                print(f"{name:<28}{'-':>10}{row['wall_s']:>10.3f}{'new':>8}")
+                continue
+            ratio = row["wall_s"] / before["wall_s"] if before["wall_s"] else float("inf")
+            slower = ratio > REGRESSION_RATIO
+            regressions += slower
+            print(f"{name:<28}{before['wall_s']:>10.3f}{row['wall_s']:>10.3f}{ratio:>8.2f}" + ("  <-- slower" if slower else ""))
+    return regressions
+
+
+def widget_bytes(widget, esm=True):
+    """
+    Size of the widget's state as shinywidgets sends it (buffers in base64);
+    esm=False leaves out its JavaScript module.
+    """
+    from ipywidgets.widgets.widget import _remove_buffers
+
+    state = widget.get_state()
+    if not esm:
+        state.pop("_esm")
+    state, _, buffers = _remove_buffers(state)
+    return len(json.dumps(state)) + sum(4 * -(-len(b) // 3) for b in buffers)
+
+
+def bench_payload():
+    from ipywidgets.widgets.widget import Widget
+
+    # Outside a session there is no comm to open; build the widgets only.
+    Widget.on_widget_constructed(lambda widget: None)
+    bundle = app.plotly_bundle()
+    url = f"http://localhost/assets/plotly-widget-{bundle.digest}.js"
+    print(f"{'':<24}{'full (KiB)':>12}{'no JS (KiB)':>13}{'slim (KiB)':>12}{'ratio':>8}")
+    total_full = total_figure = total_slim = 0
+    for chart_id in app.FIGURES.names():
+        dataset, builder = app.FIGURES.source(chart_id)
+        fig = builder(app.DATASETS.get(dataset))
+        widget = app.go.FigureWidget(fig.data, fig.layout)
+        full, figure = widget_bytes(widget), widget_bytes(widget, esm=False)
+        slim_fig = app.go.Figure(app.slim_figure(json.loads(fig.to_json())), _validate=False)
+        slim = widget_bytes(app._figure_widget_class(url)(slim_fig.data, slim_fig.layout))
+        total_full += full
+        total_figure += figure
+        total_slim += slim
+        print(f"{chart_id:<24}{full / 1024:>12.1f}{figure / 1024:>13.1f}{slim / 1024:>12.1f}{full / slim:>8.0f}")
+    print(
+        f"{'total':<24}{total_full / 1024:>12.1f}{total_figure / 1024:>13.1f}"
+        f"{total_slim / 1024:>12.1f}{total_full / total_slim:>8.0f}"
+    )
+    print(
+        f"\nplotly.js bundle: {len(bundle.body) / 2**20:.1f} MiB, {len(bundle.gzip_body) / 2**20:.1f} MiB gzipped, "
+        "fetched once per browser when slim"
+    )
+
+
+def git_commit():
+    try:
+        proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return proc.stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_parse = sub.add_parser("parse", help="legacy reads vs single-pass grid reader")
+    p_parse.add_argument("--repeat", type=int, default=3)
+    p_profile = sub.add_parser("profile", help="time imports, each loader and each figure builder")
+    p_profile.add_argument("--repeat", type=int, default=3)
+    p_profile.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    p_diff = sub.add_parser("diff", help="compare two profile --json reports")
+    p_diff.add_argument("old")
+    p_diff.add_argument("new")
+    sub.add_parser("payload", help="widget state bytes per chart, with and without the payload optimizer")
+    args = parser.parse_args()
+
+    if args.command == "parse":
+        bench_parse(args.repeat)
+    elif args.command == "profile":
+        bench_profile(args.repeat, args.json)
+    elif args.command == "diff":
+        sys.exit(1 if bench_diff(args.old, args.new) else 0)
+    elif args.command == "payload":
+        bench_payload()
+
+
+if __name__ == "__main__":
+    main()
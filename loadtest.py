@@ -0,0 +1,296 @@
+# loadtest.py
+# Concurrent-session load test against a local server.
+#
+#   python loadtest.py [--sessions N] [--ramp SECONDS] [--json report.json]
+#
+# Starts `shiny run app.py` on a free local port and opens N websocket
+# sessions that behave like a browser: each one opens the dashboard, visits
+# every tab in turn and then changes the ZIP code selection a few times.
+# Nothing leaves the machine.
+#
+# Needs the `websockets` client library, which is in requirements-dev.txt
+# (pip install -r requirements-dev.txt); the app itself does not use it.
+#
+# For every output the report gives p50/p95/p99 of the time from the action
+# that shows it (opening the app or switching to its tab) to its first
+# value; for every action, the time until the server reports idle. It also
+# gives throughput (actions and bytes received per second) and the server
+# process's resident memory before, during (peak) and after the run.
+#
+# --json writes the same numbers, with each row's p95 as "wall_s", so two
+# runs can be compared with `python bench.py diff before.json after.json`.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import websockets
+
+from bench import git_commit
+import app
+
+# Outputs that become visible with each tab, in the order a user visits them.
+TAB_OUTPUTS = {
+    "summary": (
+        "kpi_total",
+        "kpi_male",
+        "kpi_female",
+        "kpi_largest_age_group",
+        "summary_pop_trend",
+        "summary_race_pie",
+        "summary_zip_bar",
+    ),
+    "age": ("age_population_pyramid", "age_group_trends"),
+    "race": ("race_pop_trends", "race_age_dist", "race_gender_dist"),
+    "geo": ("geo_zip_bar_rank", "geo_zip_trends", "geo_zip_age_dist"),
+    "tracts": ("tract_map", "tract_bar_rank"),
+}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_bytes(pid):
+    """Resident set size of `pid` (Linux only; None elsewhere)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class Server:
+    """`shiny run` in a subprocess, with its memory sampled in the background."""
+
+    def __init__(self, port, app_path="app.py"):
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.url = f"http://127.0.0.1:{port}"
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "shiny", "run", "--port", str(port), app_path],
+            cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                urllib.request.urlopen(self.url + "/", timeout=1).read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"server did not start within {timeout}s")
+
+    def rss(self):
+        return rss_bytes(self.proc.pid)
+
+    def start_sampling(self, interval=0.1):
+        def sample():
+            while not self._stop.wait(interval):
+                self.peak_rss = max(self.peak_rss, self.rss() or 0)
+
+        threading.Thread(target=sample, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self.proc.terminate()
+        self.proc.wait(timeout=10)
+
+
+def session_script(zip_changes):
+    """(action name, input update, outputs expected) for one simulated user."""
+    steps = [("open", None, TAB_OUTPUTS["summary"])]
+    for tab in app.TABS[1:]:
+        steps.append((f"tab:{tab}", {"navbar": tab}, TAB_OUTPUTS[tab]))
+    zips = list(app.ZIP_CODES_LABEL)
+    for i in range(zip_changes):
+        selected = [zips[(2 * i + k) % len(zips)] for k in range(3)]
+        steps.append(("zip_select", {"zip_select": selected}, ()))
+    return steps
+
+
+async def run_session(url, steps, results, timeout):
+    """
+    Play `steps` over one websocket. Each action waits until all of its
+    outputs have a value and the server is idle again before the next.
+    """
+    init = {
+        "navbar": "summary",
+        "zip_select": app.DEFAULT_ZIPS,
+        "geo_year": "2023",
+        "geo_gender": "Total",
+        "age_measure": "absolute",
+        "race_measure": "absolute",
+        "zip_measure": "absolute",
+        # An empty multiple selectize reports null.
+        "tract_zip": None,
+    }
+    # What a browser reports about its URL; figure widgets use it to load
+    # plotly.js from the server rather than receive it inline.
+    scheme, _, rest = url.partition("//")
+    host, _, port = rest.partition(":")
+    init.update({
+        ".clientdata_url_protocol": scheme,
+        ".clientdata_url_hostname": host,
+        ".clientdata_url_port": port,
+        ".clientdata_url_pathname": "/",
+    })
+    for outputs in TAB_OUTPUTS.values():
+        for output_id in outputs:
+            init[f".clientdata_output_{output_id}_hidden"] = False
+
+    ws_url = url.replace("http://", "ws://") + "/websocket/"
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        for action, update, outputs in steps:
+            pending = set(outputs)
+            idle = False
+            t0 = time.perf_counter()
+            if update is None:
+                await ws.send(json.dumps({"method": "init", "data": init}))
+            else:
+                await ws.send(json.dumps({"method": "update", "data": update}))
+            deadline = t0 + timeout
+            while pending or not idle:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    results["timeouts"].append(action)
+                    break
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), remaining)
+                except asyncio.TimeoutError:
+                    continue
+                results["bytes"] += len(raw)
+                if raw.startswith('{"custom"'):
+                    # Widget state (megabytes each); nothing to time in it,
+                    # and parsing it would make the client the bottleneck.
+                    continue
+                msg = json.loads(raw)
+                elapsed = time.perf_counter() - t0
+                for output_id, value in (msg.get("values") or {}).items():
+                    if output_id in pending and value is not None:
+                        pending.discard(output_id)
+                        results["outputs"].setdefault(output_id, []).append(elapsed)
+                for output_id in msg.get("errors") or {}:
+                    results["errors"].append(output_id)
+                    pending.discard(output_id)
+                if msg.get("busy") == "busy":
+                    idle = False
+                elif msg.get("busy") == "idle":
+                    idle = True
+            else:
+                results["actions"].setdefault(action, []).append(time.perf_counter() - t0)
+
+
+async def run_sessions(url, n, ramp, zip_changes, timeout):
+    results = {"outputs": {}, "actions": {}, "errors": [], "timeouts": [], "bytes": 0}
+    steps = session_script(zip_changes)
+
+    async def start(i):
+        await asyncio.sleep(ramp * i / max(n, 1))
+        try:
+            await run_session(url, steps, results, timeout)
+        except (OSError, websockets.WebSocketException) as e:
+            results["errors"].append(f"session {i}: {e}")
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(start(i) for i in range(n)))
+    results["wall_s"] = time.perf_counter() - t0
+    return results
+
+
+def percentiles(samples):
+    """p50, p95 and p99 of `samples` (seconds)."""
+    if len(samples) == 1:
+        return samples[0], samples[0], samples[0]
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return q[49], q[94], q[98]
+
+
+def json_rows(rows):
+    # wall_s repeats p95 so that bench.py diff compares p95s.
+    out = {}
+    for name, samples in rows.items():
+        p50, p95, p99 = percentiles(samples)
+        out[name] = {"n": len(samples), "p50_s": round(p50, 6), "p95_s": round(p95, 6), "p99_s": round(p99, 6), "wall_s": round(p95, 6)}
+    return out
+
+
+def print_rows(title, rows):
+    print(f"\n{title:<28}{'n':>5}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}")
+    for name, samples in rows.items():
+        p50, p95, p99 = percentiles(samples)
+        print(f"{name:<28}{len(samples):>5}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test")
+    parser.add_argument("--sessions", type=int, default=10, help="simultaneous sessions")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which sessions start")
+    parser.add_argument("--zip-changes", type=int, default=3, help="zip_select changes per session")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds allowed per action")
+    parser.add_argument("--port", type=int, default=0, help="server port (default: a free one)")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    server = Server(args.port or free_port())
+    try:
+        server.wait_ready()
+        rss_idle = server.rss()
+        server.start_sampling()
+        results = asyncio.run(run_sessions(server.url, args.sessions, args.ramp, args.zip_changes, args.timeout))
+        rss_after = server.rss()
+    finally:
+        server.stop()
+
+    wall = results["wall_s"]
+    actions = sum(len(v) for v in results["actions"].values())
+    print(f"{args.sessions} sessions, {wall:.1f}s")
+    print_rows("time to first value", results["outputs"])
+    print_rows("time to idle", results["actions"])
+    print(f"\nthroughput: {actions / wall:.2f} actions/s, {results['bytes'] / wall / 2**20:.2f} MiB/s received")
+    if rss_idle is not None:
+        print(
+            f"server RSS (MiB): idle {rss_idle / 2**20:.0f}, peak {server.peak_rss / 2**20:.0f}, "
+            f"after {rss_after / 2**20:.0f}"
+        )
+    if results["errors"] or results["timeouts"]:
+        print(f"errors: {results['errors']}\ntimeouts: {results['timeouts']}")
+
+    if args.json:
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "sessions": args.sessions,
+            "ramp_s": args.ramp,
+            "throughput": {"actions_per_s": actions / wall, "bytes_per_s": results["bytes"] / wall},
+            "server_rss_bytes": {"idle": rss_idle, "peak": server.peak_rss, "after": rss_after},
+            "errors": results["errors"],
+            "timeouts": results["timeouts"],
+            "results": {
+                "first value": json_rows(results["outputs"]),
+                "idle": json_rows(results["actions"]),
+            },
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
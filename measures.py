@@ -0,0 +1,98 @@
+# measures.py
+# What the trend charts can plot besides counts: the TREND_MEASURES table,
+# which of them each chart's "Show:" toggle offers, and TrendMeasures,
+# which computes them all.
+# numpy is imported when a TrendMeasures is first built, so the app can
+# lay out its toggles without loading it.
+
+import math
+
+# What a trend chart can plot instead of the counts: measure -> (toggle
+# label, axis title, hover number format, unit, whether it can be stacked).
+TREND_MEASURES = {
+    "absolute": ("Population", "Population", ",.0f", "", True),
+    "change": ("Change", "Change from previous year", "+,.0f", "", False),
+    "pct_change": ("% change", "Change from previous year (%)", "+.1f", "%", False),
+    "share": ("Share", "Share of total (%)", ".1f", "%", True),
+    "index": ("Index vs city", "Index (city average = 100)", ".0f", "", False),
+}
+
+
+# Measures each trend chart's "Show:" toggle offers.
+CHART_MEASURES = {
+    "age_group_trends": ("absolute", "change", "pct_change", "share"),
+    "race_pop_trends": ("absolute", "change", "pct_change", "share"),
+    "geo_zip_trends": ("absolute", "pct_change", "share", "index"),
+}
+
+
+def measure_choices(chart_id):
+    """Radio button choices for a chart's CHART_MEASURES."""
+    return {measure: TREND_MEASURES[measure][0] for measure in CHART_MEASURES[chart_id]}
+
+
+class TrendMeasures:
+    """
+    Every TREND_MEASURES value of a dataset with one count per group and
+    year (race_trends, age_trends, zip_trends), computed for all groups at
+    once on a [group, year] array, plus each group's compound annual growth
+    rate. The app's MEASURES keeps one per dataset version, so switching a
+    chart's measure only indexes arrays that are already there.
+
+    Changes are from the previous year in the sheet. Shares and the index
+    compare a group with all groups in the same year; an index of 100 is
+    the average group, e.g. the average ZIP code. Missing counts give NaN.
+    """
+
+    def __init__(self, group, groups, years, counts):
+        import numpy as np
+
+        self.group = group
+        self.groups = groups
+        self.years = years
+        prev = np.concatenate([np.full((len(groups), 1), np.nan), counts[:, :-1]], axis=1)
+        known = ~np.isnan(counts)
+        # Like np.nansum, but a year with no counts at all stays NaN.
+        total = np.where(known.any(axis=0), np.nansum(counts, axis=0), np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.values = {
+                "absolute": counts,
+                "change": counts - prev,
+                "pct_change": (counts - prev) / prev * 100,
+                "share": counts / total * 100,
+                "index": counts / (total / known.sum(axis=0)) * 100,
+            }
+            # First and last year each group has a count for.
+            rows = np.arange(len(groups))
+            first = known.argmax(axis=1)
+            last = counts.shape[1] - 1 - known[:, ::-1].argmax(axis=1)
+            self.first_year = years.to_numpy()[first]
+            self.last_year = years.to_numpy()[last]
+            span = np.where(self.last_year > self.first_year, self.last_year - self.first_year, np.nan)
+            self.cagr = (counts[rows, last] / counts[rows, first]) ** (1 / span) - 1
+
+    @classmethod
+    def from_rollup(cls, rollup):
+        """From a Rollup over one group column and Year."""
+        group = next(dim for dim in rollup.dims if dim != "Year")
+        axes, counts = rollup.lookup([group, "Year"])
+        return cls(group, *axes, counts)
+
+    def series(self, measure, name, years):
+        """`measure` for the group `name` in each of `years`."""
+        return self.values[measure][self.groups.get_loc(name), self.years.get_indexer(years)]
+
+    def column(self, measure, d):
+        """`measure` for each row of `d`, a frame with the group and Year columns."""
+        rows = self.groups.get_indexer(d[self.group])
+        cols = self.years.get_indexer(d["Year"])
+        return self.values[measure][rows, cols]
+
+    def hovertemplate(self, measure, name):
+        _, title, fmt, unit, _ = TREND_MEASURES[measure]
+        i = self.groups.get_loc(name)
+        growth = (
+            "" if math.isnan(self.cagr[i])
+            else f"<br>Growth {self.first_year[i]}–{self.last_year[i]}: {self.cagr[i]:+.1%} a year"
+        )
+        return f"{self.group}={name}<br>Year=%{{x}}<br>{title}=%{{y:{fmt}}}{unit}{growth}<extra></extra>"
@@ -0,0 +1,258 @@
+# metrics.py
+# Counters, histograms and per-session totals for the dashboard, served by
+# app.py at GET /metrics in the Prometheus text format.
+
+import functools
+import inspect
+import json
+import os
+import re
+import threading
+import time
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, le in enumerate(self.buckets):
+            if value <= le:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+
+class Metrics:
+    """
+    In-process counters and histograms, rendered in the Prometheus text
+    format by the /metrics route. Each worker process keeps its own.
+
+    Values that already live elsewhere (cache stats, open sessions) are
+    read at scrape time by collectors: functions returning
+    (name, labels, value) samples.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}  # name -> (type, help)
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._collectors = []
+
+    def describe(self, name, kind, help):
+        self._meta[name] = (kind, help)
+
+    def inc(self, metric, value=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, metric, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def add_collector(self, fn):
+        self._collectors.append(fn)
+
+    def render(self):
+        samples = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append((labels, value))
+            for (name, labels), h in self._histograms.items():
+                rows = samples.setdefault(name, [])
+                for le, count in zip(h.buckets, h.counts):
+                    rows.append(("_bucket", labels + (("le", f"{le:g}"),), count))
+                rows.append(("_bucket", labels + (("le", "+Inf"),), h.count))
+                rows.append(("_sum", labels, h.sum))
+                rows.append(("_count", labels, h.count))
+        for collect in self._collectors:
+            for name, labels, value in collect():
+                samples.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        lines = []
+        for name in sorted(samples):
+            kind, help = self._meta.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for row in samples[name]:
+                suffix, labels, value = row if len(row) == 3 else ("", *row)
+                lines.append(f"{name}{suffix}{_labels(labels)} {value!r}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+METRICS.describe("lbdhhs_calls_total", "counter", "Calls by kind, function and outcome (ok, silent, error).")
+METRICS.describe("lbdhhs_duration_seconds", "histogram", "Wall time of loaders, calcs, effects and outputs.")
+METRICS.describe("lbdhhs_output_payload_bytes", "histogram", "Bytes sent per render of an output.")
+METRICS.describe("lbdhhs_output_sent_bytes_total", "counter", "Bytes sent for an output, renders and in-place updates.")
+METRICS.describe("lbdhhs_cache_events_total", "counter", "Hits, misses and rebuilds of the shared caches.")
+METRICS.describe("lbdhhs_sessions_active", "gauge", "Open Shiny sessions.")
+METRICS.describe("lbdhhs_sessions_total", "counter", "Shiny sessions started.")
+
+SESSION_LOG_ENV = "LBDHHS_SESSION_LOG"
+
+_COMM_IDENT = re.compile(r'"ident": "comm-([^"]+)"')
+
+
+class SessionMetrics:
+    """
+    Per-session totals for the structured log line written when the
+    session ends, and bytes sent per output.
+
+    Widgets are sent as shinywidgets custom messages keyed by the widget's
+    model id, after the render function has returned; instrument() records
+    which output each model id belongs to, and the session's
+    send_custom_message is wrapped to count those messages' bytes.
+    """
+
+    active = {}  # session id -> SessionMetrics
+
+    def __init__(self, session):
+        self.session = session
+        self.started = time.time()
+        self.calls = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.bytes = {}  # output id -> bytes sent
+        self.models = {}  # widget model id -> output id
+        SessionMetrics.active[session.id] = self
+        METRICS.inc("lbdhhs_sessions_total")
+
+        send = session.send_custom_message
+
+        async def send_custom_message(type, message):
+            if type.startswith("shinywidgets_comm_") and isinstance(message, str):
+                # The widget state can be megabytes; its "ident" field is
+                # at the end, so look there rather than parse the message.
+                match = _COMM_IDENT.search(message, max(0, len(message) - 256))
+                output_id = self.models.get(match.group(1)) if match else None
+                if output_id is not None:
+                    self.sent(output_id, len(message), render=type == "shinywidgets_comm_open")
+            await send(type, message)
+
+        session.send_custom_message = send_custom_message
+        session.on_ended(self.end)
+
+    @classmethod
+    def current(cls):
+        from shiny.session import get_current_session
+
+        session = get_current_session()
+        return cls.active.get(session.id) if session is not None else None
+
+    def sent(self, output_id, size, render):
+        self.bytes[output_id] = self.bytes.get(output_id, 0) + size
+        METRICS.inc("lbdhhs_output_sent_bytes_total", size, output=output_id)
+        if render:
+            METRICS.observe("lbdhhs_output_payload_bytes", size, SIZE_BUCKETS, output=output_id)
+
+    def end(self):
+        SessionMetrics.active.pop(self.session.id, None)
+        if os.environ.get(SESSION_LOG_ENV):
+            record = {
+                "event": "session_end",
+                "session": self.session.id,
+                "duration_s": round(time.time() - self.started, 3),
+                "calls": self.calls,
+                "call_seconds": round(self.seconds, 3),
+                "errors": self.errors,
+                "bytes_sent": sum(self.bytes.values()),
+                "bytes_by_output": self.bytes,
+            }
+            print(json.dumps(record), flush=True)
+
+
+def _silent_exceptions():
+    from shiny.types import SilentCancelOutputException, SilentException
+
+    return (SilentException, SilentCancelOutputException)
+
+
+def _record(kind, name, outcome, elapsed):
+    """Count one call of `name` and return the session's SessionMetrics, if any."""
+    METRICS.inc("lbdhhs_calls_total", kind=kind, name=name, outcome=outcome)
+    if outcome != "silent":
+        METRICS.observe("lbdhhs_duration_seconds", elapsed, kind=kind, name=name)
+    stats = SessionMetrics.current()
+    if stats is not None:
+        stats.calls += 1
+        stats.seconds += elapsed
+        stats.errors += outcome == "error"
+    return stats
+
+
+def instrument(kind, name=None):
+    """
+    Decorator counting calls and timing `fn`, labelled by kind ("loader",
+    "calc", "effect", "output", "download") and `name`, which defaults to
+    the function's name. Shiny's
+    silent exceptions (req() and friends) are counted as outcome="silent"
+    and not timed. For outputs it also records the size of what was sent:
+    text directly, widgets by their model id (see SessionMetrics). An async
+    generator, such as a download handler, is timed until it is exhausted.
+    """
+
+    def decorate(fn):
+        label = name or fn.__name__
+
+        if inspect.isasyncgenfunction(fn):
+
+            @functools.wraps(fn)
+            async def stream(*args, **kwargs):
+                t0 = time.perf_counter()
+                outcome = "ok"
+                try:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                except _silent_exceptions():
+                    outcome = "silent"
+                    raise
+                except Exception:
+                    outcome = "error"
+                    raise
+                finally:
+                    _record(kind, label, outcome, time.perf_counter() - t0)
+
+            return stream
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            outcome = "ok"
+            try:
+                result = fn(*args, **kwargs)
+            except _silent_exceptions():
+                outcome = "silent"
+                raise
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                stats = _record(kind, label, outcome, time.perf_counter() - t0)
+            if kind == "output" and stats is not None:
+                if isinstance(result, str):
+                    stats.sent(label, len(json.dumps(result)), render=True)
+                elif hasattr(result, "model_id"):
+                    stats.models[result.model_id] = label
+            return result
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,56 @@
+// static_page/page.js
+// Script of the page `python -m app build-static` writes; the build inlines
+// it. DATA is the JSON the build embeds: figures, views and zipTitle.
+
+const DATA = JSON.parse(document.getElementById("dashboard-data").textContent);
+const plotted = new Set();
+
+function chartDiv(id) { return document.getElementById(id); }
+
+function inputValue(name) {
+  const el = document.querySelector(`[name="${name}"]:checked`) || document.querySelector(`select[name="${name}"]`);
+  return el.value;
+}
+
+function applyView(id) {
+  // Restyle a chart for its inputs' current values, as the server's
+  // in-place updates would.
+  const spec = DATA.views[id];
+  if (!spec || !plotted.has(id)) return;
+  const view = spec.views[spec.inputs.map(inputValue).join("|")];
+  if (!view) return;
+  Plotly.restyle(chartDiv(id), view.data);
+  Plotly.relayout(chartDiv(id), view.layout);
+  if (id === "geo_zip_trends") showZips();
+}
+
+function showZips() {
+  const selected = new Set([...document.querySelectorAll('[name="zip_select"]:checked')].map((el) => el.value));
+  const div = chartDiv("geo_zip_trends");
+  if (!plotted.has("geo_zip_trends") || !div.data.length) return;
+  Plotly.restyle(div, {visible: div.data.map((trace) => selected.has(trace.name))});
+  Plotly.relayout(div, {"title.text": selected.size ? DATA.zipTitle : "Please select at least one ZIP code."});
+}
+
+function showTab(tab) {
+  document.querySelectorAll(".tab-pane").forEach((el) => el.classList.toggle("active", el.id === `tab-${tab}`));
+  document.querySelectorAll(".nav-link").forEach((el) => el.classList.toggle("active", el.dataset.tab === tab));
+  // Charts are drawn the first time their tab is shown, at its size.
+  document.querySelectorAll(`#tab-${tab} .chart`).forEach((div) => {
+    if (plotted.has(div.id)) return;
+    const fig = DATA.figures[div.id];
+    Plotly.newPlot(div, fig.data, fig.layout, {responsive: true});
+    plotted.add(div.id);
+    applyView(div.id);
+  });
+}
+
+document.querySelectorAll(".nav-link").forEach((el) => el.addEventListener("click", (e) => {
+  e.preventDefault();
+  showTab(el.dataset.tab);
+}));
+Object.entries(DATA.views).forEach(([id, spec]) => spec.inputs.forEach((name) => {
+  document.querySelectorAll(`[name="${name}"]`).forEach((el) => el.addEventListener("change", () => applyView(id)));
+}));
+document.querySelectorAll('[name="zip_select"]').forEach((el) => el.addEventListener("change", showZips));
+showTab("summary");
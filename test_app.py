@@ -0,0 +1,755 @@
+# test_app.py
+# Behaviour checks against the real workbooks. Run from this folder:
+#
+#   pip install -r requirements-dev.txt
+#   python -m pytest -q
+
+import asyncio
+import base64
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import pytest
+
+import app
+
+
+@pytest.fixture(scope="session", autouse=True)
+def in_app_folder():
+    # The workbooks are opened by relative path, as when the app runs.
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    yield
+    os.chdir(cwd)
+
+
+def test_registry_reloads_changed_workbooks(tmp_path):
+    path = str(tmp_path / "workbook.xlsx")
+    shutil.copy(app.LB2023_XLSX, path)
+    loads = []
+
+    def loader():
+        loads.append(path)
+        return pd.DataFrame({"Year": [2023], "Total": [len(loads)]})
+
+    registry = app.DatasetRegistry()
+    registry.register("trend", path, loader)
+    first = registry.get("trend")
+    assert registry.get("trend") is first
+    assert registry.stats == {"hits": 1, "misses": 1, "reloads": 0}
+
+    # A new mtime reloads the dataset, and so does a new size.
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert registry.get("trend")["Total"].item() == 2
+    with open(path, "ab") as fh:
+        fh.write(b"\0")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert registry.get("trend")["Total"].item() == 3
+    assert registry.get("trend")["Total"].item() == 3
+    assert registry.stats == {"hits": 2, "misses": 1, "reloads": 2}
+    assert len(loads) == 3
+
+
+def test_registry_signature():
+    signature = dict(app.DATASETS.signature())
+    assert sorted(signature) == app.DATASETS.paths()
+    assert signature[app.LB2023_XLSX] == app._file_signature(app.LB2023_XLSX)
+    assert app._file_signature("no such workbook.xlsx") is None
+
+
+@pytest.mark.parametrize("path, sheet", [
+    (app.LB2023_XLSX, app.LB2023_SHEET),
+    (app.ZIP_YEAR_XLSX, app.ZIP_YEAR_SHEET),
+])
+def test_read_sheet_matches_read_excel(path, sheet):
+    grid = app.read_sheet(path, sheet)
+    expected = pd.read_excel(path, sheet_name=sheet, header=None)
+    pd.testing.assert_frame_equal(grid, expected, check_dtype=False, check_column_type=False)
+    # Parsed once: every loader gets the same grid.
+    assert app.read_sheet(path, sheet) is grid
+
+    # sheet_table() slices any header row the way read_excel reads it.
+    header = 5
+    table = app.sheet_table(grid, header=header, nrows=10, usecols=[0, 1])
+    expected = pd.read_excel(path, sheet_name=sheet, header=header, nrows=10, usecols=[0, 1])
+    pd.testing.assert_frame_equal(table, expected.dropna(how="all").reset_index(drop=True), check_dtype=False)
+
+
+@pytest.fixture
+def workbook_copy(tmp_path):
+    """A registry reading "trend" from a copy of its workbook, and the copy's path."""
+    path = str(tmp_path / "workbook.xlsx")
+    shutil.copy(app.LB2023_XLSX, path)
+    registry = app.DatasetRegistry()
+    registry.register("trend", path, app.load_population_trend)
+    return registry, path
+
+
+def test_data_pack_round_trip(tmp_path, workbook_copy):
+    registry, path = workbook_copy
+    pack = str(tmp_path / "pack")
+    manifest = app.build_data_pack(registry, pack)
+    assert manifest["datasets"] == {"trend": "trend.arrow"}
+    assert manifest["sources"] == {path: app._file_sha256(path)}
+    d = app.read_data_pack("trend", path, pack)
+    pd.testing.assert_frame_equal(d, app.load_population_trend(), check_dtype=False)
+
+    # Not in the pack, or no pack at all.
+    assert app.read_data_pack("zip_2023", path, pack) is None
+    assert app.read_data_pack("trend", path, str(tmp_path / "none")) is None
+
+    # A workbook that no longer matches its hash is read from Excel again.
+    with open(path, "ab") as fh:
+        fh.write(b"\0")
+    assert app.read_data_pack("trend", path, pack) is None
+
+
+def test_data_pack_without_its_workbook(tmp_path, workbook_copy):
+    # A deployment may ship the pack alone.
+    registry, path = workbook_copy
+    pack = str(tmp_path / "pack")
+    app.build_data_pack(registry, pack)
+    os.remove(path)
+    assert len(app.read_data_pack("trend", path, pack)) == 13
+
+
+def test_data_pack_leaves_out_failed_loaders(tmp_path, workbook_copy):
+    registry, path = workbook_copy
+    registry.register("broken", path, lambda: pd.DataFrame(columns=["Year", "Total"]))
+    pack = str(tmp_path / "pack")
+    with pytest.raises(ValueError, match="broken"):
+        app.build_data_pack(registry, pack)
+    manifest = app._read_manifest(pack)
+    assert "broken" not in manifest["datasets"]
+    # Without the workbook's hash, nothing from it is served as current.
+    assert manifest["sources"] == {}
+    assert app.read_data_pack("trend", path, pack) is None
+    assert app.read_data_pack("broken", path, pack) is None
+
+
+def test_data_pack_format(tmp_path, workbook_copy, monkeypatch):
+    registry, path = workbook_copy
+    pack = str(tmp_path / "pack")
+    app.build_data_pack(registry, pack)
+    assert app.read_data_pack("trend", path, pack) is not None
+    # Packs built by older code are stale once the format goes up.
+    monkeypatch.setattr(app, "DATA_PACK_FORMAT", app.DATA_PACK_FORMAT + 1)
+    assert app.read_data_pack("trend", path, pack) is None
+
+
+def test_anchor_index():
+    anchors = app.sheet_anchors(app.ZIP_GENDER_AGE_XLSX, app.ZIP_GENDER_AGE_SHEET)
+    # Labels match whatever their case and spacing.
+    assert anchors.cells(" total ") == anchors.cells("TOTAL") != []
+    assert list(anchors.years()) == list(range(2016, 2024))
+    with pytest.raises(KeyError):
+        anchors.find("no such label")
+    anchors = app.sheet_anchors(app.LB2023_XLSX, app.LB2023_SHEET)
+    row, col = anchors.find("Year", col=0)
+    assert app.read_sheet(app.LB2023_XLSX, app.LB2023_SHEET).iat[row, col] == "Year"
+
+
+@pytest.mark.parametrize("name, rows", [
+    ("trend", 13), ("zip_2023", 11), ("pyramid_2023", 36), ("age_trends", 40),
+    ("race_2023", 5), ("race_age_dist", 20), ("race_gender_dist", 10), ("zip_trends", 88),
+])
+def test_loaders_find_their_tables(name, rows):
+    assert len(app.DATASETS.get(name)) == rows
+
+
+def test_age_trends_use_ten_year_bands():
+    # Of the two "Age Cat1" tables, the one starting at "<20".
+    d = app.DATASETS.get("age_trends")
+    assert list(d["Age Group"].unique()) == ["<20", "20-29", "30-39", "40-49", "50-59", "60-69", "70-79", "80+"]
+    assert sorted(d["Year"].astype(int).unique()) == list(range(2019, 2024))
+
+
+def test_figure_cache():
+    payload = app.FIGURES.payload("race_pie")
+    assert app.FIGURES.payload("race_pie") is payload
+    # Every get() is a new Figure, drawn from the shared payload.
+    fig = app.FIGURES.get("race_pie")
+    assert fig is not app.FIGURES.get("race_pie")
+    assert json.loads(fig.to_json()) == json.loads(payload)
+
+
+def test_show_zip_traces():
+    fig = app.figure_zip_trends(app.DATASETS.get("zip_trends"))
+    assert [trace.name for trace in fig.data] == app.ZIP_CODES_LABEL
+    app.show_zip_traces(fig, ["ZIP 90803", "ZIP 90815"])
+    assert [trace.name for trace in fig.data if trace.visible] == ["ZIP 90803", "ZIP 90815"]
+    app.show_zip_traces(fig, [])
+    assert not any(trace.visible for trace in fig.data)
+    assert fig.layout.title.text == "Please select at least one ZIP code."
+
+
+def test_zip_cube():
+    cube = app.ZipCube.from_frame(app.DATASETS.get("zip_gender_age"))
+    assert cube.values.shape == (11, 8, 23, 3)
+    # Every ZIP's age groups add up to its total in the ZIP-by-year sheet.
+    totals = app.DATASETS.get("zip_trends").pivot(index="ZIP Code", columns="Year", values="Population")
+    totals = totals.reindex(index=cube.zips, columns=cube.years)
+    np.testing.assert_array_equal(np.nansum(cube.sel(gender="Total"), axis=2), totals.to_numpy(dtype=float))
+    np.testing.assert_array_equal(cube.sel(gender="Male") + cube.sel(gender="Female"), cube.sel(gender="Total"))
+
+
+def test_zip_cube_sel_returns_views():
+    cube = app.ZipCube.from_frame(app.DATASETS.get("zip_gender_age"))
+    for key in ({"year": 2023}, {"gender": "Total"}, {"zip_code": "ZIP 90802", "year": 2020}):
+        assert np.shares_memory(cube.sel(**key), cube.values)
+    assert cube.sel(year=2023, gender="Female").shape == (11, 23)
+    d = cube.age_frame(2023, "Female")
+    assert d["Population"].sum() == np.nansum(cube.sel(year=2023, gender="Female"))
+
+
+def test_import_defers_heavy_modules():
+    # A fresh interpreter: this one has imported them already.
+    script = (
+        "import sys, app; "
+        "print([m for m in ('numpy', 'pandas', 'plotly.express', 'openpyxl', 'pyarrow') if m in sys.modules])"
+    )
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    assert out.strip().splitlines()[-1] == "[]"
+
+
+def test_kpi_totals():
+    k = app.AGGREGATES.get("summary_kpis")
+    assert (k["total"], k["male"], k["female"]) == (458491, 226934, 231557)
+    assert k["male"] + k["female"] == k["total"]
+    assert (k["largest_age_group"], k["largest_age_group_population"]) == ("20-44", 174952)
+    assert app.AGGREGATES.get("summary_kpis") is k
+    assert app.summary_kpis(app.DATASETS.get("pyramid_2023").iloc[:0]) is None
+
+
+def test_registry_loads_workbooks_on_its_pool():
+    names = {name for name in app.DATASETS.names() if app.DATASETS.source(name)[0] == app.LB2023_XLSX}
+    future = app.DATASETS.submit(app.LB2023_XLSX)
+    assert set(future.result(timeout=60)) == names
+    for name, d in future.result().items():
+        assert d is app.DATASETS.get(name)
+
+
+def test_data_pack_is_current(tmp_path, workbook_copy, monkeypatch):
+    registry, path = workbook_copy
+    pack = str(tmp_path / "pack")
+    assert not app.data_pack_is_current(registry, pack)
+    app.build_data_pack(registry, pack)
+    assert app.data_pack_is_current(registry, pack)
+    assert app._read_manifest(pack)["version"] == 1
+    assert app.build_data_pack(registry, pack)["version"] == 2
+
+    monkeypatch.setattr(app, "DATA_PACK_FORMAT", app.DATA_PACK_FORMAT + 1)
+    assert not app.data_pack_is_current(registry, pack)
+    monkeypatch.undo()
+    with open(path, "ab") as fh:
+        fh.write(b"\0")
+    assert not app.data_pack_is_current(registry, pack)
+
+
+def _wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_shared_store(tmp_path):
+    # Two stores on one directory, as in two worker processes: the first
+    # takes the lock and builds the pack, the second only maps it.
+    source = tmp_path / "source.txt"
+    source.write_text("1")
+
+    def loader():
+        return pd.DataFrame({"Year": [2023], "Total": [int(source.read_text())]})
+
+    registry = app.DatasetRegistry()
+    registry.register("trend", str(source), loader)
+    directory = str(tmp_path / "store")
+    writer = app.SharedStore(directory, interval=0.05)
+    writer.start_writer(registry)
+    try:
+        reader = app.SharedStore(directory)
+        d = reader.read("trend", timeout=30)
+        assert d["Total"].tolist() == [1]
+        version = reader.version(str(source))
+        assert version == app._file_sha256(str(source))
+
+        # The writer rebuilds when the source changes and readers follow.
+        source.write_text("2")
+        _wait_for(lambda: reader.version(str(source)) != version)
+        assert reader.read("trend")["Total"].tolist() == [2]
+        assert reader.read("missing", timeout=0) is None
+    finally:
+        writer.stop(timeout=10)
+    assert not writer._thread.is_alive()
+
+
+@pytest.mark.parametrize(
+    "name, rows",
+    [("race_2023", 1), ("race_trends", 7), ("race_gender_dist", 2)],
+)
+def test_filter_by_race(name, rows):
+    # "hispanic" matches "Hispanic or Latino" in the 2023 sheet too.
+    d = app.filter_dataset(app.DATASETS.get(name), [("race", (app._api_key("race", "hispanic"),))])
+    assert len(d) == rows
+    assert {app.race_key(v) for v in d["Race/Ethnicity"].astype(str)} == {"Hispanic"}
+
+
+def test_filter_by_zip_and_year():
+    filters = [("year", ("2020", "2023")), ("zip", (app._api_key("zip", "ZIP 90802"),))]
+    d = app.filter_dataset(app.DATASETS.get("zip_trends"), filters)
+    assert sorted(d["Year"]) == [2020, 2023]
+
+
+def _get(dataset, query=b"", headers=()):
+    from starlette.requests import Request
+
+    request = Request({
+        "type": "http",
+        "method": "GET",
+        "path": f"/api/{dataset}",
+        "query_string": query,
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+        "path_params": {"dataset": dataset},
+    })
+    return asyncio.run(app.api_dataset(request))
+
+
+def test_api_rows_and_etag():
+    response = _get("race_trends", b"race=hispanic,White")
+    assert response.status_code == 200
+    rows = json.loads(response.body)
+    assert len(rows) == 14
+    assert {row["Race/Ethnicity"] for row in rows} == {"Hispanic", "White"}
+
+    etag = response.headers["etag"]
+    again = _get("race_trends", b"race=white&race=HISPANIC", [("if-none-match", etag)])
+    assert again.status_code == 304
+    assert again.body == b""
+
+    csv = _get("race_trends.csv", b"race=hispanic", [("accept-encoding", "gzip")])
+    assert csv.headers["content-encoding"] == "gzip"
+    assert csv.headers["etag"] != etag
+
+
+def test_api_errors():
+    assert _get("nope").status_code == 404
+    assert _get("race_trends.xml").status_code == 404
+    assert _get("trend", b"race=hispanic").status_code == 400
+    assert _get("trend", b"year=2020,next").status_code == 400
+    # Parameters that are not filters are ignored.
+    assert _get("trend", b"year=2020&colour=red").body == _get("trend", b"year=2020").body
+
+
+def test_http_app_mounts_shiny_last():
+    from starlette.routing import Mount
+
+    routes = app.app.routes
+    assert [r.path for r in routes[:-1]] == [r.path for r in app.http_routes()]
+    assert isinstance(routes[-1], Mount) and routes[-1].app is app.shiny_app
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(app, "EXPORT_CHUNK_ROWS", 50)
+
+
+def test_export_csv(small_chunks):
+    filters = {"Gender": {"Female"}, "Year": {2020}}
+    chunks = list(app.iter_export("zip_gender_age", filters, "csv"))
+    assert len(chunks) > 2
+    d = pd.read_csv(io.StringIO("".join(chunks)))
+    full = app.DATASETS.get("zip_gender_age")
+    expected = full[(full["Gender"] == "Female") & (full["Year"] == 2020)]
+    assert list(d.columns) == list(full.columns)
+    assert len(d) == len(expected) == 253
+    assert d["Population"].sum() == expected["Population"].sum()
+
+
+def test_export_xlsx(small_chunks):
+    body = b"".join(app.iter_export("zip_trends", {"ZIP Code": {"ZIP 90802"}}, "xlsx"))
+    d = pd.read_excel(io.BytesIO(body))
+    full = app.DATASETS.get("zip_trends")
+    expected = full[full["ZIP Code"] == "ZIP 90802"]
+    assert len(d) == len(expected) == 8
+    assert list(d.columns) == list(full.columns)
+    assert d["Population"].tolist() == expected["Population"].tolist()
+
+
+def test_metrics_route():
+    from starlette.requests import Request
+
+    @app.instrument("calc", name="test_calc")
+    def calc(x):
+        return x * 2
+
+    @app.instrument("download")
+    async def download():
+        for chunk in ("a", "b"):
+            yield chunk
+
+    async def drain():
+        return [chunk async for chunk in download()]
+
+    assert calc(2) == 4 and calc(3) == 6
+    assert asyncio.run(drain()) == ["a", "b"]
+    assert download.__name__ == "download"
+
+    request = Request({"type": "http", "method": "GET", "path": "/metrics", "query_string": b"", "headers": []})
+    response = asyncio.run(app.metrics(request))
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.body.decode().splitlines()
+    assert "# TYPE lbdhhs_calls_total counter" in lines
+    assert 'lbdhhs_calls_total{kind="calc",name="test_calc",outcome="ok"} 2' in lines
+    assert 'lbdhhs_duration_seconds_count{kind="calc",name="test_calc"} 2' in lines
+    assert 'lbdhhs_duration_seconds_count{kind="download",name="download"} 1' in lines
+    assert any(line.startswith('lbdhhs_cache_events_total{cache="datasets"') for line in lines)
+
+
+def test_tidy():
+    df = pd.DataFrame({
+        "ZIP Code": ["ZIP 90999", "ZIP 90803", "ZIP 90802"],
+        "Gender": ["Female", "Male", "Female"],
+        "Age Group": ["20-44", "0-19", "20-44"],
+        "Year": [2023.0, 2023.0, 2022.0],
+        "Population": [3.0, 2.0, 1.0],
+    }, index=[7, 8, 9])
+    d = app.tidy(df, **{"Age Group": ["0-19", "20-44"]})
+    assert d.index.tolist() == [0, 1, 2]
+    assert d["Year"].dtype == "int16"
+    assert d["Population"].dtype == "int32"
+    for col in ("ZIP Code", "Gender", "Age Group"):
+        assert d[col].cat.ordered
+    # Known ZIPs keep their order and unknown ones go after them.
+    zips = d["ZIP Code"].cat.categories.tolist()
+    assert zips[: len(app.ZIP_CODES_LABEL)] == list(app.ZIP_CODES_LABEL)
+    assert zips[-1] == "ZIP 90999"
+    assert d["Gender"].cat.categories.tolist()[:2] == ["Male", "Female"]
+    assert d["Age Group"].cat.categories.tolist() == ["0-19", "20-44"]
+
+
+def test_datasets_use_the_schema():
+    for name in app.DATASETS.names():
+        d = app.DATASETS.get(name)
+        assert len(d), name
+        for col in d.columns:
+            if col == "Year":
+                assert d[col].dtype == "int16", name
+            elif col in app.COUNT_COLUMNS:
+                assert str(d[col].dtype) in ("int32", "Int32"), name
+            else:
+                assert isinstance(d[col].dtype, pd.CategoricalDtype), (name, col)
+
+
+def test_cubes_keep_one_cube_per_version():
+    cube = app.CUBES.get("zip_gender_age")
+    assert app.CUBES.get("zip_gender_age") is cube
+    assert cube.values.shape == (11, 8, 23, 3)
+
+
+def _values(value):
+    # A data array read back from JSON: typed arrays stay {"dtype", "bdata"}.
+    if isinstance(value, dict) and "bdata" in value:
+        return np.frombuffer(base64.b64decode(value["bdata"]), dtype=value["dtype"])
+    return value
+
+
+@pytest.mark.parametrize(
+    "build, dataset",
+    [
+        (app.figure_pop_trend, "trend"),
+        (app.figure_race_pie, "race_2023"),
+        (app.figure_zip_bar, "zip_2023"),
+        (app.figure_population_pyramid, "pyramid_2023"),
+        (app.figure_race_pop_trends, "race_trends"),
+    ],
+)
+def test_slim_figure_round_trip(build, dataset):
+    fig = build(app.DATASETS.get(dataset))
+    spec = json.loads(fig.to_json())
+    slim = app.slim_figure(json.loads(fig.to_json()))
+    assert len(json.dumps(slim)) < len(json.dumps(spec))
+    # plotly accepts the slimmed spec and it holds the same data.
+    again = go.Figure(slim)
+    assert len(again.data) == len(fig.data)
+    for before, after in zip(fig.data, again.data):
+        assert after.type == before.type
+        for key in ("x", "y", "labels", "values"):
+            if key in before and before[key] is not None:
+                np.testing.assert_array_equal(_values(after[key]), _values(before[key]))
+
+
+@pytest.mark.parametrize("name", [n for n in app.DATASETS.names() if n != "zip_gender_age"])
+def test_rollup_totals_match_groupby(name):
+    d = app.DATASETS.get(name)
+    rollup = app.ROLLUPS.get(name)
+    count = next(col for col in app.COUNT_COLUMNS if col in d.columns)
+    # Totals add magnitudes, so the pyramid's negative Male counts add up.
+    magnitude = d[count].abs()
+    assert rollup.lookup([])[1] == magnitude.sum()
+    for col in rollup.dims:
+        axes, values = rollup.lookup([col])
+        expected = magnitude.groupby(d[col], observed=False).sum(min_count=1)
+        np.testing.assert_array_equal(values, expected.reindex(axes[0]).to_numpy(dtype=float))
+
+
+def test_pyramid_rollup_totals():
+    rollup = app.ROLLUPS.get("pyramid_2023")
+    assert rollup.lookup([])[1] == 458491
+    (genders,), values = rollup.lookup(["Gender"])
+    assert dict(zip(genders, values[:2])) == {"Male": 226934, "Female": 231557}
+    # Counts grouped by Gender keep their sign for the chart.
+    _, values = rollup.lookup(["Gender", "Age Group"], {"Gender": ["Male"]})
+    assert (values <= 0).all()
+
+
+def test_rollup_uses_total_rows():
+    d = app.DATASETS.get("zip_gender_age")
+    (years,), values = app.ROLLUPS.get("zip_gender_age").lookup(["Year"])
+    totals = d[d["Gender"] == "Total"].groupby("Year")["Population"].sum()
+    np.testing.assert_array_equal(values, totals.reindex(years).to_numpy(dtype=float))
+
+
+def test_update_cross_filter():
+    race = {"Race/Ethnicity": frozenset({"Asian"})}
+    selection = app.update_cross_filter({}, "summary_race_pie", race)
+    assert selection == {"Race/Ethnicity": (frozenset({"Asian"}), "summary_race_pie")}
+    # Picking in another chart adds to the filter; the same pick again clears it.
+    gender = {"Gender": frozenset({"Female"})}
+    selection = app.update_cross_filter(selection, "race_gender_dist", gender)
+    assert set(selection) == {"Race/Ethnicity", "Gender"}
+    assert app.update_cross_filter(selection, "race_gender_dist", gender) == {
+        "Race/Ethnicity": (frozenset({"Asian"}), "summary_race_pie")
+    }
+    assert app.describe_cross_filter(selection) == "Race/Ethnicity: Asian; Gender: Female"
+
+
+def _square(x0, y0, x1, y1, steps=10):
+    """A closed ring around the box, with `steps` points along each side."""
+    t = np.linspace(0, 1, steps, endpoint=False)
+    sides = [
+        np.column_stack([x0 + (x1 - x0) * t, np.full_like(t, y0)]),
+        np.column_stack([np.full_like(t, x1), y0 + (y1 - y0) * t]),
+        np.column_stack([x1 - (x1 - x0) * t, np.full_like(t, y1)]),
+        np.column_stack([np.full_like(t, x0), y1 - (y1 - y0) * t]),
+    ]
+    ring = np.concatenate(sides)
+    return np.vstack([ring, ring[:1]])
+
+
+def _distance_to_ring(points, ring):
+    # Distance from each point to the nearest segment of `ring`.
+    a, b = ring[:-1], ring[1:]
+    ab = b - a
+    t = np.clip(((points[:, None] - a) * ab).sum(axis=2) / (ab ** 2).sum(axis=1), 0, 1)
+    nearest = a + t[..., None] * ab
+    return np.hypot(*(points[:, None] - nearest).transpose(2, 0, 1)).min(axis=1)
+
+
+def test_simplify_ring():
+    import tracts
+
+    ring = _square(0, 0, 1, 1)
+    # A wobble smaller than the tolerance on the bottom side.
+    ring[3, 1] = 0.0004
+    simple = tracts.simplify_ring(ring, 0.001)
+    assert len(simple) == 5
+    np.testing.assert_array_equal(simple[0], simple[-1])
+    np.testing.assert_array_equal(simple[0], ring[0])
+    assert _distance_to_ring(ring, simple).max() <= 0.001
+    # A tolerance below the wobble keeps it.
+    assert len(tracts.simplify_ring(ring, 0.0001)) > 5
+    # Too few points to simplify: returned as is.
+    triangle = np.array([[0, 0], [1, 0], [0, 1], [0, 0]], dtype=float)
+    assert tracts.simplify_ring(triangle, 10) is triangle
+
+
+def test_outline_is_geojson():
+    import tracts
+
+    polygons = tracts.polygons_of({"type": "Polygon", "coordinates": [_square(-118.2, 33.7, -118.1, 33.8).tolist()]})
+    outline = tracts.outline(polygons, 0.0005)
+    assert outline["type"] == "MultiPolygon"
+    assert outline["coordinates"] == [[[[-118.2, 33.7], [-118.1, 33.7], [-118.1, 33.8], [-118.2, 33.8], [-118.2, 33.7]]]]
+    assert tracts.polygons_of({"type": "Point", "coordinates": [0, 0]}) == []
+
+
+def test_zip_index():
+    import tracts
+
+    def box(*bounds):
+        return [[_square(*bounds, steps=2)]]
+
+    zips = {"ZIP 90802": box(0, 0, 1, 1), "ZIP 90803": box(1, 0, 2, 1), "ZIP 90999": box(5, 5, 6, 6)}
+    index = tracts.zip_index(
+        {"inside": box(0.2, 0.2, 0.4, 0.4), "across": box(0.25, 0.2, 1.25, 0.4), "outside": box(3, 3, 4, 4)},
+        zips,
+    )
+    assert index["inside"] == [["ZIP 90802", 1.0]]
+    # Three quarters of "across" lie in 90802; largest share first.
+    (first, a), (second, b) = index["across"]
+    assert (first, second) == ("ZIP 90802", "ZIP 90803")
+    assert abs(a - 0.75) < 0.05 and abs(b - 0.25) < 0.05
+    assert index["outside"] == []
+    # A known point falls in exactly one ZIP.
+    point = np.array([[1.25, 0.5]])
+    assert [label for label, polygons in zips.items() if tracts.contains(polygons, point)[0]] == ["ZIP 90803"]
+
+
+def test_year_tables():
+    anchors = app.sheet_anchors(app.RACE_BY_YEAR_XLSX, app.RACE_BY_YEAR_SHEET)
+    tables = anchors.year_tables()
+    assert [t.title for t in tables[:5]] == ["HISPANIC/LATINO", "WHITE", "ASIAN", "BLACK", "MULTIRACIAL"]
+    assert [t.title for t in tables[5:]] == ["AGE ADJUSTED AGE GROUPS"] * 5
+    assert tables[0].years.tolist() == list(range(2017, 2024))
+    assert tables[4].years.tolist() == list(range(2017, 2023))
+    # Titles match like anchors do, whatever the case and spacing.
+    assert anchors.year_table(" hispanic/latino ") is tables[0]
+    assert anchors.year_table("age adjusted age groups") is tables[5]
+    with pytest.raises(KeyError):
+        anchors.year_table("MULTIRACIAL", first="0-4")
+
+
+def test_year_tables_skip_counts_that_look_like_years():
+    nan = float("nan")
+    grid = pd.DataFrame([
+        ["Ages", 2022, 2023],
+        ["0-19", 2015, 2016],
+        ["20-44", 900, 950],
+        [nan, nan, nan],
+        ["Codes", 2022, 2023],
+        [90802, 5, 6],
+    ])
+    tables = app.AnchorIndex(grid).year_tables()
+    # The "0-19" row runs 2015, 2016 under a header; "Codes" has no text labels.
+    assert [(t.title, t.row) for t in tables] == [("Ages", 0)]
+    assert tables[0].labels == ["0-19", "20-44"]
+    np.testing.assert_array_equal(tables[0].values, [[2015, 2016], [900, 950]])
+
+
+def test_year_table_frame():
+    table = app.sheet_anchors(app.RACE_BY_YEAR_XLSX, app.RACE_BY_YEAR_SHEET).year_table("HISPANIC/LATINO")
+    assert table.labels[0] == "Total:"
+    d = table.frame(rows=[0], **{"Race/Ethnicity": "Hispanic"})
+    assert list(d.columns) == ["Race/Ethnicity", "Year", "Population"]
+    assert d["Year"].tolist() == list(range(2017, 2024))
+    trends = app.DATASETS.get("race_trends")
+    hispanic = trends[trends["Race/Ethnicity"] == "Hispanic"].sort_values("Year")
+    assert d["Population"].tolist() == hispanic["Population"].tolist()
+
+    # One label per table row, repeated for each year.
+    d = table.frame(rows=[1, 2], **{"Label": table.labels})
+    assert d["Label"].tolist() == [table.labels[1]] * 7 + [table.labels[2]] * 7
+
+
+def test_year_table_header_labels():
+    # "LB 2023" style headers, newest year first in the sheet. Of the two
+    # "Age Cat1" tables, age_trends reads the one starting with "<20".
+    anchors = app.sheet_anchors(app.LB2023_XLSX, app.LB2023_SHEET)
+    table = anchors.year_table("Age Cat1", first=app.AGE_TRENDS_FIRST_BAND)
+    assert table is not anchors.year_table("Age Cat1")
+    assert table.years.tolist() == list(range(2019, 2024))
+    assert table.labels == app.DATASETS.get("age_trends")["Age Group"].cat.categories.tolist()
+
+
+def _counts(name):
+    d = app.DATASETS.get(name)
+    group = next(col for col in d.columns if col not in ("Year", *app.COUNT_COLUMNS))
+    return d.pivot(index=group, columns="Year", values="Population")
+
+
+@pytest.mark.parametrize("name", ["race_trends", "age_trends", "zip_trends"])
+def test_trend_measures(name):
+    m = app.MEASURES.get(name)
+    counts = _counts(name).reindex(index=m.groups, columns=m.years).to_numpy(dtype=float)
+    values = m.values
+    np.testing.assert_array_equal(values["absolute"], counts)
+    np.testing.assert_allclose(values["change"][:, 1:], np.diff(counts, axis=1))
+    assert np.isnan(values["change"][:, 0]).all()
+    np.testing.assert_allclose(values["pct_change"][:, 1:], np.diff(counts, axis=1) / counts[:, :-1] * 100)
+    # Over the groups with a count, shares add up to 100 and the index
+    # averages 100, every year.
+    np.testing.assert_allclose(np.nansum(values["share"], axis=0), 100)
+    np.testing.assert_allclose(np.nanmean(values["index"], axis=0), 100)
+
+
+def test_trend_measures_cagr():
+    m = app.MEASURES.get("race_trends")
+    counts = _counts("race_trends")
+    i = m.groups.get_loc("Hispanic")
+    assert (m.first_year[i], m.last_year[i]) == (2017, 2023)
+    expected = (counts.loc["Hispanic", 2023] / counts.loc["Hispanic", 2017]) ** (1 / 6) - 1
+    assert m.cagr[i] == pytest.approx(expected)
+    # Multiracial has no 2023 count, so its growth runs to 2022.
+    i = m.groups.get_loc("Multiracial")
+    assert (m.first_year[i], m.last_year[i]) == (2017, 2022)
+    expected = (counts.loc["Multiracial", 2022] / counts.loc["Multiracial", 2017]) ** (1 / 5) - 1
+    assert m.cagr[i] == pytest.approx(expected)
+    assert "a year" in m.hovertemplate("share", "Multiracial")
+
+
+def test_show_trend_measure():
+    d = app.DATASETS.get("race_trends")
+    fig = app.figure_race_pop_trends(d)
+    m = app.MEASURES.get("race_trends")
+    app.show_trend_measure(fig, m, "share")
+    assert fig.layout.yaxis.ticksuffix == "%"
+    for trace in fig.data:
+        years = app._axis_labels(trace)
+        np.testing.assert_array_equal(app._decode_array(trace.y), m.series("share", trace.name, years))
+    app.show_trend_measure(fig, m, "absolute")
+    assert fig.layout.yaxis.ticksuffix is None
+
+
+def test_export_adds_the_measure(small_chunks):
+    filters = {"Race/Ethnicity": {"Hispanic"}}
+    d = pd.read_csv(io.StringIO("".join(app.iter_export("race_trends", filters, "csv", "share"))))
+    m = app.MEASURES.get("race_trends")
+    title = app.TREND_MEASURES["share"][1]
+    assert list(d.columns) == [*app.DATASETS.get("race_trends").columns, title]
+    np.testing.assert_allclose(d[title], m.series("share", "Hispanic", d["Year"]))
+    plain = pd.read_csv(io.StringIO("".join(app.iter_export("race_trends", filters, "csv", "absolute"))))
+    assert title not in plain.columns
+
+
+def test_kpi_texts():
+    texts = app.kpi_texts(app.AGGREGATES.get("summary_kpis"))
+    assert texts == {
+        "total": "458,491",
+        "male": "226,934",
+        "female": "231,557",
+        "largest_age_group": "20-44 (174,952)",
+    }
+    assert set(app.kpi_texts(None).values()) == {"—"}
+
+
+def test_build_static(tmp_path):
+    filename = app.build_static(tmp_path)
+    page = open(filename, encoding="utf-8").read()
+    assert filename == os.path.join(tmp_path, app.STATIC_PAGE)
+    # The page's script and style are inlined from STATIC_ASSETS.
+    assert 'document.getElementById("dashboard-data")' in page
+    assert ".tab-pane.active" in page
+    assert "458,491" in page
+    for tab, *_ in app.STATIC_TABS:
+        assert f'id="tab-{tab}"' in page
+    start = page.index('<script type="application/json" id="dashboard-data">')
+    start = page.index(">", start) + 1
+    data = json.loads(page[start:page.index("</script>", start)])
+    assert set(data["figures"]) == set(app.STATIC_FIGURES)
+    assert set(data["views"]) == set(app.STATIC_INPUTS)
+    for chart_id, measures in app.CHART_MEASURES.items():
+        assert set(data["views"][chart_id]["views"]) == set(measures)
+    years = app.static_zip_years()
+    assert len(data["views"]["geo_zip_age_dist"]["views"]) == len(years) * len(app.ZipCube.GENDERS)
+    visible = [t["name"] for t in data["figures"]["geo_zip_trends"]["data"] if t["visible"]]
+    assert visible == app.DEFAULT_ZIPS
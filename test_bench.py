@@ -0,0 +1,28 @@
+# test_bench.py
+# Checks for bench.py's report handling (the benchmarks themselves are
+# not run here).
+
+import json
+
+import bench
+
+
+def report(path, commit, **rows):
+    results = {"loaders": {name: {"wall_s": wall, "cpu_s": wall, "peak_bytes": 0} for name, wall in rows.items()}}
+    path.write_text(json.dumps({"commit": commit, "results": results}))
+    return str(path)
+
+
+def test_diff_counts_regressions(tmp_path, capsys):
+    old = report(tmp_path / "old.json", "aaa", load_a=1.0, load_b=1.0, load_c=1.0)
+    new = report(tmp_path / "new.json", "bbb", load_a=1.1, load_b=1.5, load_c=0.5, load_d=2.0)
+    # Only load_b is more than REGRESSION_RATIO slower; load_d is new.
+    assert bench.bench_diff(old, new) == 1
+    out = capsys.readouterr().out
+    assert "aaa -> bbb" in out
+    assert out.count("<-- slower") == 1
+
+
+def test_compare():
+    assert bench.compare(2.0, 1.0, "faster", "slower") == "x2.0 faster"
+    assert bench.compare(1.0, 1.3, "lower", "higher") == "x1.3 higher"
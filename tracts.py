@@ -0,0 +1,122 @@
+# tracts.py
+# Census tract geometry for `python -m app build-tracts`: outline
+# simplification and the tract-to-ZIP index. Plain numpy on GeoJSON
+# coordinates (longitude, latitude), so no GIS libraries are needed.
+
+import json
+
+import numpy as np
+
+# Sample points per tract for the tract-to-ZIP index.
+ZIP_SAMPLES = 32 * 32
+
+
+def simplify_ring(ring, tolerance):
+    """
+    Douglas-Peucker simplification of a closed ring (n x 2 array whose last
+    point repeats the first). Rings that would collapse below a triangle
+    are returned as they are.
+    """
+    # Split the ring at the point farthest from its start so that both
+    # halves are open polylines.
+    far = int(np.argmax(((ring - ring[0]) ** 2).sum(axis=1)))
+    if far == 0 or len(ring) <= 4:
+        return ring
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[[0, far, len(ring) - 1]] = True
+    stack = [(0, far), (far, len(ring) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        seg = ring[end] - ring[start]
+        rel = ring[start + 1 : end] - ring[start]
+        length = np.hypot(*seg)
+        if length:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / length
+        else:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack += [(start, mid), (mid, end)]
+    return ring[keep] if keep.sum() >= 4 else ring
+
+
+def polygons_of(geometry):
+    """A GeoJSON Polygon or MultiPolygon as [[ring array, ...], ...]."""
+    if geometry["type"] == "Polygon":
+        parts = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        parts = geometry["coordinates"]
+    else:
+        return []
+    return [[np.asarray(ring, dtype=float)[:, :2] for ring in polygon] for polygon in parts]
+
+
+def outline(polygons, tolerance):
+    """`polygons` simplified to `tolerance`, as a GeoJSON MultiPolygon."""
+    digits = max(0, int(np.ceil(-np.log10(tolerance))) + 1)
+    return {
+        "type": "MultiPolygon",
+        "coordinates": [
+            [np.round(simplify_ring(ring, tolerance), digits).tolist() for ring in polygon]
+            for polygon in polygons
+        ],
+    }
+
+
+def contains(polygons, points):
+    """Even-odd test of `points` (n x 2) against every ring of `polygons`."""
+    inside = np.zeros(len(points), dtype=bool)
+    x, y = points[:, 0:1], points[:, 1:2]
+    for polygon in polygons:
+        for ring in polygon:
+            x0, y0, x1, y1 = ring[:-1, 0], ring[:-1, 1], ring[1:, 0], ring[1:, 1]
+            crosses = (y0 > y) != (y1 > y)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                xs = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= ((crosses & (x < xs)).sum(axis=1) % 2).astype(bool)
+    return inside
+
+
+def bounds(polygons):
+    points = np.concatenate([ring for polygon in polygons for ring in polygon])
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+def zip_index(tracts, zips, samples=ZIP_SAMPLES):
+    """
+    {tract: [[ZIP label, share of the tract's area], ...]}, largest share
+    first, estimated from a grid of points over each tract. `tracts` and
+    `zips` map labels to polygons_of().
+    """
+    zip_bounds = {label: bounds(polygons) for label, polygons in zips.items()}
+    side = int(np.sqrt(samples))
+    index = {}
+    for tract, polygons in tracts.items():
+        x0, y0, x1, y1 = bounds(polygons)
+        gx, gy = np.meshgrid(np.linspace(x0, x1, side + 2)[1:-1], np.linspace(y0, y1, side + 2)[1:-1])
+        points = np.column_stack([gx.ravel(), gy.ravel()])
+        points = points[contains(polygons, points)]
+        shares = []
+        for label, (zx0, zy0, zx1, zy1) in zip_bounds.items():
+            if len(points) and zx0 <= x1 and x0 <= zx1 and zy0 <= y1 and y0 <= zy1:
+                share = contains(zips[label], points).mean()
+                if share >= 0.01:
+                    shares.append([label, round(float(share), 3)])
+        index[tract] = sorted(shares, key=lambda s: -s[1])
+    return index
+
+
+def read_features(path, label):
+    """{label(properties): polygons_of()} for every feature of a GeoJSON file that `label` names."""
+    with open(path) as fh:
+        features = json.load(fh)["features"]
+    out = {}
+    for feature in features:
+        name = label(feature.get("properties") or {})
+        if name is not None and feature.get("geometry"):
+            out.setdefault(name, []).extend(polygons_of(feature["geometry"]))
+    return out